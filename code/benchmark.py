@@ -1,9 +1,15 @@
 import os
 import time
 import threading
+from array import array
 import psutil
 import functools
 import gc
+import itertools
+import json
+import resource
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 import matplotlib
 matplotlib.use('Agg')  # Set backend to non-interactive
 import matplotlib.pyplot as plt
@@ -12,7 +18,29 @@ from datetime import datetime
 from colorama import Fore
 import pyRAPL.pyRAPL
 
-STEP_SECOND = 0.1  # Sampling interval in seconds
+STEP_SECOND = 0.01  # Sampling interval in seconds
+SAMPLER_CAPACITY = 2**16  # Samples kept per metric, the oldest are overwritten beyond
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100  # Unit of the CPU times of /proc/*/stat
+RUSAGE_THREAD = getattr(resource, 'RUSAGE_THREAD', None)  # Linux only
+PHASE_LABELS = {'encrypt': 'Encryption', 'operation': 'Operation', 'decrypt': 'Decryption'}
+METRICS_STORE = "results_profile/metrics"  # Time series of every run (.npz) and their index (index.jsonl)
+METRICS_INDEX = "index.jsonl"
+# Graphs rendered from the stored columns: column, name, color, run graph and title, aggregated graph and title
+METRIC_GRAPHS = [
+    ("cpu", "CPU Busy Percentage", 'tab:red', "graph_cpu.png", "Process CPU Busy Percentage Over Time", "graph_avg_cpu.png", "Average CPU Busy Percentage Over % Time"),
+    ("memory", "Memory Usage (bytes)", 'tab:blue', "graph_ram.png", "Memory Usage Over Time", "graph_avg_ram.png", "Average Memory Usage Over % Time"),
+    ("net_sent", "Network Bytes Sent", 'tab:pink', "graph_network_sent.png", "Network Bytes Sent Over Time", "graph_avg_network_sent.png", "Average Network Bytes Sent Over % Time"),
+    ("net_received", "Network Bytes Received", 'tab:purple', "graph_network_received.png", "Network Bytes Received Over Time", "graph_avg_network_received.png", "Average Network Bytes Received Over % Time"),
+    ("disk_read", "Disk Read (bytes)", 'tab:gray', "graph_disk_read.png", "Disk Read Bytes Over Time", "graph_avg_disk_read.png", "Average Disk Read Bytes Over % Time"),
+    ("disk_write", "Disk Write (bytes)", 'tab:brown', "graph_disk_write.png", "Disk Write Bytes Over Time", "graph_avg_disk_write.png", "Average Disk Write Bytes Over % Time"),
+    ("battery", "Battery Consumption (Joules)", 'tab:orange', "graph_battery.png", "Battery Consumption Over Time", "graph_avg_battery.png", "Average Battery Consumption Over % Time"),
+]
+pending_plots = []  # Folders of the runs profiled by this process whose graphs are not rendered yet
+CONFIDENCE_LEVEL = 0.95    # Confidence level of the bootstrap intervals
+BOOTSTRAP_RESAMPLES = 2000  # Resamples of the bootstrap
+MAD_THRESHOLD = 3.5        # Modified z-score above which a run is an outlier
+ADAPTIVE_MIN_RUNS = 5      # Runs measured before an adaptive sweep may stop
+OUTLIER_MIN_RUNS = 5       # Fewer runs are too few to tell an outlier apart
 NUM_POINTS = 20    # Number of points for interpolation
 PLOT_PRINT = False  # Set to True to show plots
 BATTERY = False     # Set to True to enable battery monitoring
@@ -22,6 +50,10 @@ if BATTERY:
 current_network_bytes_sent = 0     # Global variable for network bytes sent
 current_network_bytes_received = 0   # Global variable for network bytes received
 current_network_latency = 0         # Global variable for network latency
+current_compression_raw_bytes = 0   # Bytes of the messages before compression, sent and received
+current_compression_wire_bytes = 0  # Bytes of the same messages on the wire
+current_compression_time = 0        # CPU time spent compressing, in seconds
+current_decompression_time = 0      # CPU time spent decompressing, in seconds
 
 # Global variables for phase timestamps
 encrypt_start_time = 0     # Start time of encryption phase
@@ -30,9 +62,16 @@ operation_start_time = 0   # Start time of operation phase
 operation_end_time = 0     # End time of operation phase
 decrypt_start_time = 0     # Start time of decryption phase
 decrypt_end_time = 0       # End time of decryption phase
+phase_details = {}         # Extra values logged under a phase duration, e.g. {'encrypt': {'Label': value}}
+phase_spans = []           # Spans of the streamed chunks, e.g. [('encrypt', start_time, end_time)]
+PHASE_COLORS = {'encrypt': 'red', 'operation': 'green', 'decrypt': 'purple'}
 
 current_run = 0
 
+def record_phase_span(phase, start_time, end_time):
+    """Record the span of one chunk of a phase, drawn over the graphs of the run"""
+    phase_spans.append((phase, start_time, end_time))
+
 # --- Metrics Classes ---
 
 class MetricsRun:
@@ -106,7 +145,7 @@ class MetricsAggregated:
     
     def get_average_series(self):
         # If each run has exactly one measurement, use the run index for x-axis.
-        if all(len(run.times) == 1 for run in self.runs if run.times):
+        if all(len(run.times) == 1 for run in self.runs if len(run.times)):
             x_data = np.arange(1, len(self.runs) + 1)
             y_data = np.array([run.values[0] for run in self.runs])
             return x_data, y_data
@@ -114,7 +153,7 @@ class MetricsAggregated:
         x_perc = np.linspace(0, 100, num=NUM_POINTS)
         series_list = []
         for run in self.runs:
-            if run.times and run.times[-1] > 0:
+            if len(run.times) and run.times[-1] > 0:
                 times = np.array(run.times)
                 norm_time = (times / times[-1]) * 100  # Normalize to percentage scale
                 interp_values = np.interp(x_perc, norm_time, run.values)
@@ -140,6 +179,7 @@ class PhaseMetrics:
         self.decrypt_start = 0
         self.decrypt_end = 0
         self.total_duration = 0
+        self.spans = []
 
     def update_from_globals(self, run_start_time, run_end_time):
         global encrypt_start_time, encrypt_end_time, operation_start_time, operation_end_time, decrypt_start_time, decrypt_end_time
@@ -152,6 +192,7 @@ class PhaseMetrics:
         self.decrypt_start = decrypt_start_time - run_start_time if decrypt_start_time != 0 else 0
         self.decrypt_end = decrypt_end_time - run_start_time if decrypt_end_time != 0 else 0
         self.total_duration = run_end_time - run_start_time
+        self.spans = [(phase, start - run_start_time, end - run_start_time) for phase, start, end in phase_spans]
         
         if self.encrypt_start != 0 and self.encrypt_end != 0:
             self.encrypt_duration = self.encrypt_end - self.encrypt_start
@@ -180,6 +221,10 @@ class PhaseMetrics:
             result.decrypt_start = (self.decrypt_start / self.total_duration) * 100
         if self.decrypt_end != 0:
             result.decrypt_end = (self.decrypt_end / self.total_duration) * 100
+        result.spans = [
+            (phase, (start / self.total_duration) * 100, (end / self.total_duration) * 100)
+            for phase, start, end in self.spans
+        ]
             
         return result
 
@@ -221,7 +266,7 @@ class PhaseMetricsAggregated:
         return max([run.decrypt_duration for run in self.runs if run.decrypt_duration > 0])
 
     def get_average_phase_metrics(self):
-        """Get average phase metrics with timestamps interpolated to percentage scale using NUM_POINTS"""
+        """Median phase timestamps over the runs, as percentages of the duration of each run"""
         if not self.runs:
             return None
             
@@ -231,45 +276,407 @@ class PhaseMetricsAggregated:
         # Create a result metrics object
         result = PhaseMetrics()
         result.total_duration = 100  # 100%
-        
-        # Create x-axis points for interpolation
-        x_perc = np.linspace(0, 100, num=NUM_POINTS)
-        
-        # Interpolate each phase's start and end times
-        def interpolate_phase_times(times):
-            if not times:
-                return None
-            # Filter out zero values and get valid times
-            valid_times = [t for t in times if t != 0]
-            if not valid_times:
-                return None
-            # Interpolate to NUM_POINTS points
-            return np.interp(x_perc, np.linspace(0, 100, len(valid_times)), valid_times)
-        
-        # Interpolate each phase's timestamps
-        encrypt_starts = [run.encrypt_start for run in percentage_runs if run.encrypt_start != 0]
-        encrypt_ends = [run.encrypt_end for run in percentage_runs if run.encrypt_end != 0]
-        operation_starts = [run.operation_start for run in percentage_runs if run.operation_start != 0]
-        operation_ends = [run.operation_end for run in percentage_runs if run.operation_end != 0]
-        decrypt_starts = [run.decrypt_start for run in percentage_runs if run.decrypt_start != 0]
-        decrypt_ends = [run.decrypt_end for run in percentage_runs if run.decrypt_end != 0]
-        
-        # Get interpolated values and take the average
-        if encrypt_starts:
-            result.encrypt_start = np.mean(interpolate_phase_times(encrypt_starts))
-        if encrypt_ends:
-            result.encrypt_end = np.mean(interpolate_phase_times(encrypt_ends))
-        if operation_starts:
-            result.operation_start = np.mean(interpolate_phase_times(operation_starts))
-        if operation_ends:
-            result.operation_end = np.mean(interpolate_phase_times(operation_ends))
-        if decrypt_starts:
-            result.decrypt_start = np.mean(interpolate_phase_times(decrypt_starts))
-        if decrypt_ends:
-            result.decrypt_end = np.mean(interpolate_phase_times(decrypt_ends))
+
+        # Runs without a phase do not count for its timestamps
+        for attribute in ("encrypt_start", "encrypt_end", "operation_start", "operation_end", "decrypt_start", "decrypt_end"):
+            values = [getattr(run, attribute) for run in percentage_runs if getattr(run, attribute) != 0]
+            if values:
+                setattr(result, attribute, float(np.median(values)))
             
         return result
 
+# --- Statistics ---
+
+def reject_outliers(values, threshold=None):
+    """
+    Values kept and rejected by the modified z-score 0.6745 * |x - median| / MAD (Iglewicz and Hoaglin),
+    nothing is rejected when more than half of the values are equal or with fewer than OUTLIER_MIN_RUNS values.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    median = np.median(values)
+    mad = np.median(np.abs(values - median))
+    if mad == 0 or len(values) < OUTLIER_MIN_RUNS:
+        return values, values[:0]
+    keep = 0.6745 * np.abs(values - median) / mad <= (threshold or MAD_THRESHOLD)
+    return values[keep], values[~keep]
+
+def bootstrap_ci(values, confidence=None, resamples=None, seed=0):
+    """Percentile bootstrap confidence interval of the mean, the resamples are drawn at once"""
+    values = np.asarray(values, dtype=np.float64)
+    confidence = confidence or CONFIDENCE_LEVEL
+    rng = np.random.default_rng(seed)
+    means = rng.choice(values, size=(resamples or BOOTSTRAP_RESAMPLES, len(values))).mean(axis=1)
+    low, high = np.quantile(means, [(1 - confidence) / 2, (1 + confidence) / 2])
+    return float(low), float(high)
+
+def summarize_runs(values):
+    """
+    Statistics of a measure over the runs: the median, percentiles and MAD of all the runs,
+    the mean and its bootstrap confidence interval without the outliers. ci_width is relative to the mean.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    kept, rejected = reject_outliers(values)
+    mean = float(np.mean(kept))
+    low, high = bootstrap_ci(kept) if len(kept) > 1 else (mean, mean)
+    return {
+        'runs': len(values),
+        'outliers': len(rejected),
+        'median': float(np.median(values)),
+        'p5': float(np.percentile(values, 5)),
+        'p95': float(np.percentile(values, 95)),
+        'mad': float(np.median(np.abs(values - np.median(values)))),
+        'mean': mean,
+        'ci_low': low,
+        'ci_high': high,
+        'ci_width': (high - low) / mean if mean else 0.0
+    }
+
+def stop_decision(measures : dict, min_runs : int, target_ci : float=0, max_runs : int=None):
+    """
+    Whether enough runs were measured, and a message saying why the runs stop.
+    Without a target the runs stop at min_runs, with one once the relative CI width of every measure is below it.
+    """
+    nb_runs = len(measures['Execution Time'])
+    if not target_ci:
+        return nb_runs >= min_runs, None
+    if nb_runs < max(min_runs, ADAPTIVE_MIN_RUNS):
+        return False, None
+    widths = {name: summarize_runs(values)['ci_width'] for name, values in measures.items() if len(values) > 1}
+    widest = max(widths, key=widths.get)
+    if widths[widest] <= target_ci:
+        return True, f"Stopping after {nb_runs} runs: the widest CI ({widest}) is {widths[widest]:.2%} of the mean, below the {target_ci:.2%} target"
+    if max_runs and nb_runs >= max_runs:
+        return True, f"Stopping after {nb_runs} runs, the maximum: the widest CI ({widest}) is still {widths[widest]:.2%} of the mean, above the {target_ci:.2%} target"
+    return False, None
+
+def log_run_statistics(name, values, log_file, unit="seconds"):
+    """Log the statistics of a measure over the runs"""
+    stats = summarize_runs(values)
+    log_message(
+        f"- {name}: median {stats['median']:.6f} {unit} (p5 {stats['p5']:.6f}, p95 {stats['p95']:.6f}, MAD {stats['mad']:.6f}), "
+        f"mean {stats['mean']:.6f} {unit}, {CONFIDENCE_LEVEL:.0%} CI [{stats['ci_low']:.6f}, {stats['ci_high']:.6f}] "
+        f"(width {stats['ci_width']:.2%}), {stats['outliers']} of {stats['runs']} runs rejected as outliers",
+        log_file
+    )
+
+# --- Sampler ---
+
+class ProcSampler:
+    """
+    Samples the CPU time, resident memory and disk I/O of the process on a drift-corrected schedule.
+    Reads /proc/self/statm and io through file descriptors opened once (psutil elsewhere),
+    into preallocated array('d') ring buffers, so a tick never blocks the measured code.
+    CPU is the busy percentage of the process and of its child processes, 100% being one core fully busy.
+    It never comes from clock ticks (10 ms, /proc/*/stat), which are too coarse for short intervals,
+    and is capped at the number of cores.
+    The sampler thread is left out of the CPU times and context switches, its own CPU time is kept apart.
+    The kernel splits user and system time separately for the process and for the thread, so the busy percentage
+    comes from the exact CPU clocks of the process and of the sampler, and the cumulative columns never go backwards.
+    Child processes are read from /proc/<pid>/stat for their user and system times, quantized to clock ticks,
+    and from the /proc/<pid>/task/<tid>/schedstat of their threads, in nanoseconds, for the busy percentage.
+    """
+    COLUMNS = (
+        "time", "cpu", "memory", "disk_read", "disk_write", "net_sent", "net_received", "net_latency", "battery",
+        "user", "system", "voluntary_switches", "involuntary_switches", "children_user", "children_system", "sampler_cpu"
+    )
+    CUMULATIVE_COLUMNS = COLUMNS[9:]
+    CHILDREN_REFRESH = 0.1  # Seconds between two scans for new child processes
+    READ_SLACK = 0.001  # Seconds a reading of the CPU clocks may take, a longer one was preempted and is taken again
+    READ_ATTEMPTS = 3
+
+    def __init__(self, interval=None, capacity=None):
+        self.interval = interval or STEP_SECOND
+        self.capacity = capacity or SAMPLER_CAPACITY
+        self.buffers = {column: array('d', bytes(8 * self.capacity)) for column in self.COLUMNS}
+        self.count = 0
+        self.page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+        self.cores = os.cpu_count() or 1
+        self.process = psutil.Process()
+        self.fds = {}
+        for name in ("statm", "io"):
+            try:
+                self.fds[name] = os.open(f"/proc/self/{name}", os.O_RDONLY)
+            except OSError:
+                pass
+        # Child processes: stat descriptors, CPU times at the start and last CPU times read
+        self.child_fds = {}
+        self.child_start = {}
+        self.child_last = {}
+        # Threads of the child processes: schedstat descriptors, runtime at the start and last runtime read
+        self.task_fds = {}
+        self.task_start = {}
+        self.task_last = {}
+        self.start_time = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def read(self, name):
+        """Current content of a pre-opened /proc/self file"""
+        return os.pread(self.fds[name], 4096, 0)
+
+    def usage(self):
+        """
+        User time, system time and context switches of the process without the sampler thread, the CPU time of the sampler,
+        and the total CPU time without the sampler. Called from the sampler thread only.
+        """
+        sampler = time.thread_time()
+        total = time.process_time() - sampler
+        process = resource.getrusage(resource.RUSAGE_SELF)
+        if RUSAGE_THREAD is None:
+            return process.ru_utime - sampler, process.ru_stime, process.ru_nvcsw, process.ru_nivcsw, sampler, total
+        thread = resource.getrusage(RUSAGE_THREAD)
+        return (
+            process.ru_utime - thread.ru_utime,
+            process.ru_stime - thread.ru_stime,
+            process.ru_nvcsw - thread.ru_nvcsw,
+            process.ru_nivcsw - thread.ru_nivcsw,
+            sampler,
+            total
+        )
+
+    def refresh_children(self, started=False):
+        """Open the stat files of the child processes started since the last scan, started is set for the first scan"""
+        try:
+            children = self.process.children(recursive=True)
+        except psutil.Error:
+            return
+        for child in children:
+            self.refresh_tasks(child.pid, started)
+            if child.pid in self.child_start:
+                continue
+            try:
+                self.child_fds[child.pid] = os.open(f"/proc/{child.pid}/stat", os.O_RDONLY)
+            except OSError:
+                continue
+            self.child_last[child.pid] = self.read_child(child.pid) or (0, 0)
+            # Children started during the run count from zero
+            self.child_start[child.pid] = self.child_last[child.pid] if started else (0, 0)
+
+    def refresh_tasks(self, pid, started=False):
+        """Open the schedstat files of the threads of a child process started since the last scan"""
+        try:
+            tids = os.listdir(f"/proc/{pid}/task")
+        except OSError:
+            return
+        for tid in tids:
+            key = (pid, tid)
+            if key in self.task_start:
+                continue
+            try:
+                self.task_fds[key] = os.open(f"/proc/{pid}/task/{tid}/schedstat", os.O_RDONLY)
+            except OSError:
+                continue
+            # Threads found after the start count from now, a rate cannot take back the samples already taken
+            self.task_last[key] = self.task_start[key] = self.read_task(key) or 0
+
+    def read_task(self, key):
+        """Nanoseconds on CPU of a thread of a child process, None once it is gone"""
+        try:
+            return int(os.pread(self.task_fds[key], 256, 0).split()[0])
+        except (OSError, IndexError, ValueError):
+            os.close(self.task_fds.pop(key))
+            return None
+
+    def children_runtime(self):
+        """
+        CPU time of the child processes in seconds, exact unlike their clock ticks.
+        Threads found after the start count from when they are found, at most CHILDREN_REFRESH late.
+        """
+        for key in list(self.task_fds):
+            self.task_last[key] = self.read_task(key) or self.task_last[key]
+        return sum(last - self.task_start[key] for key, last in self.task_last.items()) / 1e9
+
+    def read_child(self, pid):
+        """User and system CPU time of a child process, None once it is gone"""
+        try:
+            fields = os.pread(self.child_fds[pid], 1024, 0).rpartition(b')')[2].split()
+        except OSError:
+            os.close(self.child_fds.pop(pid))
+            return None
+        return int(fields[11]) / CLOCK_TICKS, int(fields[12]) / CLOCK_TICKS
+
+    def children_cpu(self):
+        """User and system CPU time of the child processes since the start, the last value read for those gone"""
+        for pid in list(self.child_fds):
+            self.child_last[pid] = self.read_child(pid) or self.child_last[pid]
+        user = sum(last[0] - self.child_start[pid][0] for pid, last in self.child_last.items())
+        system = sum(last[1] - self.child_start[pid][1] for pid, last in self.child_last.items())
+        return user, system
+
+    def resident_bytes(self):
+        """Resident set size of the process"""
+        if "statm" in self.fds:
+            return int(self.read("statm").split()[1]) * self.page_size
+        return self.process.memory_info().rss
+
+    def disk_bytes(self):
+        """Bytes read from and written to storage by the process"""
+        if "io" in self.fds:
+            counters = dict(line.split(b': ') for line in self.read("io").splitlines())
+            return int(counters[b'read_bytes']), int(counters[b'write_bytes'])
+        try:
+            io_counters = self.process.io_counters()
+            return io_counters.read_bytes, io_counters.write_bytes
+        except (AttributeError, psutil.Error):
+            return 0, 0
+
+    def record(self, *values):
+        """Store one sample, overwriting the oldest once the buffers are full"""
+        index = self.count % self.capacity
+        for column, value in zip(self.COLUMNS, values):
+            self.buffers[column][index] = value
+        self.count += 1
+
+    def run(self):
+        """Sampling loop of the thread, values are relative to the start except the CPU busy percentage"""
+        start = self.start_time
+        self.refresh_children(started=True)
+        usage_before = self.usage()
+        memory_before = self.resident_bytes()
+        read_before, write_before = self.disk_bytes()
+        last_time, last_cpu = start, 0
+        last_usage = [0.0] * len(usage_before)
+        children_refresh = start + self.CHILDREN_REFRESH
+        battery = 0
+        if BATTERY:
+            battery_meter = pyRAPL.Measurement('bar')
+            battery_meter.begin()
+
+        tick = 0
+        stopped = False
+        while not stopped:
+            # Deadlines are multiples of the interval from the start, a late tick does not delay the next ones
+            tick += 1
+            deadline = start + tick * self.interval
+            stopped = self.stop_event.wait(max(0.0, deadline - time.perf_counter()))
+            now = time.perf_counter()
+            if now - deadline > self.interval:
+                tick = int((now - start) / self.interval)
+            if now >= children_refresh:
+                self.refresh_children()
+                children_refresh = now + self.CHILDREN_REFRESH
+
+            if BATTERY:
+                battery_meter.end()
+                battery = battery_meter.result.pkg[0]
+                battery_meter.begin()
+            # The sample is timed with its CPU clocks, a reading preempted before it is timed is taken again
+            for _ in range(self.READ_ATTEMPTS):
+                read_start = time.perf_counter()
+                usage = [value - before for value, before in zip(self.usage(), usage_before)]
+                children_runtime = self.children_runtime()
+                now = time.perf_counter()
+                if now - read_start < self.READ_SLACK:
+                    break
+            children_user, children_system = self.children_cpu()
+            cpu = max(last_cpu, usage[5] + children_runtime)
+            last_usage = usage = [max(value, last) for value, last in zip(usage, last_usage)]
+            disk_read, disk_write = self.disk_bytes()
+            self.record(
+                now - start,
+                min(100.0 * self.cores, max(0.0, 100 * (cpu - last_cpu) / (now - last_time))) if now > last_time else 0,
+                self.resident_bytes() - memory_before,
+                disk_read - read_before,
+                disk_write - write_before,
+                current_network_bytes_sent,
+                current_network_bytes_received,
+                current_network_latency,
+                battery,
+                *usage[:4],
+                children_user,
+                children_system,
+                usage[4]
+            )
+            last_time, last_cpu = now, cpu
+
+    def start(self):
+        """Start sampling in a daemon thread"""
+        self.start_time = time.perf_counter()
+        self.thread = threading.Thread(target=self.run, name="sampler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop sampling, the last sample is taken at the stop so that every run has one"""
+        self.stop_event.set()
+        self.thread.join()
+        for fd in itertools.chain(self.fds.values(), self.child_fds.values(), self.task_fds.values()):
+            os.close(fd)
+        self.fds, self.child_fds, self.task_fds = {}, {}, {}
+
+    @property
+    def dropped(self):
+        """Number of samples overwritten once the ring buffers were full"""
+        return max(0, self.count - self.capacity)
+
+    def series(self, column):
+        """Samples of a column in chronological order"""
+        values = np.frombuffer(self.buffers[column], dtype=np.float64)
+        if self.count <= self.capacity:
+            return values[:self.count].copy()
+        index = self.count % self.capacity
+        return np.concatenate((values[index:], values[:index]))
+
+    def fill(self, metric, column):
+        """Set the time series of a metric from the samples of a column"""
+        metric.times = self.series("time")
+        metric.values = self.series(column)
+        return metric
+
+    def attribution(self, start_time, end_time):
+        """
+        CPU times, context switches and effective parallelism between two perf_counter timestamps,
+        interpolated between the samples. Parallelism is the CPU seconds per wall second, children included.
+        """
+        times = self.series("time") + self.start_time
+        if not self.dropped:
+            # Every cumulative column starts from zero at the start of the sampler
+            times = np.concatenate(([self.start_time], times))
+
+        def delta(column):
+            values = self.series(column)
+            if not self.dropped:
+                values = np.concatenate(([0.0], values))
+            return float(np.interp(end_time, times, values) - np.interp(start_time, times, values))
+
+        result = {column: delta(column) for column in self.CUMULATIVE_COLUMNS}
+        # Interpolated counts
+        result['voluntary_switches'] = round(result['voluntary_switches'])
+        result['involuntary_switches'] = round(result['involuntary_switches'])
+        result['wall'] = end_time - start_time
+        cpu = result['user'] + result['system'] + result['children_user'] + result['children_system']
+        result['parallelism'] = cpu / result['wall'] if result['wall'] > 0 else 0
+        return result
+
+def thread_cpu_times():
+    """Name, user and system CPU time of each live thread of the process, from /proc/self/task/*/stat"""
+    names = {thread.native_id: thread.name for thread in threading.enumerate()}
+    times = {}
+    try:
+        tids = os.listdir("/proc/self/task")
+    except OSError:
+        return times
+    for tid in map(int, tids):
+        try:
+            with open(f"/proc/self/task/{tid}/stat", "rb") as f:
+                command, _, rest = f.read().rpartition(b')')
+        except OSError:
+            continue
+        fields = rest.split()
+        # Threads started by native libraries (TenSEAL, Concrete) have no Python name
+        name = names.get(tid, f"native {command.partition(b'(')[2].decode(errors='replace')}")
+        times[tid] = (name, int(fields[11]) / CLOCK_TICKS, int(fields[12]) / CLOCK_TICKS)
+    return times
+
+def log_cpu_attribution(label, attribution, log_file):
+    """Log the CPU times, context switches and parallelism of a phase"""
+    children = attribution['children_user'] + attribution['children_system']
+    log_message(
+        f"- {label}: {attribution['user']:.6f} s user, {attribution['system']:.6f} s system, {children:.6f} s children, "
+        f"{attribution['voluntary_switches']:.0f} voluntary and {attribution['involuntary_switches']:.0f} involuntary context switches, "
+        f"parallelism {attribution['parallelism']:.2f}",
+        log_file
+    )
+
 # --- Utility Functions ---
 
 def plot_graph(x_data, y_data, title, y_label, filename, folder, x_label="Time (seconds)", color=None, phase_metrics=None):
@@ -292,6 +699,12 @@ def plot_graph(x_data, y_data, title, y_label, filename, folder, x_label="Time (
         if phase_metrics.decrypt_start != 0 and phase_metrics.decrypt_end != 0:
             ax.axvline(x=phase_metrics.decrypt_start, color='purple', linestyle='--', label='Decrypt Start')
             ax.axvline(x=phase_metrics.decrypt_end, color='purple', linestyle='-', label='Decrypt End')
+        # Shade the chunks of streamed phases, overlapping spans show the pipelining
+        labeled = set()
+        for phase, start, end in phase_metrics.spans:
+            ax.axvspan(start, end, color=PHASE_COLORS[phase], alpha=0.15,
+                       label=None if phase in labeled else f"{phase.capitalize()} Chunks")
+            labeled.add(phase)
     
     ax.legend()
     plt.title(title)
@@ -319,12 +732,176 @@ def plot_metric(metric, folder : str, isAggregated:bool=False, phase_metrics=Non
     filename = metric.graph_filename if metric.graph_filename else "graph.png"
     plot_graph(x_data, y_data, title, metric.name, filename, folder, x_label=x_label, color=metric.color, phase_metrics=phase_metrics)
 
+log_buffers = {}  # Lines of the log files written in one go, e.g. {'print.md': ['# Run 1']}
+
 def log_message(message : str, log_file : str):
-    with open(log_file, "a") as f:
-        f.write(message + "\n")
+    if log_file in log_buffers:
+        log_buffers[log_file].append(message)
+    else:
+        with open(log_file, "a") as f:
+            f.write(message + "\n")
     if PLOT_PRINT:
         print(Fore.GREEN + message)
 
+def buffer_log(log_file : str):
+    """Keep the next messages of a log file in memory until flush_log"""
+    log_buffers.setdefault(log_file, [])
+
+def flush_log(log_file : str):
+    """Write the buffered messages of a log file with a single open"""
+    lines = log_buffers.pop(log_file, [])
+    with open(log_file, "a") as f:
+        f.write("".join(line + "\n" for line in lines))
+
+# --- Metrics Store ---
+
+def append_run_metrics(metadata : dict, run : int, sampler, phase_metrics, summary : dict, folder : str="", main_folder : str="", directory : str=None):
+    """
+    Append the time series of a run to the metrics store: one uncompressed .npz of columns per run,
+    and one line in the index with the configuration, phase timestamps and summary values.
+    """
+    directory = directory or METRICS_STORE
+    os.makedirs(directory, exist_ok=True)
+    file_name = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{os.getpid()}_run{run + 1}.npz"
+    spans = phase_metrics.spans
+    np.savez(
+        os.path.join(directory, file_name),
+        **{column: sampler.series(column) for column in sampler.COLUMNS},
+        span_phase=np.array([phase for phase, _, _ in spans], dtype='U9'),
+        span_start=np.array([start for _, start, _ in spans], dtype=np.float64),
+        span_end=np.array([end for _, _, end in spans], dtype=np.float64)
+    )
+    entry = dict(metadata, run=run + 1, file=file_name, folder=folder, main_folder=main_folder, timestamp=datetime.now().isoformat(timespec='seconds'))
+    for phase in PHASE_LABELS:
+        entry[f"{phase}_start"] = getattr(phase_metrics, f"{phase}_start")
+        entry[f"{phase}_end"] = getattr(phase_metrics, f"{phase}_end")
+        entry[f"{phase}_duration"] = getattr(phase_metrics, f"{phase}_duration")
+    entry.update(summary)
+    with open(os.path.join(directory, METRICS_INDEX), "a") as f:
+        f.write(json.dumps(entry, default=float) + "\n")
+
+def load_metrics_index(directory : str=None):
+    """
+    Index of the metrics store as columns, one NumPy array per key, so runs are selected with vectorized masks:
+    index['execution_time'][(index['scheme'] == 'bfv') & (index['nb_data'] == 1024)]
+    """
+    with open(os.path.join(directory or METRICS_STORE, METRICS_INDEX)) as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    keys = list(dict.fromkeys(key for entry in entries for key in entry))
+    columns = {}
+    for key in keys:
+        values = [entry.get(key) for entry in entries]
+        column = np.array(values)
+        # Missing keys and mixed types stay Python objects
+        columns[key] = column if column.dtype != object and None not in values else np.array(values, dtype=object)
+    return columns
+
+def load_run_series(file_name : str, directory : str=None):
+    """Time series of one run of the index, the columns are read lazily from the .npz"""
+    return np.load(os.path.join(directory or METRICS_STORE, file_name))
+
+def read_metrics_entries(directory : str=None):
+    """Lines of the index of the metrics store, as dicts"""
+    with open(os.path.join(directory or METRICS_STORE, METRICS_INDEX)) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+# --- Rendering ---
+
+def phase_metrics_from_entry(entry : dict, series):
+    """Phase timestamps of a stored run, relative to its start"""
+    phase_metrics = PhaseMetrics()
+    for phase in PHASE_LABELS:
+        for key in ("start", "end", "duration"):
+            setattr(phase_metrics, f"{phase}_{key}", entry[f"{phase}_{key}"])
+    phase_metrics.total_duration = entry['execution_time']
+    phase_metrics.spans = list(zip(series['span_phase'].tolist(), series['span_start'].tolist(), series['span_end'].tolist()))
+    return phase_metrics
+
+def stored_metric_runs(entry : dict, series):
+    """MetricsRun of each graph of a stored run, battery only when it was measured"""
+    metrics = []
+    for column, name, color, graph_filename, graph_title, _, _ in METRIC_GRAPHS:
+        if column == "battery" and not series[column].any():
+            continue
+        metric = MetricsRun(name, color, graph_filename=graph_filename, graph_title=graph_title)
+        metric.times, metric.values = series['time'], series[column]
+        metrics.append(metric)
+    return metrics
+
+def render_run(entry : dict, directory : str=None):
+    """Render the graphs of one stored run into its run folder"""
+    with load_run_series(entry['file'], directory) as series:
+        phase_metrics = phase_metrics_from_entry(entry, series)
+        for metric in stored_metric_runs(entry, series):
+            plot_metric(metric, entry['folder'], isAggregated=False, phase_metrics=phase_metrics)
+
+def render_aggregated(entries : list, directory : str=None):
+    """Render the averaged graphs of the runs of one configuration into their main folder"""
+    aggregated = {}
+    phase_agg = PhaseMetricsAggregated()
+    for entry in entries:
+        with load_run_series(entry['file'], directory) as series:
+            phase_agg.add_phase_metrics(phase_metrics_from_entry(entry, series))
+            for metric in stored_metric_runs(entry, series):
+                aggregated.setdefault(metric.name, []).append(metric)
+    for column, name, color, _, _, graph_filename, graph_title in METRIC_GRAPHS:
+        if name in aggregated:
+            metric_agg = MetricsAggregated(name, color, graph_filename=graph_filename, graph_title=graph_title)
+            for metric in aggregated[name]:
+                metric_agg.add_metric_run(metric)
+            plot_metric(metric_agg, entries[0]['main_folder'], isAggregated=True, phase_agg=phase_agg)
+
+def render_metrics(directory : str=None, folders : list=None, workers : int=None):
+    """
+    Render the graphs of the stored runs in a process pool, outside of any measurement.
+    folders restricts the rendering to the runs of these main folders, returns the number of runs rendered.
+    """
+    folders = [os.path.normpath(folder) for folder in folders] if folders is not None else None
+    entries = [
+        entry for entry in read_metrics_entries(directory)
+        if entry.get('folder') and (folders is None or os.path.normpath(entry['main_folder']) in folders)
+    ]
+    groups = {}
+    for entry in entries:
+        # Warmup runs get their own graphs but stay out of the averaged ones
+        if not entry.get('warmup'):
+            groups.setdefault(entry['main_folder'], []).append(entry)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(render_run, entry, directory) for entry in entries]
+        futures += [executor.submit(render_aggregated, group, directory) for group in groups.values() if len(group) > 1]
+        for future in futures:
+            future.result()
+    return len(entries)
+
+def render_pending(workers : int=None):
+    """Render the graphs of the runs profiled by this process"""
+    if not pending_plots:
+        return
+    print(Fore.GREEN + f"Rendering the graphs of {len(pending_plots)} configurations")
+    print(Fore.RESET)
+    render_metrics(folders=list(pending_plots), workers=workers)
+    pending_plots.clear()
+
+def reset_peak_rss():
+    """Reset the resident set high-water mark of the process, returns False where it is not supported (Linux only)"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def peak_rss():
+    """Resident set high-water mark of the process in bytes (VmHWM), None where it is not available"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
 def format_bytes(num_bytes : int):
     """
     Format bytes to a human-readable string.
@@ -342,7 +919,14 @@ def format_bytes(num_bytes : int):
 
 # --- Decorator for Profiling and Monitoring ---
 
-def profile_and_monitor(number : int=1, folder_prefix : str="", annotation : str=""):
+def profile_and_monitor(number : int=1, folder_prefix : str="", annotation : str="", metadata : dict=None,
+                        warmup : int=0, target_ci : float=0, max_runs : int=None, agree_to_stop=None):
+    """
+    Profile number runs of the decorated function, after warmup runs which are left out of the aggregated results.
+    With a target_ci, number is a minimum: the runs go on until the confidence interval of the execution time and of
+    every phase duration is narrower than target_ci times the mean, or until max_runs.
+    agree_to_stop(stop) lets a peer take the decision, it returns whether to stop.
+    """
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
@@ -364,21 +948,31 @@ def profile_and_monitor(number : int=1, folder_prefix : str="", annotation : str
             
             # Create aggregated phase metrics
             phase_agg = PhaseMetricsAggregated()
+            peak_memory_runs = []
+            attribution_runs = []
+            measures = {'Execution Time': []}  # Execution time and phase durations of the measured runs
+            stop_message = None
             
             result = None
             
-            for run in range(number):
+            for attempt in itertools.count():
                 global current_run, current_network_bytes_sent, current_network_bytes_received, current_network_latency
                 global encrypt_start_time, encrypt_end_time, operation_start_time, operation_end_time, decrypt_start_time, decrypt_end_time
+                global phase_details, phase_spans
+                is_warmup = attempt < warmup
+                run = attempt if is_warmup else attempt - warmup
+                run_name = f"warmup_{run+1}" if is_warmup else f"run_{run+1}"
                 current_run = run
+                phase_details = {}
+                phase_spans = []
 
                 # Create a folder for each run and log the function and arguments.
-                run_folder = os.path.join(main_folder, f"run_{run+1}")
+                run_folder = os.path.join(main_folder, run_name)
                 os.makedirs(run_folder, exist_ok=True)
                 log_file = os.path.join(run_folder, "print.md")
-                print(Fore.GREEN + f"Saving run {run+1}/{number} to: {log_file}")
+                print(Fore.GREEN + (f"Saving warmup run {run+1}/{warmup}" if is_warmup else f"Saving run {run+1}/{number}") + f" to: {log_file}")
                 
-                log_message(f"# Run {run+1}", log_file)
+                log_message(f"# Warmup Run {run+1}" if is_warmup else f"# Run {run+1}", log_file)
                 log_message("## Function and Args", log_file)
                 log_message(f"- Function: {func.__name__}", log_file)
                 log_message(f"- Annotation: {annotation}", log_file)
@@ -386,7 +980,7 @@ def profile_and_monitor(number : int=1, folder_prefix : str="", annotation : str
 
                 # Initialize MetricsRun objects for this run.
                 exec_metric = MetricsRun("Execution Time", 'tab:green', graph_filename="graph_execution_time.png", graph_title="Execution Time Per Run")
-                cpu_metric = MetricsRun("CPU Busy Percentage", 'tab:red', graph_filename="graph_cpu.png", graph_title="CPU Busy Percentage Over Time")
+                cpu_metric = MetricsRun("CPU Busy Percentage", 'tab:red', graph_filename="graph_cpu.png", graph_title="Process CPU Busy Percentage Over Time")
                 memory_metric = MetricsRun("Memory Usage (bytes)", 'tab:blue', graph_filename="graph_ram.png", graph_title="Memory Usage Over Time")
                 network_sent_metric = MetricsRun("Network Bytes Sent", 'tab:pink', graph_filename="graph_network_sent.png", graph_title="Network Bytes Sent Over Time")
                 network_received_metric = MetricsRun("Network Bytes Received", 'tab:purple', graph_filename="graph_network_received.png", graph_title="Network Bytes Received Over Time")
@@ -396,47 +990,46 @@ def profile_and_monitor(number : int=1, folder_prefix : str="", annotation : str
                 if BATTERY:
                     battery_metric = MetricsRun("Battery Consumption (Joules)", 'tab:orange', graph_filename="graph_battery.png", graph_title="Battery Consumption Over Time")
                 
-                psutil_process = psutil.Process()
-                stop_monitoring = threading.Event()
-                
-                def monitor():
-                    global current_network_bytes_sent, current_network_bytes_received, current_network_latency
-                    monitor_time_start = time.perf_counter()
-                    memory_before = psutil_process.memory_info().rss
-                    disk_io_before = psutil.disk_io_counters()
-
-                    while not stop_monitoring.is_set():
-                        monitor_time_current = time.perf_counter() - monitor_time_start
-
-                        if BATTERY:
-                            battery_meter = pyRAPL.Measurement('bar')
-                            battery_meter.begin()
-                        
-                        cpu_times = psutil.cpu_times_percent(interval=STEP_SECOND)
-
-                        if BATTERY:
-                            battery_meter.end()
-                            battery_metric.add_measurement(monitor_time_current, battery_meter.result.pkg[0])
-
-                        disk_io_current = psutil.disk_io_counters()
-                        disk_read_metric.add_measurement(monitor_time_current,  disk_io_current.read_bytes - disk_io_before.read_bytes)
-                        disk_write_metric.add_measurement(monitor_time_current,  disk_io_current.write_bytes - disk_io_before.write_bytes)
-
-                        cpu_metric.add_measurement(monitor_time_current, 100 - cpu_times.idle)
-                        memory_metric.add_measurement(monitor_time_current, psutil_process.memory_info().rss - memory_before)
-                        network_sent_metric.add_measurement(monitor_time_current, current_network_bytes_sent)
-                        network_received_metric.add_measurement(monitor_time_current, current_network_bytes_received)
-                        network_latency_metric.add_measurement(monitor_time_current, current_network_latency)     
-                
-                monitor_thread = threading.Thread(target=monitor, daemon=True)
-                monitor_thread.start()
+                sampler = ProcSampler()
+                sampler.start()
+
+                # The sampled memory misses short peaks, the high-water mark of the run catches them
+                peak_supported = reset_peak_rss()
+                memory_start = sampler.resident_bytes()
+                threads_start = thread_cpu_times()
                 
                 func_time_start = time.perf_counter()
                 result = func(*args, **kwargs)
                 func_time_end = time.perf_counter()
+
+                threads_end = thread_cpu_times()
+
+                peak_memory = peak_rss() if peak_supported else None
+                if peak_memory is not None:
+                    peak_memory = max(0, peak_memory - memory_start)
+                    if not is_warmup:
+                        peak_memory_runs.append(peak_memory)
                 
-                stop_monitoring.set()
-                monitor_thread.join()
+                sampler.stop()
+
+                # CPU attribution of the whole run and of each phase, from the cumulative samples
+                attribution = {'Run': sampler.attribution(func_time_start, func_time_end)}
+                for phase, label in PHASE_LABELS.items():
+                    start_time, end_time = globals()[f"{phase}_start_time"], globals()[f"{phase}_end_time"]
+                    if start_time != 0 and end_time != 0:
+                        attribution[label] = sampler.attribution(start_time, end_time)
+                if not is_warmup:
+                    attribution_runs.append(attribution)
+
+                sampler.fill(cpu_metric, "cpu")
+                sampler.fill(memory_metric, "memory")
+                sampler.fill(network_sent_metric, "net_sent")
+                sampler.fill(network_received_metric, "net_received")
+                sampler.fill(network_latency_metric, "net_latency")
+                sampler.fill(disk_read_metric, "disk_read")
+                sampler.fill(disk_write_metric, "disk_write")
+                if BATTERY:
+                    sampler.fill(battery_metric, "battery")
 
                 # Compute execution time.
                 func_time_execution = func_time_end - func_time_start
@@ -445,9 +1038,15 @@ def profile_and_monitor(number : int=1, folder_prefix : str="", annotation : str
                 # Create and update phase metrics
                 phase_metrics = PhaseMetrics()
                 phase_metrics.update_from_globals(func_time_start, func_time_end)  # Pass both start and end times
-                phase_agg.add_phase_metrics(phase_metrics)
+                if not is_warmup:
+                    phase_agg.add_phase_metrics(phase_metrics)
+                    measures['Execution Time'].append(func_time_end - func_time_start)
+                    for phase, label in PHASE_LABELS.items():
+                        if getattr(phase_metrics, f"{phase}_duration") > 0:
+                            measures.setdefault(label, []).append(getattr(phase_metrics, f"{phase}_duration"))
                 
-                # Log run results.
+                # Log run results, written at once after the run.
+                buffer_log(log_file)
                 log_message("## Profiling Results", log_file)
                 log_message("### Execution Time", log_file)
                 log_message(f"- Execution Time: {func_time_execution:.6f} seconds", log_file)
@@ -456,46 +1055,89 @@ def profile_and_monitor(number : int=1, folder_prefix : str="", annotation : str
                 log_message("### Phase Durations", log_file)
                 if phase_metrics.encrypt_duration > 0:
                     log_message(f"- Encryption Duration: {phase_metrics.encrypt_duration:.6f} seconds", log_file)
+                    for label, value in phase_details.get('encrypt', {}).items():
+                        log_message(f"  - {label}: {value}", log_file)
                 if phase_metrics.operation_duration > 0:
                     log_message(f"- Operation Duration: {phase_metrics.operation_duration:.6f} seconds", log_file)
+                    for label, value in phase_details.get('operation', {}).items():
+                        log_message(f"  - {label}: {value}", log_file)
                 if phase_metrics.decrypt_duration > 0:
                     log_message(f"- Decryption Duration: {phase_metrics.decrypt_duration:.6f} seconds", log_file)
+                    for label, value in phase_details.get('decrypt', {}).items():
+                        log_message(f"  - {label}: {value}", log_file)
 
                 log_message("### Additional Memory Usage", log_file)
                 log_message(f"- Average Memory Usage: {format_bytes(memory_metric.get_avg())}", log_file)
                 log_message(f"- Max Memory Usage: {format_bytes(memory_metric.get_max())}", log_file)
                 log_message(f"- Min Memory Usage: {format_bytes(memory_metric.get_min())}", log_file)
+                if peak_memory is not None:
+                    log_message(f"- Peak Memory Usage: {format_bytes(peak_memory)}", log_file)
                 
                 log_message("### CPU Busy Percentage", log_file)
                 log_message(f"- Average CPU Busy: {cpu_metric.get_avg():.2f}%", log_file)
                 log_message(f"- Max CPU Busy: {cpu_metric.get_max():.2f}%", log_file)
                 log_message(f"- Min CPU Busy: {cpu_metric.get_min():.2f}%", log_file)
+                log_message(f"- Samples: {sampler.count} every {sampler.interval * 1000:g} ms" + (f", {sampler.dropped} oldest overwritten" if sampler.dropped else ""), log_file)
+
+                log_message("### CPU Attribution", log_file)
+                for label, values in attribution.items():
+                    log_cpu_attribution(label, values, log_file)
+                log_message(f"- Sampler: {attribution['Run']['sampler_cpu']:.6f} s, not counted above", log_file)
+                log_message("#### Threads", log_file)
+                thread_times = []
+                for tid, (name, user, system) in threads_end.items():
+                    _, user_start, system_start = threads_start.get(tid, (name, 0, 0))
+                    thread_times.append((user - user_start + system - system_start, name, tid, user - user_start, system - system_start))
+                for cpu, name, tid, user, system in sorted(thread_times, reverse=True):
+                    if cpu > 0:
+                        log_message(f"- {name} (tid {tid}): {user:.2f} s user, {system:.2f} s system", log_file)
                 
                 log_message("### Network Metrics", log_file)
                 log_message(f"- Total Bytes Sent: {format_bytes(current_network_bytes_sent)}", log_file)
                 log_message(f"- Total Bytes Received: {format_bytes(current_network_bytes_received)}", log_file)
                 log_message(f"- Total Network Latency: {current_network_latency:.6f} ms", log_file)
 
+                if current_compression_wire_bytes > 0:
+                    log_message("### Compression", log_file)
+                    log_message(f"- Uncompressed Bytes: {format_bytes(current_compression_raw_bytes)}", log_file)
+                    log_message(f"- Bytes on the Wire: {format_bytes(current_compression_wire_bytes)}", log_file)
+                    log_message(f"- Compression Ratio: {current_compression_raw_bytes / current_compression_wire_bytes:.3f}", log_file)
+                    log_message(f"- Compression CPU Time: {current_compression_time:.6f} seconds", log_file)
+                    log_message(f"- Decompression CPU Time: {current_decompression_time:.6f} seconds", log_file)
+
                 log_message("### Disk I/O Metrics", log_file)
-                log_message(f"- Total Disk Read: {format_bytes(disk_read_metric.get_sum())}", log_file)
-                log_message(f"- Total Disk Write: {format_bytes(disk_write_metric.get_sum())}", log_file)
+                log_message(f"- Total Disk Read: {format_bytes(disk_read_metric.get_max())}", log_file)
+                log_message(f"- Total Disk Write: {format_bytes(disk_write_metric.get_max())}", log_file)
 
                 if BATTERY:
                     log_message("### Battery Consumption", log_file)
                     log_message(f"- Total Battery Consumption: {battery_metric.get_sum():.6f} Joules", log_file)
                 
-                # Plotting for this run using the merged plot_metric function.
-                plot_metric(cpu_metric, run_folder, isAggregated=False, phase_metrics=phase_metrics)
-                plot_metric(memory_metric, run_folder, isAggregated=False, phase_metrics=phase_metrics)
-                plot_metric(network_sent_metric, run_folder, isAggregated=False, phase_metrics=phase_metrics)
-                plot_metric(network_received_metric, run_folder, isAggregated=False, phase_metrics=phase_metrics)
-                plot_metric(disk_read_metric, run_folder, isAggregated=False, phase_metrics=phase_metrics)
-                plot_metric(disk_write_metric, run_folder, isAggregated=False, phase_metrics=phase_metrics)
-                if BATTERY:
-                    plot_metric(battery_metric, run_folder, isAggregated=False, phase_metrics=phase_metrics)
-                
                 log_message("# Algorithm Result", log_file)
                 log_message(f"- Result: {result}", log_file)
+                flush_log(log_file)
+
+                # Raw time series and phase timestamps for later queries
+                summary = {
+                    'execution_time': func_time_execution,
+                    'peak_memory': peak_memory,
+                    'network_bytes_sent': current_network_bytes_sent,
+                    'network_bytes_received': current_network_bytes_received,
+                    'network_latency': current_network_latency,
+                    'samples': sampler.count,
+                    'sample_interval': sampler.interval
+                }
+                summary.update({f"cpu_{key}": value for key, value in attribution['Run'].items()})
+                append_run_metrics(
+                    dict(metadata or {}, function=func.__name__, annotation=annotation, warmup=is_warmup), run, sampler, phase_metrics, summary,
+                    folder=run_folder, main_folder=main_folder
+                )
+
+                gc.collect()
+                if is_warmup:
+                    print(Fore.GREEN + f"Warmup run {run+1}/{warmup} completed, left out of the results.")
+                    print(Fore.RESET)
+                    continue
                 
                 # Add each run's metrics to the aggregated objects.
                 exec_time_agg.add_metric_run(exec_metric)
@@ -509,19 +1151,38 @@ def profile_and_monitor(number : int=1, folder_prefix : str="", annotation : str
                 if BATTERY:
                     battery_agg.add_metric_run(battery_metric)
                 
-                gc.collect()
                 print(Fore.GREEN + f"Run {run+1}/{number} completed.")
                 print(Fore.RESET)
 
+                stop, stop_message = stop_decision(measures, number, target_ci, max_runs)
+                if agree_to_stop is not None:
+                    agreed = agree_to_stop(stop)
+                    if agreed and not stop:
+                        stop_message = f"Stopping after {run+1} runs, as decided by the peer"
+                    stop = agreed
+                if stop:
+                    if stop_message:
+                        print(Fore.GREEN + stop_message)
+                        print(Fore.RESET)
+                    break
             
             # Compute aggregated results if multiple runs were performed.
-            if number > 1:
+            if len(measures['Execution Time']) > 1:
                 aggregated_log = os.path.join(main_folder, "aggregated.md")
                 print(Fore.GREEN + f"Saving aggregated results to: {aggregated_log}")
+                buffer_log(aggregated_log)
                 log_message("# Aggregated Profiling Results", aggregated_log)
                 log_message("## Function and Args", aggregated_log)
                 log_message(f"- Function: {func.__name__}", aggregated_log)
                 log_message(f"- Annotation: {annotation}", aggregated_log)
+
+                # Robust statistics of the execution time and phase durations over the measured runs.
+                log_message("### Statistics", aggregated_log)
+                log_message(f"- Runs: {len(measures['Execution Time'])} measured, {warmup} warmup runs left out", aggregated_log)
+                if stop_message:
+                    log_message(f"- {stop_message}", aggregated_log)
+                for name, values in measures.items():
+                    log_run_statistics(name if name == "Execution Time" else f"{name} Duration", values, aggregated_log)
                 
                 # Log aggregated execution time metric.
                 log_message("### Execution Time", aggregated_log)
@@ -550,11 +1211,19 @@ def profile_and_monitor(number : int=1, folder_prefix : str="", annotation : str
                 log_message(f"- Average : {format_bytes(memory_agg.aggregated_avg())}", aggregated_log)
                 log_message(f"- Min : {format_bytes(memory_agg.aggregated_min_of_avg())}", aggregated_log)
                 log_message(f"- Max : {format_bytes(memory_agg.aggregated_max_of_avg())}", aggregated_log)
+                if peak_memory_runs:
+                    log_message(f"- Peak : {format_bytes(max(peak_memory_runs))}", aggregated_log)
                 
                 log_message("### CPU Busy Percentage", aggregated_log)
                 log_message(f"- Average : {cpu_agg.aggregated_avg():.2f}%", aggregated_log)
                 log_message(f"- Min : {cpu_agg.aggregated_min_of_avg():.2f}%", aggregated_log)
                 log_message(f"- Max : {cpu_agg.aggregated_max_of_avg():.2f}%", aggregated_log)
+
+                log_message("### CPU Attribution (average)", aggregated_log)
+                for label in ['Run'] + list(PHASE_LABELS.values()):
+                    runs = [attribution[label] for attribution in attribution_runs if label in attribution]
+                    if runs:
+                        log_cpu_attribution(label, {key: np.mean([run[key] for run in runs]) for key in runs[0]}, aggregated_log)
                 
                 # Aggregate Network metrics.
                 log_message("### Network Metrics", aggregated_log)
@@ -593,18 +1262,12 @@ def profile_and_monitor(number : int=1, folder_prefix : str="", annotation : str
                     log_message("### Battery Consumption", aggregated_log)
                     log_message(f"- Average Battery Consumption: {battery_agg.aggregated_avg_of_sum():.6f} Joules", aggregated_log)
                 
-                # Plot aggregated time series graphs using the merged plot_metric function.
-                plot_metric(cpu_agg, main_folder, isAggregated=True, phase_agg=phase_agg)
-                plot_metric(memory_agg, main_folder, isAggregated=True, phase_agg=phase_agg)
-                plot_metric(net_sent_agg, main_folder, isAggregated=True, phase_agg=phase_agg)
-                plot_metric(net_recv_agg, main_folder, isAggregated=True, phase_agg=phase_agg)
-                plot_metric(disk_read_agg, main_folder, isAggregated=True, phase_agg=phase_agg)
-                plot_metric(disk_write_agg, main_folder, isAggregated=True, phase_agg=phase_agg)
-                if BATTERY:
-                    plot_metric(battery_agg, main_folder, isAggregated=True, phase_agg=phase_agg)
+                flush_log(aggregated_log)
                 
                 print(Fore.RESET)
             
+            # Graphs are rendered later from the metrics store, see render_pending
+            pending_plots.append(main_folder)
             return result
         return wrapper
     return decorator
@@ -637,6 +1300,21 @@ def dummy(range_mod=2**24, modulo=7, range_sum=2**8):
     return (totalMod, totalSum)
 
 if __name__ == '__main__':
-    result = dummy(range_mod=2**20, modulo=7, range_sum=2**20)
-    print(Fore.BLUE + "Algorithm result:", result)
-    print(Fore.RESET)
+    parser = argparse.ArgumentParser(description="Profile the example function, or render the graphs of the metrics store")
+    subparsers = parser.add_subparsers(dest="command")
+    render_parser = subparsers.add_parser("render", help="Render the graphs of the stored runs into their result folders")
+    render_parser.add_argument("--store", type=str, default=METRICS_STORE, help=f"Directory of the metrics store (default: {METRICS_STORE})")
+    render_parser.add_argument("--folder", type=str, action='append', default=None,
+                               help="Only render the runs of this result folder, can be repeated (default: all)")
+    render_parser.add_argument("--workers", type=int, default=None, help="Rendering processes (default: number of cores)")
+    args = parser.parse_args()
+
+    if args.command == "render":
+        nb_runs = render_metrics(args.store, folders=args.folder, workers=args.workers)
+        print(Fore.GREEN + f"Rendered the graphs of {nb_runs} runs from {args.store}")
+        print(Fore.RESET)
+    else:
+        result = dummy(range_mod=2**20, modulo=7, range_sum=2**20)
+        render_pending()
+        print(Fore.BLUE + "Algorithm result:", result)
+        print(Fore.RESET)
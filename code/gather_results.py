@@ -1,4 +1,5 @@
 import os
+import json
 import shutil
 from pathlib import Path
 
@@ -48,6 +49,33 @@ def gather_aggregated_files():
                         
                         file_counter += 1
 
+def gather_metrics_stores():
+    # Merge the metrics stores of the VMs into one, the index lines record the VM they come from
+    base_dir = "results_profile"
+    output_dir = os.path.join(base_dir, "grapped", "metrics")
+    os.makedirs(output_dir, exist_ok=True)
+
+    # The merged index is rewritten on every invocation, like the gathered aggregated files
+    with open(os.path.join(output_dir, "index.jsonl"), "w") as f_out:
+        for store_dir in sorted(Path(base_dir).glob("vm*/**/metrics")):
+            index_path = store_dir / "index.jsonl"
+            if not index_path.exists():
+                continue
+            vm_name = store_dir.relative_to(base_dir).parts[0]
+            with open(index_path) as f_in:
+                for line in f_in:
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    source_path = store_dir / entry["file"]
+                    entry["vm"] = vm_name
+                    entry["file"] = f"{vm_name}_{entry['file']}"
+                    shutil.copy2(source_path, os.path.join(output_dir, entry["file"]))
+                    f_out.write(json.dumps(entry) + "\n")
+            print(f"Merged {store_dir} into {output_dir}")
+
 if __name__ == "__main__":
     gather_aggregated_files()
-    print("Finished gathering aggregated.md files") 
\ No newline at end of file
+    print("Finished gathering aggregated.md files")
+    gather_metrics_stores()
+    print("Finished gathering metrics stores") 
\ No newline at end of file
@@ -10,25 +10,81 @@ from abc import ABC, abstractmethod
 import base64
 import os
 import gc
+import threading
+import collections
+import hashlib
+import tempfile
+import importlib.metadata
+import zipfile
+import io
+import queue
+import asyncio
+import mmap
+import zlib
+import weakref
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+try:
+    import zstandard
+    HAS_ZSTD = True
+except ImportError:
+    HAS_ZSTD = False
+try:
+    import lz4.frame
+    HAS_LZ4 = True
+except ImportError:
+    HAS_LZ4 = False
 #NOTE HE LIBRARY
 from phe import paillier
+from phe.util import powmod
+try:
+    import gmpy2
+    HAS_GMPY2 = True
+except ImportError:
+    HAS_GMPY2 = False
+# Modular exponentiations of many bases by one exponent, releasing the GIL (gmpy2 >= 2.2)
+HAS_POWMOD_BASE_LIST = HAS_GMPY2 and hasattr(gmpy2, "powmod_base_list")
 import tenseal as ts
 from concrete import fhe
+import numpy as np
 
 #NOTE BENCHMARK LIBRARY
 import benchmark
 from benchmark import profile_and_monitor
 
 #NOTE CONSTANTS
-BUFFER_SIZE = 4096
-OPERATIONS_POSSIBLE = ["add_scalar", "add_encrypted", "mul_scalar", "mul_encrypted"]
+SENDMSG_MAX_BUFFERS = 1024
+OPERATIONS_POSSIBLE = ["add_scalar", "add_encrypted", "mul_scalar", "mul_encrypted", "sum", "mean", "weighted_sum", "dot_product"]
+# Operations reducing the whole data to a single value
+AGGREGATE_OPERATIONS = ["sum", "mean", "weighted_sum", "dot_product"]
+# Operations taking a second encrypted dataset as other operand
+SECOND_OPERAND_OPERATIONS = ["add_encrypted", "mul_encrypted", "dot_product"]
+# Separator of the stages of a pipeline, e.g. "mul_scalar->add_encrypted->mul_encrypted"
+PIPELINE_SEPARATOR = "->"
 DATA_RANGE = 2**7
 MINI_DATA_RANGE = 2**4
+WIRE_FORMATS = ["json", "binary"]
+OBFUSCATOR_REFILL_STRATEGIES = ["idle", "background"]
+DECRYPT_MODES = ["single", "batch"]
+KEY_PROFILES = ["auto", "full"]
+LOAD_ARRIVALS = ["closed", "poisson"]
+COMPRESSION_CODECS = ["none", "zlib", "zstd", "lz4"]
+# Control messages and small payloads are sent as is, compressing them costs more than it saves
+COMPRESSION_MIN_BYTES = 1024
+# Operations relinearizing after a ciphertext-ciphertext product (BFV, CKKS)
+RELIN_KEY_OPERATIONS = ["mul_encrypted", "dot_product"]
+# Operations rotating the slots of packed ciphertexts, their Galois keys are generated on demand (BFV, CKKS)
+GALOIS_KEY_OPERATIONS = ["sum", "mean", "weighted_sum", "dot_product"]
+WIRE_MAGIC = b'HEW1'
 
 def reset_benchmark():
     benchmark.current_network_bytes_sent = 0
     benchmark.current_network_bytes_received = 0
     benchmark.current_network_latency = 0
+    benchmark.current_compression_raw_bytes = 0
+    benchmark.current_compression_wire_bytes = 0
+    benchmark.current_compression_time = 0
+    benchmark.current_decompression_time = 0
     benchmark.encrypt_start_time = 0
     benchmark.encrypt_end_time = 0
     benchmark.operation_start_time = 0
@@ -41,9 +97,22 @@ def reset_benchmark():
 #SECTION - HE SCHEMES
 class HEScheme(ABC):
     """Abstract base class for homomorphic encryption schemes"""
+
+    # Server-side sharding uses threads unless the library holds the GIL while computing
+    server_executor = "thread"
+    # Distribution providing the HE library, its version is part of the context cache key
+    library = None
+    # Whether the contexts depend on the operation (compiled circuits) or only on the key length
+    context_per_operation = False
+    # Whether the evaluation keys generated depend on the key profile
+    uses_key_profile = False
+    # Whether ciphertexts can be multiplied by non-integer scalars, means are otherwise divided after decryption
+    fractional_scalars = False
+    # Plaintext modulus the values wrap around, None when it is out of reach of the benchmarked values
+    plain_modulus = None
     
     @abstractmethod
-    def generate_contexts(self, key_length, operation=None):
+    def generate_contexts(self, key_length, operation=None, key_profile=None, batch_width=1):
         """Generate public and private contexts for the scheme"""
         pass
     
@@ -67,6 +136,16 @@ class HEScheme(ABC):
         """Deserialize encrypted data"""
         pass
     
+    @abstractmethod
+    def serialize_encrypted_binary(self, encrypted_number_list):
+        """Serialize encrypted data to a list of raw byte blobs"""
+        pass
+
+    @abstractmethod
+    def deserialize_encrypted_binary(self, blobs, public_context):
+        """Deserialize encrypted data from a list of raw byte blobs"""
+        pass
+
     @abstractmethod
     def add_scalar(self, enc, scalar):
         """Add a scalar to an encrypted number"""
@@ -97,25 +176,472 @@ class HEScheme(ABC):
         """Deserialize public context"""
         pass
 
+    def slot_count(self, key_length, rotations=False):
+        """Number of plaintext values that fit in one ciphertext, whose slots can be rotated if rotations is set"""
+        return 1
+
+    def encrypt_packed(self, public_context, messages, key_length, rotations=False):
+        """Encrypt a list of messages into as few ciphertexts as the slot count allows"""
+        slots = self.slot_count(key_length, rotations)
+        if slots == 1:
+            return [self.encrypt(public_context, m) for m in messages]
+        return [
+            self.encrypt(public_context, messages[i:i + slots])
+            for i in range(0, len(messages), slots)
+        ]
+
+    def decrypt_batch(self, private_context, encrypted_list):
+        """Decrypt a whole list of ciphertexts in one call"""
+        return [self.decrypt(private_context, m) for m in encrypted_list]
+
+    def decrypt_packed(self, private_context, encrypted_list, batch=False):
+        """Decrypt packed ciphertexts back into a flat list of values"""
+        if batch:
+            return self.decrypt_batch(private_context, encrypted_list)
+        return [self.decrypt(private_context, m) for m in encrypted_list]
+
+    def export_worker_keys(self, public_context, private_context=None):
+        """Export picklable key material for worker processes, None for what cannot be shared"""
+        raise NotImplementedError(f"{type(self).__name__} does not support worker processes")
+
+    def import_worker_keys(self, public_keys, private_keys=None):
+        """Rebuild the public and private contexts inside a worker process"""
+        raise NotImplementedError(f"{type(self).__name__} does not support worker processes")
+
+    def pack_for_worker(self, encrypted_number_list):
+        """Convert encrypted data to a picklable form to cross process boundaries"""
+        return self.serialize_encrypted_binary(encrypted_number_list)
+
+    def value_count(self, encrypted):
+        """Number of values held by a ciphertext"""
+        return 1
+
+    def multiply_plain_values(self, encrypted, values):
+        """Multiply the values of a ciphertext by as many plaintext values"""
+        return self.multiply_scalar(encrypted, values[0])
+
+    def sum_encrypted(self, encrypted_list):
+        """Add ciphertexts together as a tree of pairwise additions, returns a single ciphertext"""
+        while len(encrypted_list) > 1:
+            paired = [self.add_encrypted(a, b) for a, b in zip(encrypted_list[0::2], encrypted_list[1::2])]
+            encrypted_list = paired + encrypted_list[len(paired) * 2:]
+        return encrypted_list[0]
+
+    def ciphertext_state(self, encrypted):
+        """Noise related state of a ciphertext readable without the secret key, None if the scheme has none"""
+        return None
+
+    def noise_budget(self, private_context, encrypted_list):
+        """Smallest noise budget left in a list of ciphertexts in bits, None if the scheme cannot measure it"""
+        return None
+
+    def needs_galois_keys(self, public_context):
+        """Whether Galois keys must still be generated before rotating slots"""
+        return False
+
+    def generate_galois_keys(self, public_context, private_context):
+        """Generate the Galois keys of an existing public context"""
+        raise NotImplementedError(f"{type(self).__name__} does not rotate slots")
+
+    def context_cache_key(self, key_length, operation=None, key_profile=None, batch_width=1):
+        """Digest identifying the contexts generated for a key length (and operation) by this library version"""
+        description = {
+            'scheme': type(self).__name__,
+            'library': self.library,
+            'version': importlib.metadata.version(self.library),
+            'key_length': key_length,
+            'operation': operation if self.context_per_operation else None,
+            'key_profile': key_profile if self.uses_key_profile else None,
+            'batch_width': batch_width if self.context_per_operation else None
+        }
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def public_context_digest(self, serialized_context):
+        """Digest of a serialized public context, identifying it in the key exchange handshake"""
+        return hashlib.sha256(serialized_context.encode('utf-8')).hexdigest()
+
+    def dump_contexts(self, public_context, private_context):
+        """Serialize the public and private contexts, secret key included, for the context cache"""
+        raise NotImplementedError(f"{type(self).__name__} does not support the context cache")
+
+    def load_contexts(self, data):
+        """Rebuild the public and private contexts written by dump_contexts"""
+        raise NotImplementedError(f"{type(self).__name__} does not support the context cache")
+
+    def unpack_from_worker(self, packed, public_context):
+        """Rebuild encrypted data received from another process"""
+        return self.deserialize_encrypted_binary(packed, public_context)
+
+def make_tenseal_context_public(context, key_profile=None):
+    """Detach the secret key of a TenSEAL context, keeping only the evaluation keys of the key profile"""
+    secret_key = context.secret_key()
+    if key_profile is None or key_profile['relin_keys']:
+        context.make_context_public()
+        return context, secret_key
+    # Relinearization keys are generated with the context, they can only be left out when serializing
+    public_context = ts.context_from(context.serialize(save_secret_key=False, save_relin_keys=False))
+    return public_context, secret_key
+
+def sum_tenseal_vectors(encrypted_list, tree_sum):
+    """Add TenSEAL vectors slot-wise per size, then rotate-and-sum the slots of each partial sum"""
+    groups = {}
+    for encrypted in encrypted_list:
+        groups.setdefault(encrypted.size(), []).append(encrypted)
+    partial_sums = [tree_sum(group) for group in groups.values()]
+    return tree_sum([partial.sum() if partial.size() > 1 else partial for partial in partial_sums])
+
+def dump_tenseal_contexts(public_context, secret_key):
+    """Serialize a public TenSEAL context and its detached secret key"""
+    # A detached SecretKey can only be saved to a file by SEAL
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "secret_key.bin")
+        secret_key.data.save(path)
+        with open(path, "rb") as f:
+            secret_key_bytes = f.read()
+    return pack_blobs([public_context.serialize(), secret_key_bytes])
+
+def load_tenseal_contexts(data):
+    """Rebuild a public TenSEAL context and its detached secret key"""
+    (public_bytes, secret_key_bytes), _ = unpack_blobs(data)
+    public_context = ts.context_from(bytes(public_bytes))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "secret_key.bin")
+        with open(path, "wb") as f:
+            f.write(secret_key_bytes)
+        secret_key = ts._ts_cpp.SecretKey()
+        secret_key.load(public_context.data.seal_context(), path)
+    return public_context, ts.enc_context.SecretKey(secret_key)
+
+def mark_obfuscated(encrypted_number):
+    """Flag a Paillier ciphertext as already randomized so phe does not obfuscate it again"""
+    # Ciphertexts read from the wire were obfuscated by the serializer (ciphertext(be_secure=True))
+    encrypted_number._EncryptedNumber__is_obfuscated = True
+    return encrypted_number
+
+class PaillierObfuscatorPool:
+    """
+    Pool of precomputed Paillier obfuscators r^n mod n^2 for one public key.
+    The obfuscator does not depend on the plaintext, so it can be computed ahead of time
+    and encryption becomes (1 + m*n) * r^n mod n^2.
+    Refill strategies:
+      - idle: refill only between start_refill() and stop_refill(), e.g. while waiting on the network.
+      - background: also refill whenever the pool falls below half of its size.
+    """
+    def __init__(self, public_key, size, refill="idle"):
+        self.public_key = public_key
+        self.size = size
+        self.refill = refill
+        self.low_watermark = size // 2
+        self.obfuscators = collections.deque()
+        self.hits = 0
+        self.misses = 0
+        self._stop_refill = threading.Event()
+        self._refill_thread = None
+
+    def _compute_obfuscator(self):
+        r = self.public_key.get_random_lt_n()
+        return powmod(r, self.public_key.n, self.public_key.nsquare)
+
+    def _fill(self):
+        while not self._stop_refill.is_set() and len(self.obfuscators) < self.size:
+            self.obfuscators.append(self._compute_obfuscator())
+
+    def start_refill(self):
+        """Top the pool up in a background thread"""
+        if self._refill_thread is not None and self._refill_thread.is_alive():
+            return
+        self._stop_refill.clear()
+        self._refill_thread = threading.Thread(target=self._fill, daemon=True)
+        self._refill_thread.start()
+
+    def stop_refill(self):
+        """Stop the background refill after the obfuscator being computed"""
+        self._stop_refill.set()
+        if self._refill_thread is not None:
+            self._refill_thread.join()
+
+    def take(self):
+        """Pop a precomputed obfuscator, or compute one on a miss"""
+        try:
+            obfuscator = self.obfuscators.popleft()
+            self.hits += 1
+        except IndexError:
+            obfuscator = self._compute_obfuscator()
+            self.misses += 1
+        if self.refill == "background" and len(self.obfuscators) < self.low_watermark:
+            self.start_refill()
+        return obfuscator
+
+    def encrypt(self, message):
+        """Encrypt a message with one multiplication by a precomputed obfuscator"""
+        encoding = paillier.EncodedNumber.encode(self.public_key, message)
+        # phe uses g = n + 1, so g^m = 1 + m*n mod n^2
+        nude_ciphertext = (self.public_key.n * encoding.encoding + 1) % self.public_key.nsquare
+        ciphertext = nude_ciphertext * self.take() % self.public_key.nsquare
+        return mark_obfuscated(paillier.EncryptedNumber(self.public_key, ciphertext, encoding.exponent))
+
+class PaillierCRTDecryptor:
+    """
+    Batched Paillier decryption with the Chinese Remainder Theorem.
+    The p/q factors and the hp/hq constants are converted once (to gmpy2 mpz when installed),
+    and decoding shares one BASE**exponent scale per distinct exponent of the batch.
+    """
+    def __init__(self, private_key):
+        self.private_key = private_key
+        self.public_key = private_key.public_key
+        to_integer = gmpy2.mpz if HAS_GMPY2 else int
+        self.powmod = gmpy2.powmod if HAS_GMPY2 else pow
+        self.p = to_integer(private_key.p)
+        self.q = to_integer(private_key.q)
+        self.p_minus_1 = self.p - 1
+        self.q_minus_1 = self.q - 1
+        self.psquare = to_integer(private_key.psquare)
+        self.qsquare = to_integer(private_key.qsquare)
+        self.hp = to_integer(private_key.hp)
+        self.hq = to_integer(private_key.hq)
+        self.p_inverse = to_integer(private_key.p_inverse)
+
+    def raw_decrypt(self, ciphertexts):
+        """Decrypt raw ciphertexts to raw plaintexts modulo n"""
+        p, q = self.p, self.q
+        plaintexts = []
+        for ciphertext in ciphertexts:
+            # L(c^(p-1) mod p^2) * hp mod p, same modulo q, then recombine with CRT
+            mp = (self.powmod(ciphertext, self.p_minus_1, self.psquare) - 1) // p * self.hp % p
+            mq = (self.powmod(ciphertext, self.q_minus_1, self.qsquare) - 1) // q * self.hq % q
+            u = (mq - mp) * self.p_inverse % q
+            plaintexts.append(int(mp + u * p))
+        return plaintexts
+
+    def decode(self, encodings, exponents):
+        """Decode raw plaintexts exactly like EncodedNumber.decode, sharing the scale per exponent"""
+        n = self.public_key.n
+        max_int = self.public_key.max_int
+        base = paillier.EncodedNumber.BASE
+        scales = {}
+        values = []
+        for encoding, exponent in zip(encodings, exponents):
+            if encoding <= max_int:
+                mantissa = encoding
+            elif encoding >= n - max_int:
+                mantissa = encoding - n
+            else:
+                raise OverflowError('Overflow detected in decrypted number')
+            if exponent not in scales:
+                scales[exponent] = base ** abs(exponent)
+            if exponent >= 0:
+                values.append(mantissa * scales[exponent])
+            else:
+                values.append(mantissa / scales[exponent])
+        return values
+
+    def decrypt(self, encrypted_number_list):
+        """Decrypt a list of EncryptedNumber"""
+        for encrypted_number in encrypted_number_list[:1]:
+            if encrypted_number.public_key != self.public_key:
+                raise ValueError('encrypted_number was encrypted against a different key!')
+        encodings = self.raw_decrypt([x.ciphertext(be_secure=False) for x in encrypted_number_list])
+        return self.decode(encodings, [x.exponent for x in encrypted_number_list])
+
+class PaillierVector:
+    """
+    Paillier ciphertexts of a vector sharing one exponent, stored as a list of integers (gmpy2 mpz when installed).
+    Exponentiations sharing one exponent (obfuscators, scalar products) go through gmpy2.powmod_base_list,
+    the only gmpy2 arithmetic releasing the GIL, split across threads. The rest holds the GIL and runs in sequence.
+    Results of the arithmetic are not obfuscated, like phe they are randomized once before being serialized.
+    """
+    # Threads of powmod_base_list, unused without it
+    threads = os.cpu_count()
+    _executor = None
+    to_integer = gmpy2.mpz if HAS_GMPY2 else int
+    powmod = gmpy2.powmod if HAS_GMPY2 else pow
+
+    def __init__(self, public_key, ciphertexts, exponent=0, obfuscated=False):
+        self.public_key = public_key
+        self.ciphertexts = ciphertexts
+        self.exponent = exponent
+        self.obfuscated = obfuscated
+        self.n = self.to_integer(public_key.n)
+        self.nsquare = self.to_integer(public_key.nsquare)
+
+    def __len__(self):
+        return len(self.ciphertexts)
+
+    @classmethod
+    def powmod_list(cls, bases, exponent, modulus):
+        """Every base to the same power, in chunks across threads with powmod_base_list"""
+        if not HAS_POWMOD_BASE_LIST:
+            return [cls.powmod(base, exponent, modulus) for base in bases]
+        if cls.threads <= 1 or len(bases) < 2 * cls.threads:
+            return gmpy2.powmod_base_list(bases, exponent, modulus)
+        if cls._executor is None:
+            cls._executor = ThreadPoolExecutor(max_workers=cls.threads)
+        results = cls._executor.map(lambda chunk: gmpy2.powmod_base_list(chunk, exponent, modulus), split_chunks(bases, cls.threads))
+        return list(itertools.chain.from_iterable(results))
+
+    @staticmethod
+    def encode_shared(public_key, values):
+        """Encode values with one exponent, the smallest any of them needs"""
+        exponent = min(paillier.EncodedNumber.encode(public_key, value).exponent for value in values)
+        encodings = [paillier.EncodedNumber.encode(public_key, value, max_exponent=exponent).encoding for value in values]
+        return encodings, exponent
+
+    @classmethod
+    def encrypt(cls, public_key, messages, obfuscator_pool=None):
+        """Encrypt messages as (1 + m*n) * r^n mod n^2, with the obfuscators of the pool when given"""
+        encodings, exponent = cls.encode_shared(public_key, messages)
+        vector = cls(public_key, [], exponent, obfuscated=True)
+        if obfuscator_pool is not None:
+            obfuscators = [cls.to_integer(obfuscator_pool.take()) for _ in encodings]
+        else:
+            obfuscators = vector.random_obfuscators(len(encodings))
+        n, nsquare = vector.n, vector.nsquare
+        vector.ciphertexts = [(n * encoding + 1) % nsquare * obfuscator % nsquare for encoding, obfuscator in zip(encodings, obfuscators)]
+        return vector
+
+    def random_obfuscators(self, count):
+        """r^n mod n^2 for count fresh random r"""
+        return self.powmod_list([self.to_integer(self.public_key.get_random_lt_n()) for _ in range(count)], self.n, self.nsquare)
+
+    def raw_mul_all(self, plaintext):
+        """Ciphertexts of the products of every element by one encoding"""
+        if plaintext >= self.n - self.public_key.max_int:
+            invert = gmpy2.invert if HAS_GMPY2 else lambda c, m: pow(c, -1, m)
+            return self.powmod_list([invert(c, self.nsquare) for c in self.ciphertexts], self.n - plaintext, self.nsquare)
+        return self.powmod_list(self.ciphertexts, plaintext, self.nsquare)
+
+    def raw_mul(self, ciphertext, plaintext):
+        """Ciphertext of the product of a plaintext by an encoding, negative encodings going through the inverse"""
+        if plaintext >= self.n - self.public_key.max_int:
+            inverse = gmpy2.invert(ciphertext, self.nsquare) if HAS_GMPY2 else pow(ciphertext, -1, self.nsquare)
+            return self.powmod(inverse, self.n - plaintext, self.nsquare)
+        return self.powmod(ciphertext, plaintext, self.nsquare)
+
+    def decrease_exponent_to(self, exponent):
+        """Same values with a smaller exponent, scaling the encodings by a power of the base"""
+        if exponent >= self.exponent:
+            return self
+        factor = self.to_integer(paillier.EncodedNumber.BASE ** (self.exponent - exponent))
+        return PaillierVector(self.public_key, self.raw_mul_all(factor), exponent)
+
+    def __add__(self, other):
+        """Add another vector element-wise, or a scalar to every element"""
+        if isinstance(other, PaillierVector):
+            if len(other) != len(self):
+                raise ValueError("Paillier vectors of different lengths")
+            a, b = self.decrease_exponent_to(other.exponent), other.decrease_exponent_to(self.exponent)
+            nsquare = self.nsquare
+            return PaillierVector(self.public_key, [c1 * c2 % nsquare for c1, c2 in zip(a.ciphertexts, b.ciphertexts)], a.exponent)
+
+        encoded = paillier.EncodedNumber.encode(self.public_key, other, max_exponent=self.exponent)
+        a = self.decrease_exponent_to(encoded.exponent)
+        # phe uses g = n + 1, so g^m = 1 + m*n mod n^2
+        nude_ciphertext = (self.n * self.to_integer(encoded.encoding) + 1) % self.nsquare
+        nsquare = self.nsquare
+        return PaillierVector(self.public_key, [c * nude_ciphertext % nsquare for c in a.ciphertexts], a.exponent)
+
+    __radd__ = __add__
+
+    def __mul__(self, other):
+        """Multiply every element by a scalar, or element-wise by a list of plaintext values"""
+        if isinstance(other, PaillierVector):
+            raise NotImplementedError("Paillier does not support multiplication of encrypted numbers")
+        if isinstance(other, list):
+            if len(other) != len(self):
+                raise ValueError("Plaintext values and Paillier vector of different lengths")
+            encodings, exponent = self.encode_shared(self.public_key, other)
+            ciphertexts = [self.raw_mul(c, self.to_integer(encoding)) for c, encoding in zip(self.ciphertexts, encodings)]
+            return PaillierVector(self.public_key, ciphertexts, self.exponent + exponent)
+        encoded = paillier.EncodedNumber.encode(self.public_key, other)
+        return PaillierVector(self.public_key, self.raw_mul_all(self.to_integer(encoded.encoding)), self.exponent + encoded.exponent)
+
+    __rmul__ = __mul__
+
+    def sum(self):
+        """Vector of one element, the sum of all elements, as a tree of ciphertext products"""
+        ciphertexts = self.ciphertexts
+        nsquare = self.nsquare
+        while len(ciphertexts) > 1:
+            products = [c1 * c2 % nsquare for c1, c2 in zip(ciphertexts[0::2], ciphertexts[1::2])]
+            ciphertexts = products + ciphertexts[len(products) * 2:]
+        return PaillierVector(self.public_key, ciphertexts, self.exponent)
+
+    def secure_ciphertexts(self):
+        """Ciphertexts randomized with fresh obfuscators, computed once"""
+        if not self.obfuscated:
+            nsquare = self.nsquare
+            self.ciphertexts = [c * obfuscator % nsquare for c, obfuscator in zip(self.ciphertexts, self.random_obfuscators(len(self)))]
+            self.obfuscated = True
+        return self.ciphertexts
+
+    def to_encrypted_numbers(self):
+        """Elements as phe EncryptedNumber, keeping their obfuscation state"""
+        encrypted_numbers = [paillier.EncryptedNumber(self.public_key, int(c), self.exponent) for c in self.ciphertexts]
+        return [mark_obfuscated(x) for x in encrypted_numbers] if self.obfuscated else encrypted_numbers
+
 class PaillierScheme(HEScheme):
     """Paillier homomorphic encryption scheme implementation"""
+
+    # phe computes with pure Python integers and never releases the GIL
+    server_executor = "process"
+    library = "phe"
+    fractional_scalars = True
+    obfuscator_pool = None
+    crt_decryptor = None
     
-    def generate_contexts(self, key_length, operation=None):
+    def generate_contexts(self, key_length, operation=None, key_profile=None, batch_width=1):
         """Generate a Paillier keypair with optimized parameters"""
         print(f"> Generating Keypair of length {key_length} bits")
         return paillier.generate_paillier_keypair(n_length=key_length)
+
+    def attach_obfuscator_pool(self, public_context, size, refill="idle"):
+        """Use a pool of precomputed obfuscators for the encryptions under this public key"""
+        if self.obfuscator_pool is not None:
+            self.obfuscator_pool.stop_refill()
+        self.obfuscator_pool = PaillierObfuscatorPool(public_context, size, refill=refill)
+        # Start filling right away, the key exchange leaves the client idle
+        self.obfuscator_pool.start_refill()
+        return self.obfuscator_pool
     
     def encrypt(self, public_context, message, private_context=None, message2=None):
         """Encrypt a message using Paillier"""
+        if self.obfuscator_pool is not None and self.obfuscator_pool.public_key == public_context:
+            return self.obfuscator_pool.encrypt(message)
         return public_context.encrypt(message)
+
+    def encrypt_packed(self, public_context, messages, key_length, rotations=False):
+        """Encrypt a list of messages into one array-backed Paillier vector"""
+        obfuscator_pool = self.obfuscator_pool if self.obfuscator_pool is not None and self.obfuscator_pool.public_key == public_context else None
+        return [PaillierVector.encrypt(public_context, messages, obfuscator_pool=obfuscator_pool)]
     
     def decrypt(self, private_context, encrypted_message):
         """Decrypt an encrypted message using Paillier"""
         return private_context.decrypt(encrypted_message)
+
+    def decrypt_packed(self, private_context, encrypted_list, batch=False):
+        """Decrypt Paillier vectors into a flat list of values"""
+        encrypted_numbers = list(itertools.chain.from_iterable(
+            x.to_encrypted_numbers() if isinstance(x, PaillierVector) else [x] for x in encrypted_list
+        ))
+        if batch:
+            return self.decrypt_batch(private_context, encrypted_numbers)
+        return [self.decrypt(private_context, x) for x in encrypted_numbers]
+
+    def decrypt_batch(self, private_context, encrypted_list):
+        """Decrypt a whole list of Paillier ciphertexts with the batched CRT decryptor"""
+        if self.crt_decryptor is None or self.crt_decryptor.private_key is not private_context:
+            self.crt_decryptor = PaillierCRTDecryptor(private_context)
+        return self.crt_decryptor.decrypt(encrypted_list)
     
     def serialize_encrypted(self, encrypted_number_list):
         """Serialize encrypted data for Paillier"""
         print("> Serializing encrypted data")
+        if encrypted_number_list and isinstance(encrypted_number_list[0], PaillierVector):
+            return json.dumps({
+                'vectors': [
+                    (x.exponent, [str(c) for c in x.secure_ciphertexts()]) for x in encrypted_number_list
+                ]
+            })
         enc_dict = {
             'values': [
                 (str(x.ciphertext()), x.exponent) for x in encrypted_number_list
@@ -127,10 +653,58 @@ class PaillierScheme(HEScheme):
         """Deserialize encrypted data for Paillier"""
         print("> Deserializing encrypted data")
         data_dict = json.loads(serialized_data)
+        if 'vectors' in data_dict:
+            return [
+                PaillierVector(public_context, [PaillierVector.to_integer(int(c)) for c in ctxts], int(exp), obfuscated=True)
+                for (exp, ctxts) in data_dict['vectors']
+            ]
         return [
-            paillier.EncryptedNumber(public_context, int(ctxt), int(exp))
+            mark_obfuscated(paillier.EncryptedNumber(public_context, int(ctxt), int(exp)))
             for (ctxt, exp) in data_dict['values']
         ]
+
+    def serialize_encrypted_binary(self, encrypted_number_list):
+        """Serialize Paillier ciphertexts as exponent + fixed-width big-endian integer"""
+        print("> Serializing encrypted data (binary)")
+        if not encrypted_number_list:
+            return []
+        width = paillier_ciphertext_width(encrypted_number_list[0].public_key)
+        if isinstance(encrypted_number_list[0], PaillierVector):
+            # Vectors: exponent, count and the concatenated ciphertexts
+            return [
+                struct.pack('!iI', x.exponent, len(x)) + b''.join(int(c).to_bytes(width, 'big') for c in x.secure_ciphertexts())
+                for x in encrypted_number_list
+            ]
+        return [
+            struct.pack('!i', x.exponent) + x.ciphertext().to_bytes(width, 'big')
+            for x in encrypted_number_list
+        ]
+
+    def deserialize_encrypted_binary(self, blobs, public_context):
+        """Deserialize Paillier ciphertexts from fixed-width big-endian integers"""
+        print("> Deserializing encrypted data (binary)")
+        width = paillier_ciphertext_width(public_context)
+        # A single ciphertext is exactly 4 + width bytes, a vector 8 + count * width
+        if blobs and len(blobs[0]) != 4 + width:
+            return [self.deserialize_vector(blob, public_context, width) for blob in blobs]
+        return [
+            mark_obfuscated(paillier.EncryptedNumber(
+                public_context,
+                int.from_bytes(blob[4:], 'big'),
+                struct.unpack_from('!i', blob)[0]
+            ))
+            for blob in blobs
+        ]
+
+    def deserialize_vector(self, blob, public_context, width):
+        """Rebuild a Paillier vector from its exponent, count and concatenated ciphertexts"""
+        exponent, count = struct.unpack_from('!iI', blob)
+        view = memoryview(blob)[8:]
+        ciphertexts = [
+            PaillierVector.to_integer(int.from_bytes(view[i * width:(i + 1) * width], 'big'))
+            for i in range(count)
+        ]
+        return PaillierVector(public_context, ciphertexts, exponent, obfuscated=True)
     
     def add_scalar(self, enc, scalar):
         """Add a scalar to an encrypted number using Paillier"""
@@ -147,6 +721,18 @@ class PaillierScheme(HEScheme):
     def multiply_encrypted(self, enc1, enc2):
         """Multiply two encrypted numbers using Paillier"""
         raise NotImplementedError("Paillier does not support multiplication of encrypted numbers")
+
+    def value_count(self, encrypted):
+        """Number of values of a Paillier vector, one for a single ciphertext"""
+        return len(encrypted) if isinstance(encrypted, PaillierVector) else 1
+
+    def multiply_plain_values(self, encrypted, values):
+        """Multiply the values of a Paillier vector or ciphertext by plaintext values"""
+        return encrypted * (values if isinstance(encrypted, PaillierVector) else values[0])
+
+    def sum_encrypted(self, encrypted_list):
+        """Sum of Paillier ciphertexts, vectors are first summed in bulk to a single element"""
+        return super().sum_encrypted([x.sum() if isinstance(x, PaillierVector) else x for x in encrypted_list])
     
     def serialize_public_context(self, public_context):
         """Serialize Paillier public key"""
@@ -157,17 +743,61 @@ class PaillierScheme(HEScheme):
         public_context_dict = json.loads(serialized_context)['public_key']
         return paillier.PaillierPublicKey(n=int(public_context_dict['n']))
 
+    def dump_contexts(self, public_context, private_context):
+        """Serialize the Paillier keypair as its modulus and primes"""
+        return json.dumps({'n': public_context.n, 'p': private_context.p, 'q': private_context.q}).encode('utf-8')
+
+    def load_contexts(self, data):
+        """Rebuild the Paillier keypair from its modulus and primes"""
+        keypair = json.loads(data)
+        public_context = paillier.PaillierPublicKey(n=keypair['n'])
+        return public_context, paillier.PaillierPrivateKey(public_context, keypair['p'], keypair['q'])
+
+    def export_worker_keys(self, public_context, private_context=None):
+        """Paillier keys are plain integers and can be pickled as is"""
+        return public_context, private_context
+
+    def import_worker_keys(self, public_keys, private_keys=None):
+        """Paillier keys are used as received"""
+        # Obfuscators inherited from the parent process must never be reused by several processes
+        self.obfuscator_pool = None
+        # Neither can the threads of the parent, they do not exist in a forked child
+        PaillierVector._executor = None
+        return public_keys, private_keys
+
+    def pack_for_worker(self, encrypted_number_list):
+        """Raw ciphertexts with their obfuscation state, so nothing is randomized twice"""
+        return [
+            (x.ciphertexts, x.exponent, x.obfuscated, True) if isinstance(x, PaillierVector)
+            else (x.ciphertext(be_secure=False), x.exponent, x._EncryptedNumber__is_obfuscated, False)
+            for x in encrypted_number_list
+        ]
+
+    def unpack_from_worker(self, packed, public_context):
+        """Rebuild Paillier ciphertexts and vectors with their obfuscation state"""
+        encrypted_number_list = []
+        for ciphertext, exponent, is_obfuscated, is_vector in packed:
+            if is_vector:
+                encrypted_number_list.append(PaillierVector(public_context, ciphertext, exponent, obfuscated=is_obfuscated))
+                continue
+            encrypted_number = paillier.EncryptedNumber(public_context, ciphertext, exponent)
+            encrypted_number_list.append(mark_obfuscated(encrypted_number) if is_obfuscated else encrypted_number)
+        return encrypted_number_list
+
 class BFVScheme(HEScheme):
     """BFV homomorphic encryption scheme implementation using TenSEAL"""
+
+    library = "tenseal"
+    uses_key_profile = True
+    plain_modulus = 1032193
     
-    def generate_contexts(self, key_length, operation=None):
+    def generate_contexts(self, key_length, operation=None, key_profile=None, batch_width=1):
         """Generate a BFV keypair with optimized parameters"""
         print(f"> Generating Keypair of length {key_length} bits")
-        context = ts.context(ts.SCHEME_TYPE.BFV, poly_modulus_degree=key_length, plain_modulus=1032193)
-        context.generate_galois_keys()
-        private_context = context.secret_key()
-        context.make_context_public()
-        return context, private_context
+        context = ts.context(ts.SCHEME_TYPE.BFV, poly_modulus_degree=key_length, plain_modulus=self.plain_modulus)
+        if key_profile is None or key_profile['galois_keys']:
+            context.generate_galois_keys()
+        return make_tenseal_context_public(context, key_profile)
     
     def encrypt(self, public_context, message, private_context=None, message2=None):
         """Encrypt a message using BFV"""
@@ -196,6 +826,16 @@ class BFVScheme(HEScheme):
         # Deserialize each encrypted vector from base64
         serialized_list = json.loads(serialized_data)
         return [ts.bfv_vector_from(public_context, base64.b64decode(serialized)) for serialized in serialized_list]
+
+    def serialize_encrypted_binary(self, encrypted_number_list):
+        """Serialize encrypted data for BFV as raw bytes"""
+        print("> Serializing encrypted data (binary)")
+        return [enc.serialize() for enc in encrypted_number_list]
+
+    def deserialize_encrypted_binary(self, blobs, public_context):
+        """Deserialize encrypted data for BFV from raw bytes"""
+        print("> Deserializing encrypted data (binary)")
+        return [ts.bfv_vector_from(public_context, bytes(blob)) for blob in blobs]
     
     def add_scalar(self, enc, scalar):
         """Add a scalar to an encrypted number using BFV"""
@@ -223,10 +863,75 @@ class BFVScheme(HEScheme):
         serialized_bytes = base64.b64decode(serialized_context)
         return ts.context_from(serialized_bytes)
 
+    def value_count(self, encrypted):
+        """Number of slots used by a BFV vector"""
+        return encrypted.size()
+
+    def multiply_plain_values(self, encrypted, values):
+        """Multiply the slots of a BFV vector by plaintext values"""
+        return encrypted * values
+
+    def sum_encrypted(self, encrypted_list):
+        """Sum of the slots of BFV vectors as a single slot vector, rotating with the Galois keys"""
+        return sum_tenseal_vectors(encrypted_list, super().sum_encrypted)
+
+    def ciphertext_state(self, encrypted):
+        """Moduli left in the chain and polynomial count of a BFV ciphertext"""
+        ciphertext = encrypted.ciphertext()[0]
+        return f"{ciphertext.coeff_modulus_size()} moduli left, size {ciphertext.size()}"
+
+    def noise_budget(self, private_context, encrypted_list):
+        """Smallest invariant noise budget left in BFV ciphertexts, measured with the secret key"""
+        seal_context = encrypted_list[0].context().seal_context().data
+        decryptor = ts._ts_cpp.Decryptor(seal_context, private_context.data)
+        return min(
+            decryptor.invariant_noise_budget(ciphertext)
+            for encrypted in encrypted_list for ciphertext in encrypted.ciphertext()
+        )
+
+    def needs_galois_keys(self, public_context):
+        """Whether the BFV public context still lacks Galois keys"""
+        return not public_context.has_galois_keys()
+
+    def generate_galois_keys(self, public_context, private_context):
+        """Generate the BFV Galois keys with the detached secret key"""
+        print("> Generating Galois keys")
+        public_context.generate_galois_keys(private_context)
+
+    def dump_contexts(self, public_context, private_context):
+        """Serialize the BFV public context and secret key"""
+        return dump_tenseal_contexts(public_context, private_context)
+
+    def load_contexts(self, data):
+        """Rebuild the BFV public context and secret key"""
+        return load_tenseal_contexts(data)
+
+    def export_worker_keys(self, public_context, private_context=None):
+        """Export the BFV public context, the secret key cannot be serialized once detached"""
+        return public_context.serialize(), None
+
+    def import_worker_keys(self, public_keys, private_keys=None):
+        """Rebuild the BFV public context from its serialized form"""
+        return ts.context_from(public_keys), None
+
+    def slot_count(self, key_length, rotations=False):
+        """Number of BFV slots in one ciphertext, rotations only cycle within one of its two rows"""
+        return key_length // 2 if rotations else key_length
+
+    def decrypt_packed(self, private_context, encrypted_list, batch=False):
+        """Decrypt packed BFV vectors and concatenate their slots"""
+        return list(itertools.chain.from_iterable(
+            self.decrypt(private_context, m) for m in encrypted_list
+        ))
+
 class CKKSScheme(HEScheme):
     """CKKS homomorphic encryption scheme implementation using TenSEAL"""
+
+    library = "tenseal"
+    uses_key_profile = True
+    fractional_scalars = True
     
-    def generate_contexts(self, key_length, operation=None):
+    def generate_contexts(self, key_length, operation=None, key_profile=None, batch_width=1):
         """Generate a CKKS keypair with optimized parameters"""
         print(f"> Generating Keypair of length {key_length} bits")
         # Create context with proper parameters
@@ -236,10 +941,9 @@ class CKKSScheme(HEScheme):
             coeff_mod_bit_sizes=[30, 20, 20, 30] * int(key_length/4096) # Set the appropriate coeff_mod_bit_sizes
         )
         context.global_scale = pow(2, 20 * int(key_length/4096))  # Set appropriate scale for CKKS
-        context.generate_galois_keys()
-        private_context = context.secret_key()
-        context.make_context_public()
-        return context, private_context
+        if key_profile is None or key_profile['galois_keys']:
+            context.generate_galois_keys()
+        return make_tenseal_context_public(context, key_profile)
     
     def encrypt(self, public_context, message, private_context=None, message2=None):
         """Encrypt a message using CKKS"""
@@ -268,6 +972,16 @@ class CKKSScheme(HEScheme):
         # Deserialize each encrypted vector from base64
         serialized_list = json.loads(serialized_data)
         return [ts.ckks_vector_from(public_context, base64.b64decode(serialized)) for serialized in serialized_list]
+
+    def serialize_encrypted_binary(self, encrypted_number_list):
+        """Serialize encrypted data for CKKS as raw bytes"""
+        print("> Serializing encrypted data (binary)")
+        return [enc.serialize() for enc in encrypted_number_list]
+
+    def deserialize_encrypted_binary(self, blobs, public_context):
+        """Deserialize encrypted data for CKKS from raw bytes"""
+        print("> Deserializing encrypted data (binary)")
+        return [ts.ckks_vector_from(public_context, bytes(blob)) for blob in blobs]
     
     def add_scalar(self, enc, scalar):
         """Add a scalar to an encrypted number using CKKS"""
@@ -297,10 +1011,65 @@ class CKKSScheme(HEScheme):
         serialized_bytes = base64.b64decode(serialized_context)
         return ts.context_from(serialized_bytes)
 
+    def value_count(self, encrypted):
+        """Number of slots used by a CKKS vector"""
+        return encrypted.size()
+
+    def multiply_plain_values(self, encrypted, values):
+        """Multiply the slots of a CKKS vector by plaintext values"""
+        return encrypted * values
+
+    def sum_encrypted(self, encrypted_list):
+        """Sum of the slots of CKKS vectors as a single slot vector, rotating with the Galois keys"""
+        return sum_tenseal_vectors(encrypted_list, super().sum_encrypted)
+
+    def ciphertext_state(self, encrypted):
+        """Scale, moduli left in the chain and polynomial count of a CKKS ciphertext"""
+        ciphertext = encrypted.ciphertext()[0]
+        return f"scale 2^{np.log2(ciphertext.scale):.1f}, {ciphertext.coeff_modulus_size()} moduli left, size {ciphertext.size()}"
+
+    def needs_galois_keys(self, public_context):
+        """Whether the CKKS public context still lacks Galois keys"""
+        return not public_context.has_galois_keys()
+
+    def generate_galois_keys(self, public_context, private_context):
+        """Generate the CKKS Galois keys with the detached secret key"""
+        print("> Generating Galois keys")
+        public_context.generate_galois_keys(private_context)
+
+    def dump_contexts(self, public_context, private_context):
+        """Serialize the CKKS public context and secret key"""
+        return dump_tenseal_contexts(public_context, private_context)
+
+    def load_contexts(self, data):
+        """Rebuild the CKKS public context and secret key"""
+        return load_tenseal_contexts(data)
+
+    def export_worker_keys(self, public_context, private_context=None):
+        """Export the CKKS public context, the secret key cannot be serialized once detached"""
+        return public_context.serialize(), None
+
+    def import_worker_keys(self, public_keys, private_keys=None):
+        """Rebuild the CKKS public context from its serialized form"""
+        return ts.context_from(public_keys), None
+
+    def slot_count(self, key_length, rotations=False):
+        """Number of CKKS slots in one ciphertext"""
+        return key_length // 2
+
+    def decrypt_packed(self, private_context, encrypted_list, batch=False):
+        """Decrypt packed CKKS vectors and concatenate their slots"""
+        return list(itertools.chain.from_iterable(
+            self.decrypt(private_context, m) for m in encrypted_list
+        ))
+
 class TFHEScheme(HEScheme):
     """TFHE homomorphic encryption scheme implementation using Concrete"""
+
+    library = "concrete-python"
+    context_per_operation = True
     
-    def generate_contexts(self, key_length, operation=None):
+    def generate_contexts(self, key_length, operation=None, key_profile=None, batch_width=1):
         """Generate TFHE circuit and keys"""
         print(f"> Generating TFHE circuit for operation {operation}")
         
@@ -321,15 +1090,31 @@ class TFHEScheme(HEScheme):
             def functionToCompile(x, s):
                 return x * s
             input_types = {"x": "encrypted", "s": "clear"}
+        # Reduction circuits, each run reduces a tensor to a partial aggregate added up by the client
+        elif operation in ('sum', 'mean'):
+            def functionToCompile(x, s):
+                return np.sum(x)
+            input_types = {"x": "encrypted", "s": "clear"}
+        elif operation == 'weighted_sum':
+            def functionToCompile(x, w):
+                return np.sum(x * w)
+            input_types = {"x": "encrypted", "w": "clear"}
+        elif operation == 'dot_product':
+            def functionToCompile(x, y):
+                return np.sum(x * y)
+            input_types = {"x": "encrypted", "y": "encrypted"}
         else:
             raise ValueError(f"Unsupported operation: {operation}")
         
         # Compile the circuit with uint5 range (0-31)
         compiler = fhe.Compiler(functionToCompile, input_types)
-        if operation == "mul_encrypted":
-            inputset = [(i, j) for i in range(MINI_DATA_RANGE) for j in range(MINI_DATA_RANGE)]
+        data_range = MINI_DATA_RANGE if operation in ("mul_encrypted", "dot_product") else DATA_RANGE
+        if batch_width > 1:
+            # Tensor inputs, one run evaluates a whole chunk of batch_width elements
+            print(f"> Compiling over tensors of {batch_width} elements")
+            inputset = [(np.full(batch_width, i), np.full(batch_width, j)) for i in range(data_range) for j in range(data_range)]
         else:
-            inputset = [(i, j) for i in range(DATA_RANGE) for j in range(DATA_RANGE)]
+            inputset = [(i, j) for i in range(data_range) for j in range(data_range)]
         circuit = compiler.compile(inputset)
         circuit.keygen()
         
@@ -337,7 +1122,8 @@ class TFHEScheme(HEScheme):
         private_context = {"circuit_client": circuit.client}
         public_context = {
             "circuit_server": circuit.server,
-            "evaluation_keys": circuit.client.evaluation_keys
+            "evaluation_keys": circuit.client.evaluation_keys,
+            "batch_width": batch_width
         }
         
         return public_context, private_context
@@ -346,14 +1132,38 @@ class TFHEScheme(HEScheme):
         """Encrypt a message using TFHE"""
         if message2 is None:
             message2 = message
+        batch_width = public_context.get("batch_width", 1)
+        if batch_width > 1:
+            return [
+                private_context["circuit_client"].encrypt(d1, d2)
+                for d1, d2 in zip(self.split_tensors(message, batch_width), self.split_tensors(message2, batch_width))
+            ]
         return [
             private_context["circuit_client"].encrypt(d1, d2)
             for d1, d2 in zip(message, message2)
         ]
+
+    def split_tensors(self, message, batch_width):
+        """Split a list into tensors of batch_width elements, the last one padded with zeros"""
+        tensors = []
+        for i in range(0, len(message), batch_width):
+            tensor = np.zeros(batch_width, dtype=np.int64)
+            chunk = message[i:i + batch_width]
+            tensor[:len(chunk)] = chunk
+            tensors.append(tensor)
+        return tensors
     
     def decrypt(self, private_context, encrypted_message):
         """Decrypt an encrypted message using TFHE"""
         return private_context["circuit_client"].decrypt(encrypted_message)
+
+    def decrypt_packed(self, private_context, encrypted_list, batch=False):
+        """Decrypt TFHE results, tensors are concatenated into a flat list"""
+        decrypted_list = []
+        for m in encrypted_list:
+            # Element-wise circuits return tensors, reduction circuits scalars
+            decrypted_list.extend(np.ravel(self.decrypt(private_context, m)).tolist())
+        return decrypted_list
     
     def serialize_encrypted(self, encrypted_data):
         """Serialize encrypted data for TFHE"""
@@ -406,6 +1216,28 @@ class TFHEScheme(HEScheme):
         else:
             # Handle single base64 string
             return fhe.Value.deserialize(base64.b64decode(data))
+
+    def serialize_encrypted_binary(self, encrypted_data):
+        """Serialize encrypted data for TFHE as raw bytes"""
+        print("> Serializing encrypted data (binary)")
+        # Tuples of encrypted arguments are nested as length-prefixed blobs
+        return [
+            b'T' + pack_blobs([ei.serialize() for ei in item]) if isinstance(item, tuple)
+            else b'V' + item.serialize()
+            for item in encrypted_data
+        ]
+
+    def deserialize_encrypted_binary(self, blobs, public_context):
+        """Deserialize encrypted data for TFHE from raw bytes"""
+        print("> Deserializing encrypted data (binary)")
+        deserialized_list = []
+        for blob in blobs:
+            if blob[:1] == b'T':
+                sub_blobs, _ = unpack_blobs(blob, 1)
+                deserialized_list.append(tuple(fhe.Value.deserialize(bytes(ei)) for ei in sub_blobs))
+            else:
+                deserialized_list.append(fhe.Value.deserialize(bytes(blob[1:])))
+        return deserialized_list
     
     def add_scalar(self, enc, scalar):
         """Add a scalar to an encrypted number using TFHE"""
@@ -440,7 +1272,8 @@ class TFHEScheme(HEScheme):
         
         return {
             "circuit_server": circuit_server_bytes,
-            "evaluation_keys": evaluation_keys_base64
+            "evaluation_keys": evaluation_keys_base64,
+            "batch_width": public_context.get("batch_width", 1)
         }
     
     def deserialize_public_context(self, serialized_context):
@@ -461,9 +1294,55 @@ class TFHEScheme(HEScheme):
         
         return {
             "circuit_server": circuit_server,
-            "evaluation_keys": evaluation_keys
+            "evaluation_keys": evaluation_keys,
+            "batch_width": serialized_context.get("batch_width", 1)
         }
 
+    def public_context_digest(self, serialized_context):
+        """Digest of the server circuit files and evaluation keys, ignoring the zip timestamps"""
+        serialized_context = json.loads(serialized_context)
+        digest = hashlib.sha256()
+        with zipfile.ZipFile(io.BytesIO(base64.b64decode(serialized_context["circuit_server"]))) as archive:
+            for name in sorted(archive.namelist()):
+                digest.update(name.encode('utf-8'))
+                digest.update(hashlib.sha256(archive.read(name)).digest())
+        digest.update(serialized_context["evaluation_keys"].encode('utf-8'))
+        digest.update(str(serialized_context.get("batch_width", 1)).encode('utf-8'))
+        return digest.hexdigest()
+
+    def dump_contexts(self, public_context, private_context):
+        """Serialize the compiled server and client circuits and the client keys"""
+        with tempfile.TemporaryDirectory() as directory:
+            public_context["circuit_server"].save(os.path.join(directory, "server.zip"))
+            private_context["circuit_client"].save(os.path.join(directory, "client.zip"))
+            with open(os.path.join(directory, "server.zip"), "rb") as f:
+                server_bytes = f.read()
+            with open(os.path.join(directory, "client.zip"), "rb") as f:
+                client_bytes = f.read()
+        keys_bytes = private_context["circuit_client"].keys.serialize()
+        batch_width_bytes = struct.pack('!I', public_context.get("batch_width", 1))
+        return pack_blobs([server_bytes, client_bytes, keys_bytes, batch_width_bytes])
+
+    def load_contexts(self, data):
+        """Rebuild the server and client circuits without compiling nor generating keys again"""
+        (server_bytes, client_bytes, keys_bytes, batch_width_bytes), _ = unpack_blobs(data)
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, "server.zip"), "wb") as f:
+                f.write(server_bytes)
+            with open(os.path.join(directory, "client.zip"), "wb") as f:
+                f.write(client_bytes)
+            circuit_server = fhe.Server.load(os.path.join(directory, "server.zip"))
+            circuit_client = fhe.Client.load(os.path.join(directory, "client.zip"))
+        circuit_client.keys.load_from_bytes(bytes(keys_bytes))
+
+        private_context = {"circuit_client": circuit_client}
+        public_context = {
+            "circuit_server": circuit_server,
+            "evaluation_keys": circuit_client.evaluation_keys,
+            "batch_width": struct.unpack('!I', batch_width_bytes)[0]
+        }
+        return public_context, private_context
+
 # Dictionary of available schemes
 SCHEMES = {
     'paillier': PaillierScheme(),
@@ -483,19 +1362,36 @@ def create_socket():
     return sock
 
 #ANCHOR - SENDING 
+def send_buffers(sock, buffers):
+    """Send several buffers with scatter-gather I/O, without joining or slicing copies"""
+    views = [memoryview(buffer).cast('B') for buffer in buffers]
+    views = [view for view in views if view.nbytes]
+    if not hasattr(sock, 'sendmsg'):
+        for view in views:
+            sock.sendall(view)
+        return
+
+    while views:
+        sent_bytes = sock.sendmsg(views[:SENDMSG_MAX_BUFFERS])
+        # Drop the fully sent buffers and advance into the partially sent one
+        while views and sent_bytes >= views[0].nbytes:
+            sent_bytes -= views[0].nbytes
+            views.pop(0)
+        if sent_bytes:
+            views[0] = views[0][sent_bytes:]
+
 def send_data(sock, data):
-    """Send data efficiently"""
-    data_bytes = data.encode('utf-8')
-    data_length = len(data_bytes)
-    
-    sock.sendall(struct.pack('!I', data_length))
-    
-    sent_bytes = 0
-    while sent_bytes < data_length:
-        chunk = data_bytes[sent_bytes:sent_bytes + BUFFER_SIZE]
-        sock.sendall(chunk)
-        sent_bytes += len(chunk)
-    
+    """Send data efficiently, compressed if a codec was negotiated on the connection"""
+    data_bytes = data.encode('utf-8') if isinstance(data, str) else memoryview(data).cast('B')
+    compressor = connection_compressors.get(sock)
+    if compressor is None:
+        buffers = [data_bytes]
+    else:
+        buffers = list(compress_message(compressor, data_bytes))
+    data_length = sum(len(buffer) for buffer in buffers)
+
+    send_buffers(sock, [struct.pack('!I', data_length)] + buffers)
+
     benchmark.current_network_bytes_sent += data_length
 
 #ANCHOR - RECEIVING
@@ -503,110 +1399,818 @@ class EmptyResponseError(Exception):
     """Raised when no data is received from the socket"""
     pass
 
-def receive_data(sock):
-    """Receive data efficiently"""
-    raw_length = sock.recv(4)
-    if not raw_length:
-        raise EmptyResponseError("No data received from socket")
-    data_length = struct.unpack('!I', raw_length)[0]
-    
+def receive_into(sock, view):
+    """Fill a memoryview with data from the socket, returns the number of bytes received"""
     received_bytes = 0
-    data_chunks = []
-    while received_bytes < data_length:
-        chunk = sock.recv(min(BUFFER_SIZE, data_length - received_bytes))
-        if not chunk:
+    while received_bytes < view.nbytes:
+        count = sock.recv_into(view[received_bytes:])
+        if not count:
             raise EmptyResponseError("Connection closed while receiving data")
-        data_chunks.append(chunk)
-        received_bytes += len(chunk)
-    
-    data = b''.join(data_chunks).decode('utf-8')
+        received_bytes += count
+    return received_bytes
+
+def receive_data(sock, raw=False):
+    """Receive data efficiently, as a bytearray buffer if raw is set"""
+    raw_length = bytearray(4)
+    if not sock.recv_into(raw_length, 1):
+        raise EmptyResponseError("No data received from socket")
+    receive_into(sock, memoryview(raw_length)[1:])
+    data_length = struct.unpack('!I', raw_length)[0]
+
+    compressor = connection_compressors.get(sock)
+    if compressor is not None:
+        flag = bytearray(1)
+        receive_into(sock, memoryview(flag))
+        data_length -= 1
+
+    # Read straight into a preallocated buffer instead of joining chunks
+    data = bytearray(data_length)
+    received_bytes = receive_into(sock, memoryview(data))
+
+    if compressor is not None:
+        received_bytes += 1
+        data = decompress_message(compressor, flag, data)
+
     benchmark.current_network_bytes_received += received_bytes
+    return data if raw else data.decode('utf-8')
+
+#ANCHOR - COMPRESSION
+# Codec negotiated on each connection, messages are sent uncompressed on the others
+connection_compressors = weakref.WeakKeyDictionary()
+
+def available_codecs():
+    """Compression codecs usable with the installed libraries"""
+    return ["none", "zlib"] + (["zstd"] if HAS_ZSTD else []) + (["lz4"] if HAS_LZ4 else [])
+
+class Compressor:
+    """Compression codec of a connection, at the level given or the default level of the codec"""
+
+    def __init__(self, codec, level=None):
+        if codec not in available_codecs() or codec == "none":
+            raise ValueError(f"Unavailable compression codec: {codec}")
+        self.codec = codec
+        self.level = level
+
+    def compress(self, data):
+        """Compress a bytes-like object"""
+        if self.codec == "zlib":
+            return zlib.compress(data, zlib.Z_DEFAULT_COMPRESSION if self.level is None else self.level)
+        if self.codec == "zstd":
+            # Compressor objects are not thread-safe and streaming sends from several threads
+            return zstandard.ZstdCompressor(level=3 if self.level is None else self.level).compress(data)
+        return lz4.frame.compress(data, compression_level=0 if self.level is None else self.level)
+
+    def decompress(self, data):
+        """Decompress a bytes-like object"""
+        if self.codec == "zlib":
+            return zlib.decompress(data)
+        if self.codec == "zstd":
+            return zstandard.ZstdDecompressor().decompress(data)
+        return lz4.frame.decompress(data)
+
+def compress_message(compressor, data_bytes):
+    """Flag byte and body of a message, compressed only when it is large enough and actually shrinks"""
+    body, flag = data_bytes, b'\x00'
+    if len(data_bytes) >= COMPRESSION_MIN_BYTES:
+        start = time.thread_time()
+        compressed = compressor.compress(data_bytes)
+        benchmark.current_compression_time += time.thread_time() - start
+        if len(compressed) < len(data_bytes):
+            body, flag = compressed, b'\x01'
+    benchmark.current_compression_raw_bytes += len(data_bytes)
+    benchmark.current_compression_wire_bytes += len(body) + 1
+    return flag, body
+
+def decompress_message(compressor, flag, body):
+    """Original data of a message received with its flag byte"""
+    data = body
+    if flag[0]:
+        start = time.thread_time()
+        data = compressor.decompress(body)
+        benchmark.current_decompression_time += time.thread_time() - start
+    benchmark.current_compression_raw_bytes += len(data)
+    benchmark.current_compression_wire_bytes += len(body) + 1
     return data
+
+#ANCHOR - NEGOTIATION
+def compression_proposal(codec, level=None):
+    """Codecs proposed by a client, the requested one first then the fallbacks installed here"""
+    if codec not in available_codecs():
+        print(Fore.RED + f"! Compression codec {codec} is not installed, falling back" + Fore.RESET)
+    codecs = [c for c in dict.fromkeys([codec, "zlib", "none"]) if c in available_codecs()]
+    return {'codecs': codecs, 'level': level, 'level_codec': codec}
+
+def proposal_level(proposal, codec):
+    """Level of a proposal for the negotiated codec, the levels of one codec do not apply to the fallbacks"""
+    return proposal['level'] if codec == proposal['level_codec'] else None
+
+def select_codec(proposal):
+    """First codec of a client proposal installed here, with the level requested for it"""
+    codec = next(c for c in proposal['codecs'] + ["none"] if c in available_codecs())
+    return codec, proposal_level(proposal, codec)
+
+def make_compressor(codec, level=None):
+    """Compressor of a negotiated codec, None when messages are sent as is"""
+    return None if codec == "none" else Compressor(codec, level)
+
+def negotiate_compression_client(sock, codec, level=None):
+    """Propose a codec to the server, returns the codec both sides agreed on"""
+    proposal = compression_proposal(codec, level)
+    send_data(sock, json.dumps(proposal))
+    accepted = json.loads(receive_data(sock))['codec']
+    compressor = make_compressor(accepted, proposal_level(proposal, accepted))
+    if compressor is not None:
+        connection_compressors[sock] = compressor
+    print(f"! Compression negotiated: {accepted}")
+    return accepted
+
+def negotiate_compression_server(sock):
+    """Accept the first codec of the client proposal installed here, returns it"""
+    codec, level = select_codec(json.loads(receive_data(sock)))
+    send_data(sock, json.dumps({'codec': codec}))
+    compressor = make_compressor(codec, level)
+    if compressor is not None:
+        connection_compressors[sock] = compressor
+    print(f"! Compression negotiated: {codec}")
+    return codec
 #!SECTION - END NETWORKING
 
-#SECTION - HOMOMORPHIC OPERATIONS
-#ANCHOR - PERFORM OPERATION
-def perform_homomorphic_operation(scheme, operation, data_list, scalar=None, data_list2=None, nb_operations=1, public_context=None):
-    """Perform a homomorphic operation on encrypted data"""
-    print(f"> Performing homomorphic operation {operation}, {nb_operations} times")
-    data_list_copy = data_list.copy()
-    data_list2_copy = data_list2.copy() if data_list2 is not None else None
-    result = None
+#SECTION - WIRE FORMAT
+#ANCHOR - BLOBS
+def pack_blobs(blobs):
+    """Pack byte blobs as a count followed by length-prefixed blobs"""
+    parts = [struct.pack('!I', len(blobs))]
+    for blob in blobs:
+        parts.append(struct.pack('!I', len(blob)))
+        parts.append(blob)
+    return b''.join(parts)
+
+def unpack_blobs(buffer, offset=0):
+    """Unpack length-prefixed blobs as memoryviews, returns the blobs and the next offset"""
+    view = memoryview(buffer)
+    count = struct.unpack_from('!I', view, offset)[0]
+    offset += 4
+    blobs = []
+    for _ in range(count):
+        length = struct.unpack_from('!I', view, offset)[0]
+        offset += 4
+        blobs.append(view[offset:offset + length])
+        offset += length
+    return blobs, offset
+
+def paillier_ciphertext_width(public_key):
+    """Number of bytes needed to hold any ciphertext modulo n^2"""
+    return (public_key.nsquare.bit_length() + 7) // 8
+
+#ANCHOR - FRAMES
+def encode_frame(header, sections):
+    """Encode a binary frame: magic, JSON header, then one blob list per section"""
+    header_bytes = json.dumps(dict(header, sections=len(sections))).encode('utf-8')
+    parts = [WIRE_MAGIC, struct.pack('!I', len(header_bytes)), header_bytes]
+    parts.extend(pack_blobs(section) for section in sections)
+    return b''.join(parts)
+
+def decode_frame(buffer):
+    """Decode a binary frame, returns the header and the blob lists of each section"""
+    view = memoryview(buffer)
+    if bytes(view[:len(WIRE_MAGIC)]) != WIRE_MAGIC:
+        raise ValueError("Invalid binary frame")
+    offset = len(WIRE_MAGIC)
+    header_length = struct.unpack_from('!I', view, offset)[0]
+    offset += 4
+    header = json.loads(bytes(view[offset:offset + header_length]))
+    offset += header_length
+    sections = []
+    for _ in range(header['sections']):
+        blobs, offset = unpack_blobs(view, offset)
+        sections.append(blobs)
+    return header, sections
+
+#ANCHOR - PAYLOADS
+def encode_payload(scheme, config, operation, scalar, encrypted_data):
+    """Encode the encrypted data sent for computation in the configured wire format"""
+    # The second dataset of the *_encrypted operations is the data itself, TFHE circuits take both at once
+    with_second = takes_second_operand(operation) and not isinstance(scheme, TFHEScheme)
+    if config['wire_format'] == 'binary':
+        blobs = scheme.serialize_encrypted_binary(encrypted_data)
+        sections = [blobs, blobs] if with_second else [blobs]
+        return encode_frame({'operation': operation, 'scalar': scalar}, sections)
+
+    data_to_compute = {
+        'operation': operation,
+        'scalar': scalar,
+        'data': scheme.serialize_encrypted(encrypted_data)
+    }
+    if with_second:
+        data_to_compute['data2'] = data_to_compute['data']
+    return json.dumps(data_to_compute)
+
+def decode_payload(scheme, config, payload, public_context):
+    """Decode the encrypted data sent for computation, returns the operation, scalar and both datasets"""
+    if config['wire_format'] == 'binary':
+        data_to_compute, sections = decode_frame(payload)
+        data_list = scheme.deserialize_encrypted_binary(sections[0], public_context)
+        data_list2 = scheme.deserialize_encrypted_binary(sections[1], public_context) if len(sections) > 1 else None
+    else:
+        data_to_compute = json.loads(payload)
+        data_list = scheme.deserialize_encrypted(data_to_compute['data'], public_context)
+        data_list2 = scheme.deserialize_encrypted(data_to_compute['data2'], public_context) if 'data2' in data_to_compute else None
+    return data_to_compute['operation'], data_to_compute['scalar'], data_list, data_list2
+
+def encode_result(scheme, config, operation, result):
+    """Encode the encrypted result sent back to the client"""
+    if config['wire_format'] == 'binary':
+        return encode_frame({'operation': operation}, [scheme.serialize_encrypted_binary(result)])
+    return scheme.serialize_encrypted(result)
+
+def decode_result(scheme, config, payload, public_context):
+    """Decode the encrypted result received from the server"""
+    if config['wire_format'] == 'binary':
+        _, sections = decode_frame(payload)
+        return scheme.deserialize_encrypted_binary(sections[0], public_context)
+    return scheme.deserialize_encrypted(payload, public_context)
+#!SECTION - END WIRE FORMAT
 
+#SECTION - HOMOMORPHIC OPERATIONS
+#ANCHOR - EVALUATE OPERATION
+def evaluate_operation(scheme, operation, data_list, scalar=None, data_list2=None, public_context=None, value_offset=0):
+    """Evaluate a homomorphic operation once over every element of the data, aggregates reduce them to one ciphertext"""
     # Special handling for TFHE scheme
     if isinstance(scheme, TFHEScheme):
         circuit_server = public_context["circuit_server"]
         evaluation_keys = public_context["evaluation_keys"]
-        
-        for _ in range(nb_operations):
-            if "encrypted" in operation and operation in OPERATIONS_POSSIBLE:
-                result = [
-                    circuit_server.run(
-                        m,
-                        evaluation_keys=evaluation_keys
-                    )
-                    for m in data_list_copy
-                ]
-            elif not "encrypted" in operation and operation in OPERATIONS_POSSIBLE:
-                result = [
-                    circuit_server.run(
-                        enc,
-                        evaluation_keys=evaluation_keys
-                    )
-                    for enc in data_list_copy
-                ]
-            else:
-                raise ValueError(f"Unsupported operation: {operation}")
+
+        if "encrypted" in operation and operation in OPERATIONS_POSSIBLE:
+            return [
+                circuit_server.run(
+                    m,
+                    evaluation_keys=evaluation_keys
+                )
+                for m in data_list
+            ]
+        elif not "encrypted" in operation and operation in OPERATIONS_POSSIBLE:
+            return [
+                circuit_server.run(
+                    enc,
+                    evaluation_keys=evaluation_keys
+                )
+                for enc in data_list
+            ]
+        else:
+            raise ValueError(f"Unsupported operation: {operation}")
+
+    # Original implementation for other schemes
+    if operation == 'add_scalar':
+        return [scheme.add_scalar(m, scalar) for m in data_list]
+    elif operation == 'add_encrypted':
+        return [scheme.add_encrypted(m, m2) for m, m2 in zip(data_list, data_list2)]
+    elif operation == 'mul_scalar':
+        return [scheme.multiply_scalar(m, scalar) for m in data_list]
+    elif operation == 'mul_encrypted':
+        return [scheme.multiply_encrypted(m, m2) for m, m2 in zip(data_list, data_list2)]
+    elif operation in AGGREGATE_OPERATIONS:
+        return evaluate_aggregate(scheme, operation, data_list, scalar=scalar, data_list2=data_list2, value_offset=value_offset)
     else:
-        # Original implementation for other schemes
-        for _ in range(nb_operations):
-            if operation == 'add_scalar':
-                result = [scheme.add_scalar(m, scalar) for m in data_list_copy]
-            elif operation == 'add_encrypted':
-                result = [scheme.add_encrypted(m, m2) for m, m2 in zip(data_list_copy, data_list2_copy)]
-            elif operation == 'mul_scalar':
-                result = [scheme.multiply_scalar(m, scalar) for m in data_list_copy]
-            elif operation == 'mul_encrypted':
-                result = [scheme.multiply_encrypted(m, m2) for m, m2 in zip(data_list_copy, data_list2_copy)]
-            else:
-                raise ValueError(f"Unsupported operation: {operation}")
+        raise ValueError(f"Unsupported operation: {operation}")
+
+def evaluate_operation_repeated(scheme, operation, data_list, scalar=None, data_list2=None, nb_operations=1, public_context=None, value_offset=0):
+    """Evaluate a homomorphic operation nb_operations times, keeping the last result"""
+    result = None
+    for _ in range(nb_operations):
+        result = evaluate_operation(
+            scheme, operation, data_list, scalar=scalar, data_list2=data_list2,
+            public_context=public_context, value_offset=value_offset
+        )
+    return result
+
+#ANCHOR - AGGREGATES
+def takes_second_operand(operation):
+    """Whether an operation, or one stage of a pipeline, takes a second encrypted dataset"""
+    return uses_operations(operation, SECOND_OPERAND_OPERATIONS)
+
+def rotates_slots(operation, packed):
+    """Whether an operation sums the slots of packed ciphertexts, which needs Galois keys, None being no operation"""
+    return packed and operation is not None and uses_operations(operation, GALOIS_KEY_OPERATIONS)
+
+def aggregate_weights(value_offset, nb_values, scalar):
+    """Clear weights of a weighted sum, cycling from 1 to scalar over the positions of the values"""
+    return [1 + (value_offset + i) % scalar for i in range(nb_values)]
+
+def evaluate_aggregate(scheme, operation, data_list, scalar=None, data_list2=None, value_offset=0, nb_values=None):
+    """
+    Reduce the encrypted values to a single ciphertext, by a tree of additions and a rotate-and-sum over packed slots.
+    value_offset is the position of the first value of a shard in the weights, nb_values the count a mean divides by.
+    """
+    if operation == "weighted_sum":
+        terms = []
+        for encrypted in data_list:
+            count = scheme.value_count(encrypted)
+            terms.append(scheme.multiply_plain_values(encrypted, aggregate_weights(value_offset, count, scalar)))
+            value_offset += count
+    elif operation == "dot_product":
+        terms = [scheme.multiply_encrypted(m, m2) for m, m2 in zip(data_list, data_list2)]
+    else:
+        terms = data_list
+
+    total = scheme.sum_encrypted(terms)
+    if operation == "mean" and scheme.fractional_scalars:
+        nb_values = nb_values or sum(scheme.value_count(encrypted) for encrypted in data_list)
+        total = scheme.multiply_scalar(total, 1 / nb_values)
+    return [total]
+
+def plain_value_bound(operation, nb_data, scalar, data_range):
+    """Largest value an operation or pipeline can reach on nb_data values below data_range, the second operand being the data"""
+    largest = bound = data_range - 1
+    for stage in operation_stages(operation):
+        if stage == "add_scalar":
+            bound += scalar
+        elif stage == "add_encrypted":
+            bound += largest
+        elif stage == "mul_scalar":
+            bound *= scalar
+        elif stage == "mul_encrypted":
+            bound *= largest
+        elif stage == "weighted_sum":
+            bound *= sum(aggregate_weights(0, nb_data, scalar))
+        elif stage == "dot_product":
+            bound *= largest * nb_data
+        else:
+            # Means of integer schemes are divided after decryption
+            bound *= nb_data
+    return bound
+
+def plain_aggregate(operation, data, scalar, value_offset=0):
+    """Expected value of an aggregate computed in the clear, value_offset is the position of the first value"""
+    if operation == "weighted_sum":
+        return sum(w * x for w, x in zip(aggregate_weights(value_offset, len(data), scalar), data))
+    if operation == "dot_product":
+        return sum(x * x for x in data)
+    total = sum(data)
+    return total / len(data) if operation == "mean" else total
+
+def plain_pipeline(operation, data, scalar):
+    """Values of an operation or pipeline computed in the clear, the second operand being the data"""
+    values = data
+    for stage in operation_stages(operation):
+        if stage == "add_scalar":
+            values = [x + scalar for x in values]
+        elif stage == "add_encrypted":
+            values = [x + y for x, y in zip(values, data)]
+        elif stage == "mul_scalar":
+            values = [x * scalar for x in values]
+        elif stage == "mul_encrypted":
+            values = [x * y for x, y in zip(values, data)]
+        elif stage == "dot_product":
+            values = [sum(x * y for x, y in zip(values, data))]
+        else:
+            values = [plain_aggregate(stage, values, scalar)]
+    return values
+
+def finish_aggregate(scheme, operation, decrypted_result, nb_data):
+    """
+    Single value of a decrypted aggregate, partial aggregates (TFHE tensors, pool shards) are added up.
+    Means of integer schemes are divided here, only scalar products may follow them in a pipeline.
+    """
+    values = list(itertools.chain.from_iterable(v if isinstance(v, list) else [v] for v in decrypted_result))
+    total = sum(values)
+    if "mean" in operation_stages(operation) and not scheme.fractional_scalars:
+        total /= nb_data
+    return [total]
+
+#ANCHOR - PIPELINE
+def operation_stages(operation):
+    """Stages of a pipeline such as "mul_scalar->add_encrypted", a single operation being a one stage pipeline"""
+    stages = [stage.strip() for stage in operation.split(PIPELINE_SEPARATOR)]
+    for stage in stages:
+        if stage not in OPERATIONS_POSSIBLE:
+            raise ValueError(f"Unsupported operation: {stage}")
+    return stages
+
+def is_pipeline(operation):
+    """Whether an operation is a pipeline of several stages"""
+    return PIPELINE_SEPARATOR in operation
+
+def uses_operations(operation, candidates):
+    """Whether an operation, or one stage of a pipeline, is among the candidates"""
+    return any(stage in candidates for stage in operation_stages(operation))
+
+def evaluate_pipeline(scheme, operation, data_list, scalar=None, data_list2=None, public_context=None, pool=None, stage_details=None):
+    """
+    Evaluate the stages as a chain, each stage on the ciphertexts of the previous one.
+    The *_encrypted stages take the second dataset as their other operand.
+    TenSEAL relinearizes, rescales and switches moduli automatically (auto_relin, auto_rescale, auto_mod_switch).
+    """
+    result = data_list
+    for index, stage in enumerate(operation_stages(operation), 1):
+        start = time.perf_counter()
+        if pool is not None:
+            # Stages are sharded one at a time to time them, process pools serialize the intermediate ciphertexts
+            result = pool.evaluate(stage, result, scalar=scalar, data_list2=data_list2)
+        else:
+            result = evaluate_operation(scheme, stage, result, scalar=scalar, data_list2=data_list2, public_context=public_context)
+        duration = time.perf_counter() - start
+        state = scheme.ciphertext_state(result[0]) if result else None
+        print(f"> Stage {index} {stage}: {duration:.6f} seconds" + (f", {state}" if state else ""))
+
+        if stage_details is not None:
+            # Durations add up over the chunks of a streamed run
+            label = f"Stage {index} {stage}"
+            stage_details[f"{label} Duration (seconds)"] = round(stage_details.get(f"{label} Duration (seconds)", 0) + duration, 6)
+            if state:
+                stage_details[f"{label} Ciphertext"] = state
     return result
+
+#ANCHOR - PERFORM OPERATION
+def perform_homomorphic_operation(scheme, operation, data_list, scalar=None, data_list2=None, nb_operations=1, public_context=None, pool=None, stage_details=None):
+    """Perform a homomorphic operation on encrypted data, pipelines are evaluated once as a chain"""
+    data_list_copy = data_list.copy()
+    data_list2_copy = data_list2.copy() if data_list2 is not None else None
+
+    if is_pipeline(operation):
+        print(f"> Evaluating pipeline {operation} on {len(data_list)} ciphertexts")
+        return evaluate_pipeline(
+            scheme, operation, data_list_copy, scalar=scalar, data_list2=data_list2_copy,
+            public_context=public_context, pool=pool, stage_details=stage_details
+        )
+
+    print(f"> Performing homomorphic operation {operation}, {nb_operations} times on {len(data_list)} ciphertexts")
+
+    if pool is not None:
+        print(f"> Sharding the data across {pool.workers} {pool.kind} workers")
+        return pool.evaluate(operation, data_list_copy, scalar=scalar, data_list2=data_list2_copy, nb_operations=nb_operations)
+
+    return evaluate_operation_repeated(
+        scheme,
+        operation,
+        data_list_copy,
+        scalar=scalar,
+        data_list2=data_list2_copy,
+        nb_operations=nb_operations,
+        public_context=public_context
+    )
 #!SECTION - END HOMOMORPHIC OPERATIONS
 
+#SECTION - WORKER POOL
+#ANCHOR - WORKER PROCESS
+_WORKER_STATE = {}
+
+def _init_worker(scheme_name, public_keys, private_keys):
+    """Load the key material once per worker process"""
+    scheme = SCHEMES[scheme_name]
+    public_context, private_context = scheme.import_worker_keys(public_keys, private_keys)
+    _WORKER_STATE['scheme'] = scheme
+    _WORKER_STATE['public_context'] = public_context
+    _WORKER_STATE['private_context'] = private_context
+
+def _worker_ready(_):
+    """Return the worker pid, used to start every worker ahead of the measurements"""
+    return os.getpid()
+
+def _worker_encrypt(messages, packed, key_length, rotations=False):
+    """Encrypt a chunk of messages and return them as binary blobs"""
+    scheme = _WORKER_STATE['scheme']
+    public_context = _WORKER_STATE['public_context']
+    if packed:
+        encrypted = scheme.encrypt_packed(public_context, messages, key_length, rotations)
+    else:
+        encrypted = [scheme.encrypt(public_context, m) for m in messages]
+    return scheme.pack_for_worker(encrypted)
+
+def _worker_decrypt(packed_data, packed, batch):
+    """Decrypt a chunk of encrypted data"""
+    scheme = _WORKER_STATE['scheme']
+    encrypted = scheme.unpack_from_worker(packed_data, _WORKER_STATE['public_context'])
+    if packed:
+        return scheme.decrypt_packed(_WORKER_STATE['private_context'], encrypted, batch=batch)
+    if batch:
+        return scheme.decrypt_batch(_WORKER_STATE['private_context'], encrypted)
+    return [scheme.decrypt(_WORKER_STATE['private_context'], m) for m in encrypted]
+
+def _worker_evaluate(operation, packed_data, packed_data2, scalar, nb_operations, value_offset=0):
+    """Evaluate an operation over a shard of encrypted data"""
+    scheme = _WORKER_STATE['scheme']
+    public_context = _WORKER_STATE['public_context']
+    data_list = scheme.unpack_from_worker(packed_data, public_context)
+    data_list2 = scheme.unpack_from_worker(packed_data2, public_context) if packed_data2 is not None else None
+    result = evaluate_operation_repeated(
+        scheme, operation, data_list, scalar=scalar, data_list2=data_list2,
+        nb_operations=nb_operations, public_context=public_context, value_offset=value_offset
+    )
+    return scheme.pack_for_worker(result)
+
+#ANCHOR - CHUNKS
+def split_chunks(items, nb_chunks, align=1):
+    """Split items into at most nb_chunks contiguous chunks whose sizes are multiples of align"""
+    nb_blocks = -(-len(items) // align)
+    blocks_per_chunk = max(1, -(-nb_blocks // nb_chunks))
+    chunk_size = blocks_per_chunk * align
+    return [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+
+#ANCHOR - POOL
+class WorkerPool:
+    """Process pool whose workers receive the scheme key material once, in their initializer"""
+
+    def __init__(self, scheme_name, public_context, private_context, workers):
+        self.scheme = SCHEMES[scheme_name]
+        self.public_context = public_context
+        self.workers = workers
+        public_keys, private_keys = self.scheme.export_worker_keys(public_context, private_context)
+        self.can_decrypt = private_keys is not None
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(scheme_name, public_keys, private_keys)
+        )
+        # Start every worker now so process startup is not measured
+        list(self.executor.map(_worker_ready, range(workers)))
+
+    def encrypt(self, data, packed=False, key_length=None, rotations=False):
+        """Encrypt data across the workers, results keep the input order"""
+        align = self.scheme.slot_count(key_length, rotations) if packed else 1
+        chunks = split_chunks(data, self.workers, align=align)
+        nb_chunks = len(chunks)
+        packed_chunks = self.executor.map(_worker_encrypt, chunks, [packed] * nb_chunks, [key_length] * nb_chunks, [rotations] * nb_chunks)
+        return self.scheme.unpack_from_worker(
+            list(itertools.chain.from_iterable(packed_chunks)), self.public_context
+        )
+
+    def decrypt(self, encrypted_data, packed=False, batch=False):
+        """Decrypt data across the workers, results keep the input order"""
+        chunks = split_chunks(self.scheme.pack_for_worker(encrypted_data), self.workers)
+        return list(itertools.chain.from_iterable(
+            self.executor.map(_worker_decrypt, chunks, [packed] * len(chunks), [batch] * len(chunks))
+        ))
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+class OperationPool:
+    """Server-side pool sharding the evaluation: threads when the native library releases the GIL, processes otherwise"""
+
+    def __init__(self, scheme_name, public_context, workers):
+        self.scheme = SCHEMES[scheme_name]
+        self.public_context = public_context
+        self.workers = workers
+        self.kind = self.scheme.server_executor
+        if self.kind == "process":
+            public_keys, _ = self.scheme.export_worker_keys(public_context)
+            self.executor = ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_worker,
+                initargs=(scheme_name, public_keys, None)
+            )
+            # Start every worker now so process startup is not measured
+            list(self.executor.map(_worker_ready, range(workers)))
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def _evaluate_shard(self, operation, shard, shard2, scalar, nb_operations, value_offset=0):
+        return evaluate_operation_repeated(
+            self.scheme, operation, shard, scalar=scalar, data_list2=shard2,
+            nb_operations=nb_operations, public_context=self.public_context, value_offset=value_offset
+        )
+
+    def evaluate(self, operation, data_list, scalar=None, data_list2=None, nb_operations=1):
+        """Evaluate the operation shard by shard, results keep the input order"""
+        shards = split_chunks(data_list, self.workers)
+        shards2 = split_chunks(data_list2, self.workers) if data_list2 is not None else [None] * len(shards)
+        nb_shards = len(shards)
+
+        # Shards reduce their own values, a mean is only divided once the partial sums are added up
+        shard_operation = "sum" if operation == "mean" else operation
+        shard_counts = [sum(self.scheme.value_count(encrypted) for encrypted in shard) for shard in shards]
+        value_offsets = list(itertools.accumulate([0] + shard_counts[:-1]))
+
+        if self.kind == "process":
+            results = self.executor.map(
+                _worker_evaluate,
+                [shard_operation] * nb_shards,
+                [self.scheme.pack_for_worker(shard) for shard in shards],
+                [self.scheme.pack_for_worker(shard2) if shard2 is not None else None for shard2 in shards2],
+                [scalar] * nb_shards,
+                [nb_operations] * nb_shards,
+                value_offsets
+            )
+            result = self.scheme.unpack_from_worker(list(itertools.chain.from_iterable(results)), self.public_context)
+        else:
+            results = self.executor.map(
+                self._evaluate_shard,
+                [shard_operation] * nb_shards,
+                shards,
+                shards2,
+                [scalar] * nb_shards,
+                [nb_operations] * nb_shards,
+                value_offsets
+            )
+            result = list(itertools.chain.from_iterable(results))
+
+        # TFHE circuits cannot add outside of a run, the client adds the partial aggregates up
+        if operation in AGGREGATE_OPERATIONS and not isinstance(self.scheme, TFHEScheme):
+            return evaluate_aggregate(self.scheme, "mean" if operation == "mean" else "sum", result, nb_values=sum(shard_counts))
+        return result
+
+    def shutdown(self):
+        self.executor.shutdown()
+#!SECTION - END WORKER POOL
+
+#SECTION - SPEEDUP REPORT
+#ANCHOR - RECORD
+OPERATION_DURATIONS = {}
+
+def record_operation_duration(config, duration):
+    """Keep the operation phase duration of a run, grouped by configuration and worker count"""
+    key = (config['scheme'], config['operation'], config['key_length'], config['nb_data'])
+    OPERATION_DURATIONS.setdefault(key, {}).setdefault(config['workers'], []).append(duration)
+
+#ANCHOR - REPORT
+def write_speedup_report(folder_prefix=""):
+    """Write the speedup of the operation phase per worker count, relative to the fewest workers tested"""
+    if not OPERATION_DURATIONS:
+        return
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    os.makedirs("results_profile", exist_ok=True)
+    report_file = os.path.join("results_profile", f"{folder_prefix or 'server'}_speedup_{timestamp}.md")
+    print(Fore.GREEN + f"Saving speedup report to: {report_file}" + Fore.RESET)
+
+    benchmark.log_message("# Operation Speedup Per Core Count", report_file)
+    benchmark.log_message(f"- Available Cores: {os.cpu_count()}", report_file)
+    benchmark.log_message("", report_file)
+    benchmark.log_message("| Scheme | Operation | Key Length | NB Data | Workers | Average Operation Duration | Speedup | Efficiency |", report_file)
+    benchmark.log_message("|---|---|---|---|---|---|---|---|", report_file)
+    for (scheme_name, operation, key_length, nb_data), durations_by_workers in OPERATION_DURATIONS.items():
+        baseline_workers = min(durations_by_workers)
+        baseline = sum(durations_by_workers[baseline_workers]) / len(durations_by_workers[baseline_workers])
+        for workers in sorted(durations_by_workers):
+            durations = durations_by_workers[workers]
+            average = sum(durations) / len(durations)
+            speedup = baseline / average if average > 0 else 0
+            efficiency = speedup * baseline_workers / workers
+            benchmark.log_message(
+                f"| {scheme_name} | {operation} | {key_length} | {nb_data} | {workers} | "
+                f"{average:.6f} seconds | {speedup:.2f}x | {efficiency:.0%} |",
+                report_file
+            )
+#!SECTION - END SPEEDUP REPORT
+
+#SECTION - CONTEXT CACHE
+#ANCHOR - CONTENT STORE
+class ContentStore:
+    """
+    Content-addressed blobs on disk, named by their digest.
+    Reading an entry refreshes its modification time, and the least recently used entries
+    are evicted once the store grows over max_bytes.
+    """
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # Entries may hold secret keys
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    def path(self, digest):
+        """File holding an entry"""
+        return os.path.join(self.directory, f"{digest}.bin")
+
+    def get(self, digest):
+        """Read an entry, None when it is not stored"""
+        path = self.path(digest)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        os.utime(path)
+        return data
+
+    def put(self, digest, data):
+        """Store an entry, then evict the least recently used ones over the size limit"""
+        path = self.path(digest)
+        # A temporary file per call, concurrent sessions of the async server put the same digest from several threads
+        fd, temporary_path = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+        self.evict(keep=digest)
+
+    def evict(self, keep=None):
+        """Remove the least recently used entries until the store fits in max_bytes"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".bin"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                # Evicted meanwhile by another thread or process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total_size <= self.max_bytes:
+                break
+            if name == f"{keep}.bin":
+                continue
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+#ANCHOR - CONTEXTS
+def load_or_generate_contexts(scheme, key_length, operation=None, store=None, key_profile=None, batch_width=1):
+    """Load the contexts from the cache, or generate them and store them for the next sweeps"""
+    if store is None:
+        return scheme.generate_contexts(key_length, operation=operation, key_profile=key_profile, batch_width=batch_width)
+
+    digest = scheme.context_cache_key(key_length, operation, key_profile, batch_width)
+    data = store.get(digest)
+    if data is not None:
+        print(f"> Loading cached contexts {digest[:12]}")
+        return scheme.load_contexts(data)
+
+    public_context, private_context = scheme.generate_contexts(key_length, operation=operation, key_profile=key_profile, batch_width=batch_width)
+    store.put(digest, scheme.dump_contexts(public_context, private_context))
+    return public_context, private_context
+#ANCHOR - KEY PROFILE
+def key_profile(operations, profile="auto"):
+    """Evaluation keys to generate for a set of operations, all of them for the full profile"""
+    if profile == "full":
+        return {'relin_keys': True, 'galois_keys': True}
+    return {
+        'relin_keys': any(uses_operations(operation, RELIN_KEY_OPERATIONS) for operation in operations),
+        # Generated on demand by the first operation rotating slots
+        'galois_keys': False
+    }
+#!SECTION - END CONTEXT CACHE
+
 #SECTION - KEY EXCHANGE
 #ANCHOR - SEND KEY
-def send_public_context(sock, scheme, public_context):
-    """Send public key efficiently"""
-    print("> Sending Public Key to Server")
-    key_data = scheme.serialize_public_context(public_context)
-    send_data(sock, json.dumps(key_data))
+def send_public_context(sock, scheme, public_context, handshake=False):
+    """Send public key efficiently, only its digest when the server already holds it, and return its size"""
+    key_data = json.dumps(scheme.serialize_public_context(public_context))
+    if handshake:
+        digest = scheme.public_context_digest(key_data)
+        print(f"> Sending Public Key digest {digest[:12]} to Server")
+        send_data(sock, json.dumps({'context_digest': digest}))
+        reply = receive_data(sock)
+        if reply == "hit":
+            print(f"> Server already holds the Public Key, {len(key_data)} bytes not sent")
+        elif reply == "miss":
+            print("> Sending Public Key to Server")
+            send_data(sock, key_data)
+        else:
+            raise ValueError("Unexpected response from server")
+    else:
+        print("> Sending Public Key to Server")
+        send_data(sock, key_data)
     
     # Wait for server completion
     print("> Waiting for server completion...")
     if receive_data(sock) != "finished":
         raise ValueError("Unexpected response from server")
+    return len(key_data)
 
 #ANCHOR - RECEIVE KEY
-def receive_public_context(sock, scheme):
-    """Receive public key efficiently"""
-    print("> Receiving Public Key from Client")
-    data = receive_data(sock)
+def receive_public_context(sock, scheme, store=None):
+    """Receive public key efficiently, reusing the copy from the store when the digest is known, and return its size"""
+    if store is not None:
+        digest = json.loads(receive_data(sock))['context_digest']
+        stored = store.get(digest)
+        if stored is not None:
+            print(f"> Public Key {digest[:12]} found in the store")
+            send_data(sock, "hit")
+            data = stored.decode('utf-8')
+        else:
+            print(f"> Public Key {digest[:12]} unknown, receiving it from Client")
+            send_data(sock, "miss")
+            data = receive_data(sock)
+            if scheme.public_context_digest(data) != digest:
+                raise ValueError("Public Key does not match its digest")
+            store.put(digest, data.encode('utf-8'))
+    else:
+        print("> Receiving Public Key from Client")
+        data = receive_data(sock)
     public_context = scheme.deserialize_public_context(data)
     
     # Signal completion to client
     print("> Signaling completion to client...")
     send_data(sock, "finished")
-    return public_context
+    return public_context, len(data)
 #!SECTION - END KEY EXCHANGE
 
 #SECTION - MEDICAL DATA
 #ANCHOR - GENERATE DATA
 def generate_data(num_elements, operation=None, scheme=None):
     """Generate data for homomorphic operations"""
-    if isinstance(scheme, TFHEScheme) and operation == "mul_encrypted":
-        return [random.randint(0, MINI_DATA_RANGE) for _ in range(num_elements)]
+    # Sums of products overflow the plaintext modulus of BFV and the circuits of TFHE on the full range
+    # Values stay below the range, the TFHE circuits are compiled over range(DATA_RANGE)
+    if (isinstance(scheme, TFHEScheme) and operation == "mul_encrypted") or operation == "dot_product":
+        return [random.randrange(MINI_DATA_RANGE) for _ in range(num_elements)]
     else:
-        return [random.randint(0, DATA_RANGE) for _ in range(num_elements)]
+        return [random.randrange(DATA_RANGE) for _ in range(num_elements)]
 #!SECTION - END MEDICAL DATA
 
 #SECTION - LATENCY
@@ -652,61 +2256,339 @@ def measure_latency_server(sock):
     benchmark.current_network_latency = rtt_server
 #!SECTION - END LATENCY
 
-#SECTION - CLIENT WORKFLOW
-#ANCHOR - RUN OPERATIONS
-def run_client_operations(sock, scheme, operation, public_context, private_context, config):
-    """Run client operations efficiently"""
-    measure_latency_client(sock)
+#SECTION - STREAMING
+#ANCHOR - CHUNKS IN FLIGHT
+def record_chunk_spans(phase, spans):
+    """Set the phase timestamps from the first to the last chunk, and log the chunk count and busy time"""
+    if not spans:
+        return
+    setattr(benchmark, f"{phase}_start_time", spans[0][0])
+    setattr(benchmark, f"{phase}_end_time", spans[-1][1])
+    benchmark.phase_details.setdefault(phase, {}).update({
+        'Chunks': len(spans),
+        'Busy Time': f"{sum(end - start for start, end in spans):.6f} seconds"
+    })
+
+#ANCHOR - STREAM CLIENT
+def stream_client_chunks(sock, scheme, operation, data, scalar, public_context, private_context, config, pool=None):
+    """
+    Encrypt chunk k+1 while chunk k is sent and earlier chunks are computed, results are decrypted as they arrive.
+    At most stream_window chunks are in flight, which bounds the encrypted data held in memory.
+    """
+    chunk_size = config['stream_chunk']
+    chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+    print(f"> Streaming {len(data)} elements in {len(chunks)} chunks, {config['stream_window']} in flight")
+    window = threading.Semaphore(config['stream_window'])
+    send_queue = queue.Queue()
+    results = []
+    errors = []
+    encrypt_spans, decrypt_spans = [], []
+
+    def sender():
+        try:
+            while (payload := send_queue.get()) is not None:
+                send_data(sock, payload)
+        except Exception as e:
+            errors.append(e)
+            window.release(len(chunks))
 
-    nb_data = config['nb_data']
+    def receiver():
+        try:
+            for chunk in chunks:
+                encrypted_result = decode_result(scheme, config, receive_data(sock, raw=True), public_context)
+                start = time.perf_counter()
+                results.extend(decrypt_data(scheme, encrypted_result, len(chunk), private_context, config, pool=pool))
+                decrypt_spans.append((start, time.perf_counter()))
+                benchmark.record_phase_span('decrypt', *decrypt_spans[-1])
+                window.release()
+        except Exception as e:
+            errors.append(e)
+            window.release(len(chunks))
+
+    threads = [threading.Thread(target=sender, daemon=True), threading.Thread(target=receiver, daemon=True)]
+    for thread in threads:
+        thread.start()
+    for chunk in chunks:
+        window.acquire()
+        if errors:
+            break
+        start = time.perf_counter()
+        payload = encode_payload(scheme, config, operation, scalar, encrypt_data(scheme, operation, chunk, scalar, public_context, private_context, config, pool=pool))
+        encrypt_spans.append((start, time.perf_counter()))
+        benchmark.record_phase_span('encrypt', *encrypt_spans[-1])
+        send_queue.put(payload)
+    send_queue.put(None)
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+    record_chunk_spans('encrypt', encrypt_spans)
+    record_chunk_spans('decrypt', decrypt_spans)
+    return results
+
+#ANCHOR - STREAM SERVER
+def stream_server_chunks(sock, scheme, config, public_context, pool=None):
+    """Compute the chunks in order, the next ones are received and deserialized meanwhile"""
+    nb_chunks = -(-config['nb_data'] // config['stream_chunk'])
+    received = queue.Queue(maxsize=config['stream_window'])
+
+    def reader():
+        try:
+            for _ in range(nb_chunks):
+                received.put(decode_payload(scheme, config, receive_data(sock, raw=True), public_context))
+        except Exception as e:
+            received.put(e)
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+    operation_spans = []
+    for _ in range(nb_chunks):
+        item = received.get()
+        if isinstance(item, Exception):
+            raise item
+        operation, scalar, data_list, data_list2 = item
+
+        start = time.perf_counter()
+        result = perform_homomorphic_operation(
+            scheme,
+            operation,
+            data_list,
+            scalar=scalar,
+            data_list2=data_list2,
+            nb_operations=config['nb_operations'],
+            public_context=public_context,
+            pool=pool,
+            stage_details=benchmark.phase_details.setdefault('operation', {})
+        )
+        operation_spans.append((start, time.perf_counter()))
+        benchmark.record_phase_span('operation', *operation_spans[-1])
+        send_data(sock, encode_result(scheme, config, operation, result))
+    thread.join()
 
-    # Generate data
-    data = generate_data(nb_data, operation=operation, scheme=scheme)
-    scalar = 4
+    record_chunk_spans('operation', operation_spans)
+    record_operation_duration(config, sum(end - start for start, end in operation_spans))
+    print(Fore.CYAN)
+    print(f"# result: {nb_chunks} chunks computed")
+    print(Fore.RESET)
+#!SECTION - END STREAMING
+
+#SECTION - GENERATOR PIPELINE
+#ANCHOR - DATA CHUNKS
+def generate_data_chunks(num_elements, chunk_size, operation=None, scheme=None):
+    """Generate the data one chunk at a time, only one chunk of plaintexts is alive at once"""
+    for start in range(0, num_elements, chunk_size):
+        yield generate_data(min(chunk_size, num_elements - start), operation=operation, scheme=scheme)
+
+def send_message_chunks(sock, payloads, nb_chunks):
+    """Send one logical message as its chunk count followed by the payloads of a generator"""
+    send_data(sock, json.dumps({'chunks': nb_chunks}))
+    for payload in payloads:
+        send_data(sock, payload)
+
+def receive_message_chunks(sock):
+    """Generator of the payloads of a logical message sent by send_message_chunks"""
+    nb_chunks = json.loads(receive_data(sock))['chunks']
+    for _ in range(nb_chunks):
+        yield receive_data(sock, raw=True)
+
+#ANCHOR - GENERATOR CLIENT
+def send_generated_chunks(sock, scheme, operation, scalar, public_context, private_context, config, pool=None):
+    """
+    Generate, encrypt, serialize and send the data as a chain of generators, one chunk of the data is alive at once.
+    Returns the first values and the expected aggregate, which is accumulated over the chunks.
+    """
+    chunk_size = config['generator_chunk']
+    nb_chunks = -(-config['nb_data'] // chunk_size)
+    # Only single aggregates add up over the chunks, pipelines are not checked in the clear
+    head, expected = [], 0 if operation in AGGREGATE_OPERATIONS else None
+    encrypt_spans = []
+
+    def encrypted_chunks():
+        nonlocal head, expected
+        value_offset = 0
+        for chunk in generate_data_chunks(config['nb_data'], chunk_size, operation=operation, scheme=scheme):
+            head = (head + chunk)[:4]
+            if expected is not None:
+                expected += plain_aggregate("sum" if operation == "mean" else operation, chunk, scalar, value_offset)
+            start = time.perf_counter()
+            encrypted_data = encrypt_data(scheme, operation, chunk, scalar, public_context, private_context, config, pool=pool, value_offset=value_offset)
+            encrypt_spans.append((start, time.perf_counter()))
+            benchmark.record_phase_span('encrypt', *encrypt_spans[-1])
+            value_offset += len(chunk)
+            yield encrypted_data
+
+    print(f"> Generating, encrypting and sending {config['nb_data']} elements in {nb_chunks} chunks")
+    payloads = (encode_payload(scheme, config, operation, scalar, encrypted_data) for encrypted_data in encrypted_chunks())
+    send_message_chunks(sock, payloads, nb_chunks)
+    record_chunk_spans('encrypt', encrypt_spans)
+
+    if operation == "mean":
+        expected /= config['nb_data']
+    return head, expected
+
+def receive_decrypted_chunks(sock, scheme, operation, public_context, private_context, config, pool=None):
+    """Decrypt the result chunks as they arrive, keeping only the first values of element-wise results"""
+    nb_data = config['nb_data']
+    decrypted_result, decrypt_spans = [], []
+    encrypted_result = None
+    for payload in receive_message_chunks(sock):
+        encrypted_result = decode_result(scheme, config, payload, public_context)
+        start = time.perf_counter()
+        values = decrypt_data(scheme, encrypted_result, nb_data, private_context, config, pool=pool)
+        decrypt_spans.append((start, time.perf_counter()))
+        benchmark.record_phase_span('decrypt', *decrypt_spans[-1])
+        if uses_operations(operation, AGGREGATE_OPERATIONS):
+            decrypted_result.extend(values)
+        else:
+            nb_data -= len(values)
+            decrypted_result = (decrypted_result + values)[:4]
+
+    record_chunk_spans('decrypt', decrypt_spans)
+    if uses_operations(operation, AGGREGATE_OPERATIONS):
+        decrypted_result = finish_aggregate(scheme, operation, decrypted_result, config['nb_data'])
+    return decrypted_result, encrypted_result
+
+#ANCHOR - GENERATOR SERVER
+def receive_generated_chunks(sock, scheme, config, public_context):
+    """Deserialize the chunks as they arrive, only the ciphertexts of the whole data are kept"""
+    data_list, data_list2, chunk_lengths = [], None, []
+    for payload in receive_message_chunks(sock):
+        operation, scalar, chunk_list, chunk_list2 = decode_payload(scheme, config, payload, public_context)
+        data_list.extend(chunk_list)
+        chunk_lengths.append(len(chunk_list))
+        if chunk_list2 is not None:
+            data_list2 = data_list2 if data_list2 is not None else []
+            data_list2.extend(chunk_list2)
+    return operation, scalar, data_list, data_list2, chunk_lengths
+
+def send_result_chunks(sock, scheme, config, operation, result, chunk_lengths):
+    """Send an element-wise result back in the chunks it was received in, an aggregate in a single chunk"""
+    if len(result) != sum(chunk_lengths):
+        chunk_lengths = [len(result)]
+    offsets = list(itertools.accumulate(chunk_lengths, initial=0))
+    payloads = (
+        encode_result(scheme, config, operation, result[start:end])
+        for start, end in zip(offsets, offsets[1:])
+    )
+    send_message_chunks(sock, payloads, len(chunk_lengths))
+#!SECTION - END GENERATOR PIPELINE
 
-    # Encrypt data
-    benchmark.encrypt_start_time = time.perf_counter()
-    print(f"> Encrypting {nb_data} elements")
+#SECTION - CLIENT WORKFLOW
+#ANCHOR - ENCRYPT
+def encrypt_data(scheme, operation, data, scalar, public_context, private_context, config, pool=None, value_offset=0, rotations=None):
+    """
+    Encrypt the data with the configured strategy, value_offset is the position of the first value of a chunk.
+    rotations overrides whether the packed slots are laid out for a rotate-and-sum, by default it follows the operation.
+    """
+    if rotations is None:
+        rotations = rotates_slots(operation, config['packed'])
     if isinstance(scheme, TFHEScheme):
         # For TFHE, we need to encrypt pairs of data together
-        data2 = data if "encrypted" in operation else [scalar] * len(data)
-        encrypted_data = scheme.encrypt(public_context, data,private_context=private_context, message2=data2)
-    else:
-        encrypted_data = [scheme.encrypt(public_context, m) for m in data]
-    print(f"> Computing {operation} on {nb_data} elements")
-    benchmark.encrypt_end_time = time.perf_counter()
+        if takes_second_operand(operation):
+            data2 = data
+        elif operation == "weighted_sum":
+            data2 = aggregate_weights(value_offset, len(data), scalar)
+        else:
+            data2 = [scalar] * len(data)
+        return scheme.encrypt(public_context, data, private_context=private_context, message2=data2)
+    elif pool is not None:
+        print(f"> Encrypting across {pool.workers} workers")
+        return pool.encrypt(data, packed=config['packed'], key_length=config['key_length'], rotations=rotations)
+    elif config['packed']:
+        encrypted_data = scheme.encrypt_packed(public_context, data, config['key_length'], rotations)
+        print(f"> Packed {len(data)} elements into {len(encrypted_data)} ciphertexts")
+        return encrypted_data
+    return [scheme.encrypt(public_context, m) for m in data]
+
+#ANCHOR - DECRYPT
+def decrypt_data(scheme, encrypted_result, nb_data, private_context, config, pool=None):
+    """Decrypt the result with the configured strategy, keeping the first nb_data values"""
+    batch = config['decrypt_mode'] == 'batch'
+    if pool is not None and pool.can_decrypt:
+        print(f"> Decrypting across {pool.workers} workers")
+        return pool.decrypt(encrypted_result, packed=config['packed'], batch=batch)[:nb_data]
+    elif config['packed'] or isinstance(scheme, TFHEScheme):
+        return scheme.decrypt_packed(private_context, encrypted_result, batch=batch)[:nb_data]
+    elif batch:
+        return scheme.decrypt_batch(private_context, encrypted_result)
+    return [scheme.decrypt(private_context, m) for m in encrypted_result]
 
-    # Prepare data for computation
-    data_to_compute = {
-        'operation': operation,
-        'scalar': scalar,
-        'data': scheme.serialize_encrypted(encrypted_data)
-    }
+#ANCHOR - RUN OPERATIONS
+def run_client_operations(sock, scheme, operation, public_context, private_context, config, pool=None):
+    """Run client operations efficiently"""
+    # Precompute Paillier obfuscators while waiting on the network
+    obfuscator_pool = getattr(scheme, 'obfuscator_pool', None)
+    if obfuscator_pool is not None and obfuscator_pool.public_key != public_context:
+        obfuscator_pool = None
+    if obfuscator_pool is not None:
+        obfuscator_pool.start_refill()
 
-    # Add second dataset for add_encrypted operation
-    if "encrypted" in operation and not isinstance(scheme, TFHEScheme):
-        data_to_compute['data2'] = data_to_compute['data']
+    measure_latency_client(sock)
 
-    # Send data and receive result
-    print("> Sending data to server for computation")
-    send_data(sock, json.dumps(data_to_compute))
+    nb_data = config['nb_data']
 
-    print("> Waiting for server result...")
-    serialized_data = receive_data(sock)
+    # Generate data, the generator pipeline generates it chunk by chunk
+    data = generate_data(nb_data, operation=operation, scheme=scheme) if config['generator_chunk'] == 0 else None
+    scalar = 4
 
-    # Process result
-    encrypted_result = scheme.deserialize_encrypted(serialized_data, public_context)
-    
-    benchmark.decrypt_start_time = time.perf_counter()
-    decrypted_result = [scheme.decrypt(private_context, m) for m in encrypted_result]
-    benchmark.decrypt_end_time = time.perf_counter()
+    # Encrypt, compute and decrypt
+    if obfuscator_pool is not None:
+        if obfuscator_pool.refill == "idle":
+            obfuscator_pool.stop_refill()
+        hits_before, misses_before = obfuscator_pool.hits, obfuscator_pool.misses
+    if config['generator_chunk'] > 0:
+        data, expected = send_generated_chunks(sock, scheme, operation, scalar, public_context, private_context, config, pool=pool)
+        print("> Waiting for server result...")
+        decrypted_result, encrypted_result = receive_decrypted_chunks(sock, scheme, operation, public_context, private_context, config, pool=pool)
+
+        # Noise left at the end of a pipeline, measured on the last chunk outside of the decryption phase
+        noise_budget = scheme.noise_budget(private_context, encrypted_result) if is_pipeline(operation) else None
+        if noise_budget is not None:
+            benchmark.phase_details.setdefault('decrypt', {})['Noise Budget Left'] = f"{noise_budget} bits"
+    elif config['stream_chunk'] > 0:
+        decrypted_result = stream_client_chunks(sock, scheme, operation, data, scalar, public_context, private_context, config, pool=pool)
+    else:
+        benchmark.encrypt_start_time = time.perf_counter()
+        print(f"> Encrypting {nb_data} elements")
+        encrypted_data = encrypt_data(scheme, operation, data, scalar, public_context, private_context, config, pool=pool)
+        print(f"> Computing {operation} on {nb_data} elements")
+        benchmark.encrypt_end_time = time.perf_counter()
+
+        # Send data and receive result
+        print("> Sending data to server for computation")
+        send_data(sock, encode_payload(scheme, config, operation, scalar, encrypted_data))
+
+        print("> Waiting for server result...")
+        encrypted_result = decode_result(scheme, config, receive_data(sock, raw=True), public_context)
+
+        benchmark.decrypt_start_time = time.perf_counter()
+        decrypted_result = decrypt_data(scheme, encrypted_result, nb_data, private_context, config, pool=pool)
+        if uses_operations(operation, AGGREGATE_OPERATIONS):
+            decrypted_result = finish_aggregate(scheme, operation, decrypted_result, nb_data)
+        benchmark.decrypt_end_time = time.perf_counter()
+
+        # Noise left at the end of a pipeline, measured outside of the decryption phase
+        noise_budget = scheme.noise_budget(private_context, encrypted_result) if is_pipeline(operation) else None
+        if noise_budget is not None:
+            benchmark.phase_details.setdefault('decrypt', {})['Noise Budget Left'] = f"{noise_budget} bits"
+    if obfuscator_pool is not None:
+        benchmark.phase_details.setdefault('encrypt', {}).update({
+            'Obfuscator Pool Hits': obfuscator_pool.hits - hits_before,
+            'Obfuscator Pool Misses': obfuscator_pool.misses - misses_before,
+            'Obfuscator Pool Size': f"{len(obfuscator_pool.obfuscators)}/{obfuscator_pool.size} ({obfuscator_pool.refill} refill)"
+        })
 
     # Print to verify the result
     print(Fore.CYAN)
     print(f"# data: {data[0:max(1, min(4, len(data)))]}")
-    if "encrypted" not in operation:
+    if not takes_second_operand(operation):
         print(f"# scalar: {scalar}")
     print(f"# operation: {operation}")
+    if config['generator_chunk'] == 0 and uses_operations(operation, AGGREGATE_OPERATIONS):
+        expected = plain_pipeline(operation, data, scalar)[0]
+    if uses_operations(operation, AGGREGATE_OPERATIONS) and expected is not None:
+        print(f"# expected: {expected}")
     print(f"# result: {decrypted_result[0:max(1, min(4, len(decrypted_result)))]}")
     print(Fore.RESET)
 
@@ -714,113 +2596,846 @@ def run_client_operations(sock, scheme, operation, public_context, private_conte
     print("> Signaling completion to server...")
     send_data(sock, "finished")
 
+    # Keep precomputing obfuscators until the next encryption phase
+    if obfuscator_pool is not None:
+        obfuscator_pool.start_refill()
+
+#ANCHOR - ADAPTIVE RUNS
+def client_stop_agreement(sock, config):
+    """With a target CI the client decides when the runs stop, and tells the server after each run"""
+    if config['target_ci'] <= 0:
+        return None
+
+    def agree_to_stop(stop):
+        send_data(sock, json.dumps({'stop': stop}))
+        return stop
+    return agree_to_stop
+
 #ANCHOR - CLIENT
 def client(sock, scheme, config, public_context, private_context):
     """Client main function"""
-    folder_prefix = config["folder_prefix"] if config["folder_prefix"] != "" else f"client_{config['operation']}_{config['nb_data']}bits"
+    folder_prefix = config["folder_prefix"] if config["folder_prefix"] != "" else f"client_{config['operation'].replace(PIPELINE_SEPARATOR, '-')}_{config['nb_data']}bits"
     annotation_str = (
         f"Client Operation | "
         f"NB_RUNS={config['nb_runs']}, "
+        f"WARMUP_RUNS={config['warmup_runs']}, "
+        f"TARGET_CI={config['target_ci']}, "
         f"NB_DATA={config['nb_data']}, "
         f"KEY_LENGTH={config['key_length']}, "
         f"OPERATION={config['operation']}, "
-        f"SCHEME={config['scheme']}"
+        f"SCHEME={config['scheme']}, "
+        f"PACKED={config['packed']}, "
+        f"WIRE_FORMAT={config['wire_format']}, "
+        f"WORKERS={config['workers']}, "
+        f"DECRYPT_MODE={config['decrypt_mode']}, "
+        f"KEY_PROFILE={config['key_profile']}, "
+        f"PUBLIC_KEY_BYTES={config['public_context_bytes']}, "
+        f"TFHE_BATCH={config['tfhe_batch']}, "
+        f"STREAM_CHUNK={config['stream_chunk']}, "
+        f"STREAM_WINDOW={config['stream_window']}, "
+        f"GENERATOR_CHUNK={config['generator_chunk']}, "
+        f"COMPRESSION={config['compression']}"
     )
 
     benchmarked_fn = profile_and_monitor(
         number=config['nb_runs'],
         folder_prefix=folder_prefix,
-        annotation=annotation_str
+        annotation=annotation_str,
+        metadata=dict(config, role="client"),
+        warmup=config['warmup_runs'],
+        target_ci=config['target_ci'] / 100,
+        max_runs=config['max_runs'],
+        agree_to_stop=client_stop_agreement(sock, config)
     )(run_client_operations)
 
-    benchmarked_fn(sock, scheme, config['operation'], public_context, private_context, config)
+    # Worker processes are started once per configuration, outside of the measured runs
+    pool = None
+    if config['workers'] > 1 and not isinstance(scheme, TFHEScheme):
+        pool = WorkerPool(config['scheme'], public_context, private_context, config['workers'])
+
+    try:
+        benchmarked_fn(sock, scheme, config['operation'], public_context, private_context, config, pool=pool)
+    finally:
+        if pool is not None:
+            pool.shutdown()
 #!SECTION - END CLIENT WORKFLOW
 
 #SECTION - SERVER WORKFLOW
 #ANCHOR - RUN OPERATIONS
-def run_server_operations(sock, scheme, config, public_context):
+def run_server_operations(sock, scheme, config, public_context, pool=None):
     """Run server operations efficiently"""
     measure_latency_server(sock)
 
-    print("> Waiting for client data...")
-    data_to_compute = json.loads(receive_data(sock))
-    operation = data_to_compute['operation']
-    scalar = data_to_compute['scalar']
-    
-    # Process input data
-    data_list = scheme.deserialize_encrypted(data_to_compute['data'], public_context)
-    data_list2 = scheme.deserialize_encrypted(data_to_compute['data2'], public_context) if "encrypted" in operation and not isinstance(scheme, TFHEScheme) else None
-
-    # Perform operations
-    benchmark.operation_start_time = time.perf_counter()
-    result = perform_homomorphic_operation(
-        scheme,
-        operation, 
-        data_list, 
-        scalar=scalar, 
-        data_list2=data_list2,
-        nb_operations=config['nb_operations'],
-        public_context=public_context
-    )
-    benchmark.operation_end_time = time.perf_counter()
+    if config['stream_chunk'] > 0:
+        stream_server_chunks(sock, scheme, config, public_context, pool=pool)
+    else:
+        print("> Waiting for client data...")
+        if config['generator_chunk'] > 0:
+            operation, scalar, data_list, data_list2, chunk_lengths = receive_generated_chunks(sock, scheme, config, public_context)
+        else:
+            operation, scalar, data_list, data_list2 = decode_payload(scheme, config, receive_data(sock, raw=True), public_context)
+
+        # Perform operations
+        benchmark.operation_start_time = time.perf_counter()
+        result = perform_homomorphic_operation(
+            scheme,
+            operation, 
+            data_list, 
+            scalar=scalar, 
+            data_list2=data_list2,
+            nb_operations=config['nb_operations'],
+            public_context=public_context,
+            pool=pool,
+            stage_details=benchmark.phase_details.setdefault('operation', {})
+        )
+        benchmark.operation_end_time = time.perf_counter()
+        record_operation_duration(config, benchmark.operation_end_time - benchmark.operation_start_time)
 
-    # Send result
-    serialized_result = scheme.serialize_encrypted(result)
-    print("> Sending computation result back to client")
-    send_data(sock, serialized_result)
+        # Send result
+        print("> Sending computation result back to client")
+        if config['generator_chunk'] > 0:
+            send_result_chunks(sock, scheme, config, operation, result, chunk_lengths)
+        else:
+            send_data(sock, encode_result(scheme, config, operation, result))
 
-    # Print to verify the result
-    print(Fore.CYAN)
-    print(f"# result: {result[0:max(1, min(4, len(result)))]}")
-    print(Fore.RESET)
+        # Print to verify the result
+        print(Fore.CYAN)
+        print(f"# result: {result[0:max(1, min(4, len(result)))]}")
+        print(Fore.RESET)
 
     # Wait for client completion
     print("> Waiting for client completion...")
     if receive_data(sock) != "finished":
         raise ValueError("Unexpected response from client")
 
+#ANCHOR - ADAPTIVE RUNS
+def server_stop_agreement(sock, config):
+    """With a target CI the server runs until the client decides to stop"""
+    if config['target_ci'] <= 0:
+        return None
+
+    def agree_to_stop(stop):
+        return json.loads(receive_data(sock))['stop']
+    return agree_to_stop
+
 #ANCHOR - SERVER
 def server(sock, scheme, config, public_context):
     """Server main function"""
-    folder_prefix = config["folder_prefix"] if config["folder_prefix"] != "" else f"server_{config['operation']}_{config['nb_data']}bits"
+    folder_prefix = config["folder_prefix"] if config["folder_prefix"] != "" else f"server_{config['operation'].replace(PIPELINE_SEPARATOR, '-')}_{config['nb_data']}bits"
     annotation_str = (
         f"Server Operation | "
         f"NB_RUNS={config['nb_runs']}, "
+        f"WARMUP_RUNS={config['warmup_runs']}, "
+        f"TARGET_CI={config['target_ci']}, "
         f"NB_DATA={config['nb_data']}, "
         f"KEY_LENGTH={config['key_length']}, "
         f"OPERATION={config['operation']}, "
-        f"SCHEME={config['scheme']}"
+        f"SCHEME={config['scheme']}, "
+        f"PACKED={config['packed']}, "
+        f"WIRE_FORMAT={config['wire_format']}, "
+        f"WORKERS={config['workers']}, "
+        f"DECRYPT_MODE={config['decrypt_mode']}, "
+        f"KEY_PROFILE={config['key_profile']}, "
+        f"PUBLIC_KEY_BYTES={config['public_context_bytes']}, "
+        f"TFHE_BATCH={config['tfhe_batch']}, "
+        f"STREAM_CHUNK={config['stream_chunk']}, "
+        f"STREAM_WINDOW={config['stream_window']}, "
+        f"GENERATOR_CHUNK={config['generator_chunk']}, "
+        f"COMPRESSION={config['compression']}"
     )
 
     benchmarked_fn = profile_and_monitor(
         number=config['nb_runs'],
         folder_prefix=folder_prefix,
-        annotation=annotation_str
+        annotation=annotation_str,
+        metadata=dict(config, role="server"),
+        warmup=config['warmup_runs'],
+        target_ci=config['target_ci'] / 100,
+        max_runs=config['max_runs'],
+        agree_to_stop=server_stop_agreement(sock, config)
     )(run_server_operations)
 
-    benchmarked_fn(sock, scheme, config, public_context)
+    # Worker pools are started once per configuration, outside of the measured runs
+    pool = None
+    if config['workers'] > 1:
+        pool = OperationPool(config['scheme'], public_context, config['workers'])
+
+    try:
+        benchmarked_fn(sock, scheme, config, public_context, pool=pool)
+    finally:
+        if pool is not None:
+            pool.shutdown()
 #!SECTION - END SERVER WORKFLOW
 
+#SECTION - ASYNC SERVER
+#ANCHOR - CONNECTION
+class AsyncConnection:
+    """Length-prefixed messages over asyncio streams, with byte counters"""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.compressor = None
+
+    async def send(self, data):
+        """Send length-prefixed data, compressed if a codec was negotiated"""
+        data_bytes = data.encode('utf-8') if isinstance(data, str) else data
+        buffers = [data_bytes] if self.compressor is None else list(compress_message(self.compressor, data_bytes))
+        data_length = sum(len(buffer) for buffer in buffers)
+        self.writer.write(struct.pack('!I', data_length))
+        self.writer.writelines(buffers)
+        await self.writer.drain()
+        self.bytes_sent += data_length
+
+    async def receive(self, raw=False):
+        """Receive length-prefixed data, as bytes if raw is set"""
+        try:
+            raw_length = await self.reader.readexactly(4)
+            data = await self.reader.readexactly(struct.unpack('!I', raw_length)[0])
+        except asyncio.IncompleteReadError:
+            raise EmptyResponseError("Connection closed while receiving data")
+        self.bytes_received += len(data)
+        if self.compressor is not None:
+            data = decompress_message(self.compressor, data[:1], data[1:])
+        return data if raw else data.decode('utf-8')
+
+    async def expect(self, message):
+        """Receive a control message and check it"""
+        if await self.receive() != message:
+            raise ValueError("Unexpected response from peer")
+
+    async def propose_compression(self, codec, level=None):
+        """Client side of the compression negotiation, returns the codec agreed on"""
+        proposal = compression_proposal(codec, level)
+        await self.send(json.dumps(proposal))
+        accepted = json.loads(await self.receive())['codec']
+        self.compressor = make_compressor(accepted, proposal_level(proposal, accepted))
+        return accepted
+
+    async def accept_compression(self):
+        """Server side of the compression negotiation, returns the codec agreed on"""
+        codec, level = select_codec(json.loads(await self.receive()))
+        await self.send(json.dumps({'codec': codec}))
+        self.compressor = make_compressor(codec, level)
+        return codec
+
+#ANCHOR - SESSION
+class ServerSession(AsyncConnection):
+    """One client of the asyncio server: its stream, its byte counters and the metrics of its runs"""
+
+    def __init__(self, session_id, reader, writer):
+        super().__init__(reader, writer)
+        self.session_id = session_id
+        self.peer = writer.get_extra_info('peername')
+        self.started = datetime.now()
+        self.latency = 0
+        self.compression = "none"
+        self.runs = []
+
+#ANCHOR - WORKER BUDGET
+class WorkerBudget:
+    """Workers of the operation pools shared by all sessions, a session waits until its pool fits in the budget"""
+
+    def __init__(self, total):
+        self.total = total
+        self.available = total
+        self.condition = asyncio.Condition()
+
+    async def acquire(self, workers):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.available >= workers)
+            self.available -= workers
+
+    async def release(self, workers):
+        async with self.condition:
+            self.available += workers
+            self.condition.notify_all()
+
+#ANCHOR - SESSION PROTOCOL
+def compute_payload(scheme, config, payload, public_context, pool=None):
+    """Decode, evaluate and encode one request, returns the encoded result and the evaluation duration"""
+    operation, scalar, data_list, data_list2 = decode_payload(scheme, config, payload, public_context)
+    start = time.perf_counter()
+    result = perform_homomorphic_operation(
+        scheme,
+        operation,
+        data_list,
+        scalar=scalar,
+        data_list2=data_list2,
+        nb_operations=config['nb_operations'],
+        public_context=public_context,
+        pool=pool
+    )
+    duration = time.perf_counter() - start
+    return encode_result(scheme, config, operation, result), duration
+
+async def async_receive_public_context(session, scheme, executor, store=None):
+    """Receive the public context of a session, deserialized off the event loop"""
+    loop = asyncio.get_running_loop()
+    if store is not None:
+        digest = json.loads(await session.receive())['context_digest']
+        stored = await loop.run_in_executor(executor, store.get, digest)
+        if stored is not None:
+            await session.send("hit")
+            data = stored.decode('utf-8')
+        else:
+            await session.send("miss")
+            data = await session.receive()
+            if await loop.run_in_executor(executor, scheme.public_context_digest, data) != digest:
+                raise ValueError("Public Key does not match its digest")
+            await loop.run_in_executor(executor, store.put, digest, data.encode('utf-8'))
+    else:
+        data = await session.receive()
+    public_context = await loop.run_in_executor(executor, scheme.deserialize_public_context, data)
+    await session.send("finished")
+    return public_context, len(data)
+
+async def async_serve_run(session, scheme, config, public_context, executor, pool=None, warmup=False):
+    """Serve one benchmark run of a session, warmup runs are left out of the session report"""
+    # Latency exchange, same messages as measure_latency_server
+    await session.expect("ping_ready")
+    await session.send("pong_ready")
+    await session.expect("ping")
+    await session.send("pong")
+    session.latency = float(await session.receive())
+
+    payload = await session.receive(raw=True)
+    submitted = time.perf_counter()
+    serialized_result, operation_duration = await asyncio.get_running_loop().run_in_executor(
+        executor, compute_payload, scheme, config, payload, public_context, pool
+    )
+    executor_duration = time.perf_counter() - submitted
+    await session.send(serialized_result)
+    await session.expect("finished")
+    if warmup:
+        return
+
+    session.runs.append({
+        'scheme': config['scheme'],
+        'operation': config['operation'],
+        'key_length': config['key_length'],
+        'nb_data': config['nb_data'],
+        'workers': config['workers'],
+        'operation_duration': operation_duration,
+        # Time in the executor queue plus decoding and encoding
+        'overhead_duration': executor_duration - operation_duration,
+        'request_bytes': len(payload) + 4,
+        'response_bytes': len(serialized_result) + 4
+    })
+
+async def serve_session(session, args, sweep, executor, budget, store=None):
+    """Run the benchmark sweep of one client, mirroring the synchronous server loops"""
+    schemes_list, key_length_list, operations, nb_data_list, workers_list = sweep
+    loop = asyncio.get_running_loop()
+    if args.compression != "none":
+        session.compression = await session.accept_compression()
+    for scheme_name in schemes_list:
+        scheme = SCHEMES[scheme_name]
+        for key_length in key_length_list:
+
+            bool_contextGenerated = False
+            for operation in operations:
+                if (not bool_contextGenerated or scheme_name == "tfhe"
+                        or (rotates_slots(operation, args.packed) and scheme.needs_galois_keys(public_context))):
+                    public_context, public_context_bytes = await async_receive_public_context(session, scheme, executor, store)
+                    bool_contextGenerated = True
+
+                for nb_data, workers in itertools.product(nb_data_list, workers_list):
+                    config = build_config(args, scheme_name, key_length, operation, nb_data, workers, public_context_bytes)
+                    pool = None
+                    if workers > 1:
+                        # Process pools start and warm up their workers, off the event loop
+                        await budget.acquire(workers)
+                        try:
+                            pool = await loop.run_in_executor(executor, OperationPool, scheme_name, public_context, workers)
+                        except BaseException:
+                            await budget.release(workers)
+                            raise
+                    try:
+                        # Warmup runs first, then nb_runs or, with a target CI, until the client decides to stop
+                        for run in itertools.count(1 - config['warmup_runs']):
+                            await async_serve_run(session, scheme, config, public_context, executor, pool=pool, warmup=run < 1)
+                            if run < 1:
+                                continue
+                            if config['target_ci'] > 0:
+                                if json.loads(await session.receive())['stop']:
+                                    break
+                            elif run >= config['nb_runs']:
+                                break
+                    finally:
+                        if pool is not None:
+                            await loop.run_in_executor(executor, pool.shutdown)
+                            await budget.release(workers)
+
+#ANCHOR - SESSION REPORT
+def write_session_report(session, folder_prefix=""):
+    """Write the metrics of one session"""
+    timestamp = session.started.strftime('%Y%m%d_%H%M%S')
+    os.makedirs("results_profile", exist_ok=True)
+    report_file = os.path.join("results_profile", f"{folder_prefix or 'server'}_session_{session.session_id}_{timestamp}.md")
+    print(Fore.GREEN + f"Saving session {session.session_id} report to: {report_file}" + Fore.RESET)
+
+    benchmark.log_message(f"# Session {session.session_id}", report_file)
+    benchmark.log_message(f"- Client: {session.peer}", report_file)
+    benchmark.log_message(f"- Started: {session.started.isoformat()}", report_file)
+    benchmark.log_message(f"- Duration: {(datetime.now() - session.started).total_seconds():.6f} seconds", report_file)
+    benchmark.log_message(f"- Last RTT: {session.latency:.2f} ms", report_file)
+    benchmark.log_message(f"- Compression: {session.compression}", report_file)
+    benchmark.log_message(f"- Total Bytes Sent: {benchmark.format_bytes(session.bytes_sent)}", report_file)
+    benchmark.log_message(f"- Total Bytes Received: {benchmark.format_bytes(session.bytes_received)}", report_file)
+    benchmark.log_message("", report_file)
+    benchmark.log_message("| Scheme | Operation | Key Length | NB Data | Workers | Operation Duration | Executor Overhead | Request | Response |", report_file)
+    benchmark.log_message("|---|---|---|---|---|---|---|---|---|", report_file)
+    for run in session.runs:
+        benchmark.log_message(
+            f"| {run['scheme']} | {run['operation']} | {run['key_length']} | {run['nb_data']} | {run['workers']} | "
+            f"{run['operation_duration']:.6f} seconds | {run['overhead_duration']:.6f} seconds | "
+            f"{benchmark.format_bytes(run['request_bytes'])} | {benchmark.format_bytes(run['response_bytes'])} |",
+            report_file
+        )
+
+#ANCHOR - SERVER
+async def run_async_server(args, sweep, store=None):
+    """Accept concurrent clients, each served in its own session, evaluations run in a bounded executor"""
+    executor = ThreadPoolExecutor(max_workers=args.executor_workers)
+    budget = WorkerBudget(args.pool_workers)
+    session_ids = itertools.count(1)
+    finished_sessions = asyncio.Queue()
+
+    async def handle_client(reader, writer):
+        session = ServerSession(next(session_ids), reader, writer)
+        print(f"! Session {session.session_id} accepted connection from {session.peer}")
+        try:
+            await serve_session(session, args, sweep, executor, budget, store)
+            print(f"! Session {session.session_id} completed")
+        except Exception as e:
+            # A failing session must not bring down the other sessions
+            print(Fore.RED + f"! Session {session.session_id} aborted: {e!r}" + Fore.RESET)
+        finally:
+            writer.close()
+            write_session_report(session, args.folder_prefix)
+            await finished_sessions.put(session)
+
+    async_server = await asyncio.start_server(handle_client, "0.0.0.0", args.port, reuse_address=True)
+    print(f"! Async server listening on port {args.port}, {args.executor_workers} executor workers, {args.pool_workers} pool workers")
+    try:
+        async with async_server:
+            if args.max_sessions > 0:
+                for _ in range(args.max_sessions):
+                    await finished_sessions.get()
+            else:
+                await async_server.serve_forever()
+    finally:
+        executor.shutdown()
+#!SECTION - END ASYNC SERVER
+
+#SECTION - LOAD GENERATOR
+#ANCHOR - PREPARE
+def prepare_load_steps(args, sweep, store=None):
+    """
+    Replay script of the client protocol: the public contexts to send and one encoded payload per configuration.
+    Data is encrypted once here, every simulated client resends the same payloads.
+    """
+    schemes_list, key_length_list, operations, nb_data_list, workers_list = sweep
+    steps = []
+    for scheme_name in schemes_list:
+        scheme = SCHEMES[scheme_name]
+        for key_length in key_length_list:
+
+            bool_contextGenerated = False
+            for operation in operations:
+                send_context = not bool_contextGenerated or scheme_name == "tfhe"
+                if send_context:
+                    public_context, private_context = load_or_generate_contexts(
+                        scheme, key_length, operation, store, key_profile(operations, args.key_profile), args.tfhe_batch
+                    )
+                if rotates_slots(operation, args.packed) and scheme.needs_galois_keys(public_context):
+                    scheme.generate_galois_keys(public_context, private_context)
+                    send_context = True
+                if send_context:
+                    key_data = json.dumps(scheme.serialize_public_context(public_context))
+                    steps.append(('context', key_data, scheme.public_context_digest(key_data)))
+                    bool_contextGenerated = True
+
+                for nb_data, workers in itertools.product(nb_data_list, workers_list):
+                    config = build_config(args, scheme_name, key_length, operation, nb_data, workers, len(key_data))
+                    print(f"> Preparing the {operation} payload of {nb_data} elements for {scheme_name}")
+                    data = generate_data(nb_data, operation=operation, scheme=scheme)
+                    encrypted_data = encrypt_data(scheme, operation, data, 4, public_context, private_context, config)
+                    steps.append(('runs', config, encode_payload(scheme, config, operation, 4, encrypted_data)))
+    return steps
+
+#ANCHOR - SIMULATED CLIENT
+async def run_load_client(client_id, args, steps, records):
+    """Replay the protocol on one connection, recording the end-to-end latency of every request"""
+    reader, writer = await asyncio.open_connection(args.client, args.port)
+    connection = AsyncConnection(reader, writer)
+    # Each client draws its own Poisson arrivals
+    rng = random.Random(client_id)
+    try:
+        if args.compression != "none":
+            await connection.propose_compression(args.compression, args.compression_level)
+        for step in steps:
+            if step[0] == 'context':
+                _, key_data, digest = step
+                if args.context_handshake:
+                    await connection.send(json.dumps({'context_digest': digest}))
+                    if await connection.receive() == "miss":
+                        await connection.send(key_data)
+                else:
+                    await connection.send(key_data)
+                await connection.expect("finished")
+                continue
+
+            _, config, payload = step
+            next_arrival = time.perf_counter()
+            for run in range(config['warmup_runs'] + config['nb_runs']):
+                if args.arrival == "poisson":
+                    next_arrival += rng.expovariate(args.rate)
+                    await asyncio.sleep(max(0, next_arrival - time.perf_counter()))
+                # Latency exchange expected by the server before each run
+                await connection.send("ping_ready")
+                await connection.expect("pong_ready")
+                await connection.send("ping")
+                await connection.expect("pong")
+                await connection.send("0")
+
+                # Arrivals are scheduled regardless of the answers, but a connection carries one request at a time:
+                # a request due while the previous one is outstanding waits, its latency counts from its scheduled arrival
+                start = next_arrival if args.arrival == "poisson" else time.perf_counter()
+                await connection.send(payload)
+                await connection.receive(raw=True)
+                end = time.perf_counter()
+                await connection.send("finished")
+                if run >= config['warmup_runs']:
+                    records.append((config['scheme'], config['operation'], config['key_length'], config['nb_data'], start, end))
+    finally:
+        writer.close()
+
+async def run_load(args, steps):
+    """Run the simulated clients concurrently"""
+    records = []
+    await asyncio.gather(*(run_load_client(client_id, args, steps, records) for client_id in range(args.load)))
+    return records
+
+#ANCHOR - LOAD REPORT
+def write_load_report(args, records):
+    """Write the throughput and the end-to-end latency percentiles per configuration"""
+    grouped = {}
+    for scheme_name, operation, key_length, nb_data, start, end in records:
+        grouped.setdefault((scheme_name, operation, key_length, nb_data), []).append((start, end))
+
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    os.makedirs("results_profile", exist_ok=True)
+    report_file = os.path.join("results_profile", f"{args.folder_prefix or 'client'}_load_{timestamp}.md")
+    print(Fore.GREEN + f"Saving load report to: {report_file}" + Fore.RESET)
+
+    benchmark.log_message("# Load Test", report_file)
+    benchmark.log_message(f"- Simulated Clients: {args.load}", report_file)
+    arrival = (
+        f"poisson, {args.rate} requests/s per client ({args.rate * args.load} requests/s in total), at most {args.load} outstanding"
+        if args.arrival == "poisson" else "closed loop"
+    )
+    benchmark.log_message(f"- Arrivals: {arrival}", report_file)
+    benchmark.log_message("", report_file)
+    benchmark.log_message("| Scheme | Operation | Key Length | NB Data | Requests | Throughput | p50 | p95 | p99 |", report_file)
+    benchmark.log_message("|---|---|---|---|---|---|---|---|---|", report_file)
+    for (scheme_name, operation, key_length, nb_data), spans in grouped.items():
+        latencies = np.array([end - start for start, end in spans]) * 1000
+        wall_time = max(end for _, end in spans) - min(start for start, _ in spans)
+        throughput = len(spans) / wall_time if wall_time > 0 else 0
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        benchmark.log_message(
+            f"| {scheme_name} | {operation} | {key_length} | {nb_data} | {len(spans)} | {throughput:.2f} ops/s | "
+            f"{p50:.2f} ms | {p95:.2f} ms | {p99:.2f} ms |",
+            report_file
+        )
+#!SECTION - END LOAD GENERATOR
+
+#SECTION - CORPUS
+#ANCHOR - BUILD
+def corpus_path(directory, scheme_name, key_length, nb_data, operation=None):
+    """File of the corpus of a configuration, per operation only for the schemes compiling circuits"""
+    suffix = f"_{operation}" if operation is not None else ""
+    return os.path.join(directory, f"corpus_{scheme_name}_{key_length}_{nb_data}{suffix}.bin")
+
+def build_corpus(args, sweep, store=None):
+    """Encrypt the data once per configuration and write it with its public context as a binary frame"""
+    schemes_list, key_length_list, operations, nb_data_list, _ = sweep
+    os.makedirs(args.build_corpus, exist_ok=True)
+    for scheme_name in schemes_list:
+        scheme = SCHEMES[scheme_name]
+        for key_length in key_length_list:
+            for operation in (operations if scheme.context_per_operation else [None]):
+                public_context, private_context = load_or_generate_contexts(
+                    scheme, key_length, operation, store, key_profile(operations, args.key_profile), args.tfhe_batch
+                )
+                # Shared corpora are laid out for the rotate-and-sum of any operation of the sweep
+                rotations = any(rotates_slots(op, args.packed) for op in operations)
+                if rotations and scheme.needs_galois_keys(public_context):
+                    scheme.generate_galois_keys(public_context, private_context)
+                public_context_data = json.dumps(scheme.serialize_public_context(public_context)).encode('utf-8')
+
+                for nb_data in nb_data_list:
+                    config = build_config(args, scheme_name, key_length, operation, nb_data, 1, len(public_context_data))
+                    data = generate_data(nb_data, operation=operation, scheme=scheme)
+                    encrypted_data = encrypt_data(scheme, operation, data, 4, public_context, private_context, config, rotations=rotations)
+                    header = {
+                        'scheme': scheme_name,
+                        'key_length': key_length,
+                        'nb_data': nb_data,
+                        'operation': operation,
+                        'scalar': 4,
+                        'packed': args.packed,
+                        'tfhe_batch': args.tfhe_batch
+                    }
+                    frame = encode_frame(header, [[public_context_data], scheme.serialize_encrypted_binary(encrypted_data)])
+
+                    path = corpus_path(args.build_corpus, scheme_name, key_length, nb_data, operation)
+                    with open(f"{path}.tmp", "wb") as f:
+                        f.write(frame)
+                    os.replace(f"{path}.tmp", path)
+                    print(Fore.GREEN + f"Saved corpus of {nb_data} elements to: {path} ({benchmark.format_bytes(len(frame))})" + Fore.RESET)
+
+#ANCHOR - LOAD
+class Corpus:
+    """Memory-mapped corpus, its blobs are views of the mapping until it is closed"""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.header, (public_context_blobs, self.blobs) = decode_frame(self.mapping)
+        self.public_context_data = bytes(public_context_blobs[0]).decode('utf-8')
+        public_context_blobs[0].release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        # The mapping cannot be closed while views on it are alive
+        for blob in self.blobs:
+            blob.release()
+        self.blobs = []
+        self.mapping.close()
+
+#ANCHOR - BENCH
+def run_corpus_operations(scheme, config, corpus, public_context, pool=None):
+    """Time the server side on a corpus: deserialization, evaluation and serialization, without any socket"""
+    operation = config['operation']
+    start = time.perf_counter()
+    data_list = scheme.deserialize_encrypted_binary(corpus.blobs, public_context)
+    data_list2 = data_list if takes_second_operand(operation) and not isinstance(scheme, TFHEScheme) else None
+    deserialization_duration = time.perf_counter() - start
+
+    benchmark.operation_start_time = time.perf_counter()
+    result = perform_homomorphic_operation(
+        scheme,
+        operation,
+        data_list,
+        scalar=corpus.header['scalar'],
+        data_list2=data_list2,
+        nb_operations=config['nb_operations'],
+        public_context=public_context,
+        pool=pool,
+        stage_details=benchmark.phase_details.setdefault('operation', {})
+    )
+    benchmark.operation_end_time = time.perf_counter()
+    record_operation_duration(config, benchmark.operation_end_time - benchmark.operation_start_time)
+
+    start = time.perf_counter()
+    serialized_result = encode_result(scheme, config, operation, result)
+    serialization_duration = time.perf_counter() - start
+
+    benchmark.phase_details['operation'].update({
+        'Deserialization Duration': f"{deserialization_duration:.6f} seconds",
+        'Serialization Duration': f"{serialization_duration:.6f} seconds",
+        'Serialized Result Size': benchmark.format_bytes(len(serialized_result))
+    })
+
+def bench_corpus(args, sweep):
+    """Benchmark the server side on every corpus of the sweep"""
+    schemes_list, key_length_list, operations, nb_data_list, workers_list = sweep
+    for scheme_name in schemes_list:
+        scheme = SCHEMES[scheme_name]
+        for key_length in key_length_list:
+            for nb_data in nb_data_list:
+                for corpus_operation in (operations if scheme.context_per_operation else [None]):
+                    path = corpus_path(args.bench_corpus, scheme_name, key_length, nb_data, corpus_operation)
+                    if not os.path.exists(path):
+                        print(Fore.RED + f"! No corpus at {path}, build it with --build_corpus" + Fore.RESET)
+                        continue
+
+                    with Corpus(path) as corpus:
+                        public_context = scheme.deserialize_public_context(corpus.public_context_data)
+                        for operation, workers in itertools.product([corpus_operation] if corpus_operation else operations, workers_list):
+                            reset_benchmark()
+                            config = build_config(args, scheme_name, key_length, operation, nb_data, workers, len(corpus.public_context_data))
+                            # The corpus was encrypted with its own packing
+                            config['packed'] = corpus.header['packed']
+                            config['tfhe_batch'] = corpus.header['tfhe_batch']
+
+                            # Configurations finish within a second, each needs its own folder whatever the prefix
+                            folder_prefix = (
+                                f"{config['folder_prefix'] or 'bench'}_{scheme_name}_{key_length}_"
+                                f"{operation.replace(PIPELINE_SEPARATOR, '-')}_{nb_data}bits_{workers}workers"
+                            )
+                            annotation_str = (
+                                f"Server Bench | "
+                                f"NB_RUNS={config['nb_runs']}, "
+                                f"WARMUP_RUNS={config['warmup_runs']}, "
+                                f"TARGET_CI={config['target_ci']}, "
+                                f"NB_DATA={config['nb_data']}, "
+                                f"KEY_LENGTH={config['key_length']}, "
+                                f"OPERATION={config['operation']}, "
+                                f"SCHEME={config['scheme']}, "
+                                f"PACKED={config['packed']}, "
+                                f"WIRE_FORMAT={config['wire_format']}, "
+                                f"WORKERS={config['workers']}, "
+                                f"TFHE_BATCH={config['tfhe_batch']}"
+                            )
+                            benchmarked_fn = profile_and_monitor(
+                                number=config['nb_runs'],
+                                folder_prefix=folder_prefix,
+                                annotation=annotation_str,
+                                metadata=dict(config, role="corpus"),
+                                warmup=config['warmup_runs'],
+                                target_ci=config['target_ci'] / 100,
+                                max_runs=config['max_runs']
+                            )(run_corpus_operations)
+
+                            pool = OperationPool(scheme_name, public_context, workers) if workers > 1 else None
+                            try:
+                                benchmarked_fn(scheme, config, corpus, public_context, pool=pool)
+                            finally:
+                                if pool is not None:
+                                    pool.shutdown()
+    write_speedup_report(args.folder_prefix or "bench")
+#!SECTION - END CORPUS
+
+#SECTION - CONFIGURATION
+def build_config(args, scheme_name, key_length, operation, nb_data, workers, public_context_bytes):
+    """Configuration of one combination of the sweep"""
+    return {
+        'nb_runs': args.nb_runs,
+        'warmup_runs': args.warmup_runs,
+        'target_ci': args.target_ci,
+        'max_runs': args.max_runs,
+        'nb_data': nb_data,
+        'key_length': key_length,
+        'operation': operation,
+        'nb_operations': args.nb_operations,
+        'folder_prefix': args.folder_prefix,
+        'scheme': scheme_name,
+        'packed': args.packed,
+        'wire_format': args.wire_format,
+        'workers': workers,
+        'decrypt_mode': args.decrypt_mode,
+        'key_profile': args.key_profile,
+        'public_context_bytes': public_context_bytes,
+        'tfhe_batch': args.tfhe_batch,
+        'stream_chunk': args.stream_chunk,
+        'stream_window': args.stream_window,
+        'generator_chunk': args.generator_chunk,
+        'compression': args.compression
+    }
+#!SECTION - END CONFIGURATION
+
 #SECTION - MAIN
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("--server", action='store_true', help="Run as server")
     parser.add_argument("--client", type=str, help="Run as client, specify server IP")
+    parser.add_argument("--build_corpus", type=str, default="",
+                        help="Encrypt the data once per scheme, key length and nb_data and write it with its public context to this directory")
+    parser.add_argument("--bench_corpus", type=str, default="",
+                        help="Benchmark deserialization, operations and serialization on the corpus of this directory, without client nor socket")
+    parser.add_argument("--load", type=int, default=0,
+                        help="With --client, simulate this many concurrent clients replaying pre-encrypted payloads, nb_runs requests per configuration (default: 0, disabled)")
+    parser.add_argument("--arrival", type=str, default="closed", choices=LOAD_ARRIVALS,
+                        help="Load generator arrivals: next request as soon as the previous answer is received, or Poisson at --rate per client. "
+                             "A session serves one request at a time, so Poisson arrivals have at most --load requests outstanding (default: closed)")
+    parser.add_argument("--rate", type=float, default=1.0,
+                        help="Load generator Poisson arrival rate of each simulated client, in requests per second, --load times it in total (default: 1.0)")
+    parser.add_argument("--async_server", action='store_true',
+                        help="With --server, serve many concurrent clients with asyncio, each in its own session")
+    parser.add_argument("--executor_workers", type=int, default=os.cpu_count(),
+                        help="Async server: threads evaluating the requests of all sessions (default: number of cores)")
+    parser.add_argument("--pool_workers", type=int, default=os.cpu_count(),
+                        help="Async server: workers of the --workers pools summed over all sessions, sessions wait for their share (default: number of cores)")
+    parser.add_argument("--max_sessions", type=int, default=0,
+                        help="Async server: stop after this many sessions (default: 0, serve forever)")
     parser.add_argument("--port", type=int, default=12345, help="Port to use for communication (default: 12345)")
     parser.add_argument("--operation", type=str, default="all",
-                        help="Operation(s): 'add', 'add_encrypted', 'mul', 'all' or comma-separated list.")
-    parser.add_argument("--nb_runs", type=int, default=2, help="Number of runs for the benchmark")
+                        help="Operation(s): 'add', 'add_encrypted', 'mul', 'all' or comma-separated list. "
+                             "A pipeline chains stages on the intermediate ciphertexts, e.g. 'mul_scalar->add_encrypted->mul_encrypted'")
+    parser.add_argument("--nb_runs", type=int, default=2, help="Number of runs for the benchmark, the minimum with --target_ci")
+    parser.add_argument("--warmup_runs", type=int, default=0,
+                        help="Runs done before the measured ones and left out of the aggregated results (default: 0)")
+    parser.add_argument("--target_ci", type=float, default=0,
+                        help="Keep running until the 95%% bootstrap CI of the execution time and of each phase duration is narrower "
+                             "than this percentage of the mean, the client decides for the server (default: 0, fixed --nb_runs)")
+    parser.add_argument("--max_runs", type=int, default=30,
+                        help="Maximum number of runs with --target_ci (default: 30)")
     parser.add_argument("--nb_data", type=str, default="1024",
                         help="Number of data elements (integer or comma-separated list of values to test)")
     parser.add_argument("--key_length", type=str, default="4096",
                         help="Key length in bits (integer or comma-separated list of values to test)")
     parser.add_argument("--nb_operations", type=int, default=16,
-                        help="Number of homomorphic operations to perform per run")
+                        help="Number of homomorphic operations to perform per run, pipelines are evaluated once")
     parser.add_argument("--folder_prefix", type=str, default="", help="Folder name for results")
     parser.add_argument("--scheme", type=str, default="paillier",
                         help="Homomorphic encryption scheme(s) to use (default: paillier). Can be a comma-separated list of schemes: paillier,bfv,ckks")
+    parser.add_argument("--packed", action='store_true',
+                        help="Pack the data into as few ciphertexts as the slot count allows (BFV, CKKS), "
+                             "or into array-backed ciphertext vectors with a shared exponent (Paillier)")
+    parser.add_argument("--paillier_threads", type=int, default=os.cpu_count(),
+                        help="Threads of the Paillier vector exponentiations sharing one exponent (obfuscators, scalar products), "
+                             "only used with gmpy2 >= 2.2 whose powmod_base_list releases the GIL (default: number of cores)")
+    parser.add_argument("--wire_format", type=str, default="json", choices=WIRE_FORMATS,
+                        help="Encoding of encrypted data on the wire: JSON+base64 or length-prefixed binary frames (default: json)")
+    parser.add_argument("--workers", type=str, default="1",
+                        help="Number of workers for client encryption/decryption and server evaluation (integer or comma-separated list of values to test)")
+    parser.add_argument("--decrypt_mode", type=str, default="single", choices=DECRYPT_MODES,
+                        help="Decrypt element by element, or the whole result list in one batched call (CRT for Paillier) (default: single)")
+    parser.add_argument("--obfuscator_pool", type=int, default=0,
+                        help="Number of precomputed Paillier obfuscators r^n kept ready for encryption (default: 0, disabled)")
+    parser.add_argument("--stream_chunk", type=int, default=0,
+                        help="Stream the data in chunks of this many elements, overlapping encryption, transfer, computation and decryption (default: 0, disabled)")
+    parser.add_argument("--stream_window", type=int, default=4,
+                        help="Maximum number of streamed chunks in flight, bounding the encrypted data held in memory (default: 4)")
+    parser.add_argument("--generator_chunk", type=int, default=0,
+                        help="Generate, encrypt, serialize and send the data as a generator of chunks of this many elements, "
+                             "bounding the client memory to one chunk, the server still computes over the whole data (default: 0, disabled)")
+    parser.add_argument("--tfhe_batch", type=int, default=1,
+                        help="Compile the TFHE circuits over tensors of this many elements, evaluated in one run per chunk (default: 1, scalar circuits)")
+    parser.add_argument("--key_profile", type=str, default="auto", choices=KEY_PROFILES,
+                        help="Evaluation keys of BFV/CKKS: only those the operations need, Galois keys on demand, or all of them upfront (default: auto)")
+    parser.add_argument("--context_cache", type=str, default="",
+                        help="Client: directory caching the generated keys and compiled circuits across runs, secret keys included (default: disabled). "
+                             "Server: directory keeping the public keys received with --context_handshake (default: context_cache)")
+    parser.add_argument("--context_cache_size", type=int, default=1024,
+                        help="Maximum size of the context cache in MB, least recently used contexts are evicted first (default: 1024)")
+    parser.add_argument("--context_handshake", action='store_true',
+                        help="Send a digest of the public key first, and the key itself only when the server does not hold it yet (client and server)")
+    parser.add_argument("--compression", type=str, default="none", choices=COMPRESSION_CODECS,
+                        help="Negotiate a compression codec for the messages of each connection, zstd and lz4 need their libraries, "
+                             "falling back to zlib. On the server any codec enables the negotiation (client and server) (default: none)")
+    parser.add_argument("--compression_level", type=int, default=None,
+                        help="Compression level of the codec (default: the default level of the codec)")
+    parser.add_argument("--no_plots", "--no-plots", action='store_true',
+                        help="Do not render the graphs at the end, the metrics store keeps what is needed to render them later")
+    parser.add_argument("--sample_interval", type=float, default=benchmark.STEP_SECOND * 1000,
+                        help=f"Interval of the resource sampler in milliseconds, sub-millisecond values are allowed (default: {benchmark.STEP_SECOND * 1000:g})")
+    parser.add_argument("--obfuscator_refill", type=str, default="idle", choices=OBFUSCATOR_REFILL_STRATEGIES,
+                        help="Refill the obfuscator pool only while idle on the network, or also in the background when it runs low (default: idle)")
 
     args = parser.parse_args()
+    PaillierVector.threads = args.paillier_threads
+    if args.target_ci > 0 and args.max_runs < args.nb_runs:
+        raise ValueError("--max_runs must be at least --nb_runs")
+    benchmark.STEP_SECOND = args.sample_interval / 1000
 
     # Parse schemes
     schemes_list = (
@@ -837,20 +3452,79 @@ if __name__ == '__main__':
     operations = args.operation.split(',') if ',' in args.operation else \
                 OPERATIONS_POSSIBLE if args.operation == 'all' else [args.operation]
 
+    # Aggregates cannot be streamed and TFHE only reduces tensors
+    if args.operation == 'all' and (args.stream_chunk > 0 or ("tfhe" in schemes_list and args.tfhe_batch < 2)):
+        operations = [operation for operation in operations if operation not in AGGREGATE_OPERATIONS]
+
+    # Validate operations and pipeline stages
+    for operation in operations:
+        operation_stages(operation)
+        if is_pipeline(operation) and "tfhe" in schemes_list:
+            raise ValueError("TFHE circuits are compiled per operation, pipelines are not supported")
+        if operation in AGGREGATE_OPERATIONS and "tfhe" in schemes_list and args.tfhe_batch < 2:
+            raise ValueError("TFHE reduction circuits are compiled over tensors, use --tfhe_batch")
+        if is_pipeline(operation) and "mean" in operation_stages(operation) and any(not SCHEMES[name].fractional_scalars for name in schemes_list):
+            # Integer schemes divide the mean after decryption, which only commutes with scalar products
+            stages = operation_stages(operation)
+            mean_index = stages.index("mean")
+            if any(stage in AGGREGATE_OPERATIONS for stage in stages[:mean_index]) or any(stage != "mul_scalar" for stage in stages[mean_index + 1:]):
+                raise ValueError(f"{operation}: integer schemes divide the mean after decryption, only mul_scalar stages may follow it and no aggregate may precede it")
+        if uses_operations(operation, AGGREGATE_OPERATIONS) and args.stream_chunk > 0:
+            raise ValueError("Aggregates reduce the whole data, they cannot be streamed in chunks")
+    if args.generator_chunk > 0 and args.stream_chunk > 0:
+        raise ValueError("--generator_chunk and --stream_chunk are exclusive, the streamed chunks are computed one at a time")
+
     # Parse number of data elements
     nb_data_list = (
         [int(x.strip()) for x in args.nb_data.split(',')] if ',' in args.nb_data
         else [int(args.nb_data)]
     )
 
+    # Values must stay below half the plaintext modulus, decrypted values are centered around zero
+    wrapping_operations = set()
+    for scheme_name, operation in itertools.product(schemes_list, operations):
+        plain_modulus = SCHEMES[scheme_name].plain_modulus
+        # Corpora are generated over the full range, whatever the operation
+        data_range = MINI_DATA_RANGE if operation == "dot_product" and not (args.build_corpus or args.bench_corpus) else DATA_RANGE
+        if plain_modulus and plain_value_bound(operation, max(nb_data_list), 4, data_range) >= plain_modulus // 2:
+            message = f"{operation} on {max(nb_data_list)} values would wrap around the plaintext modulus of {scheme_name} ({plain_modulus})"
+            if args.operation != 'all':
+                raise ValueError(f"{message}, use fewer values")
+            print(Fore.RED + f"! Skipping {message}" + Fore.RESET)
+            wrapping_operations.add(operation)
+    operations = [operation for operation in operations if operation not in wrapping_operations]
+
     # Parse key lengths
     key_length_list = (
         [int(x.strip()) for x in args.key_length.split(',')] if ',' in args.key_length
         else [int(args.key_length)]
     )
 
+    # Parse number of workers
+    workers_list = (
+        [int(x.strip()) for x in args.workers.split(',')] if ',' in args.workers
+        else [int(args.workers)]
+    )
+
+    # Corpus modes
+    if args.build_corpus:
+        context_store = ContentStore(args.context_cache, args.context_cache_size * 2**20) if args.context_cache else None
+        build_corpus(args, (schemes_list, key_length_list, operations, nb_data_list, workers_list), context_store)
+
+    elif args.bench_corpus:
+        bench_corpus(args, (schemes_list, key_length_list, operations, nb_data_list, workers_list))
+
     # Server mode
-    if args.server:
+    elif args.server and args.async_server:
+        if args.stream_chunk > 0 or args.generator_chunk > 0:
+            raise ValueError("The async server does not support --stream_chunk and --generator_chunk")
+        if max(workers_list) > args.pool_workers:
+            raise ValueError("--workers cannot exceed --pool_workers with the async server")
+        context_store = ContentStore(args.context_cache or "context_cache", args.context_cache_size * 2**20) if args.context_handshake else None
+        asyncio.run(run_async_server(args, (schemes_list, key_length_list, operations, nb_data_list, workers_list), context_store))
+
+    elif args.server:
+        context_store = ContentStore(args.context_cache or "context_cache", args.context_cache_size * 2**20) if args.context_handshake else None
         server_sock = create_socket()
         try:
             server_sock.bind(("0.0.0.0", args.port))
@@ -858,6 +3532,9 @@ if __name__ == '__main__':
             print(f"! Server listening on port {args.port}")
             sock, addr = server_sock.accept()
             print(f"! Server accepted connection from {addr}")
+            if args.compression != "none":
+                # The configurations record the codec both sides agreed on
+                args.compression = negotiate_compression_server(sock)
 
             for scheme_name in schemes_list:
                 scheme = SCHEMES[scheme_name]
@@ -865,23 +3542,16 @@ if __name__ == '__main__':
 
                     bool_contextGenerated = False
                     for operation in operations:
-                        if not bool_contextGenerated or scheme_name == "tfhe":
-                            public_context = receive_public_context(sock, scheme)
+                        if (not bool_contextGenerated or scheme_name == "tfhe"
+                                or (rotates_slots(operation, args.packed) and scheme.needs_galois_keys(public_context))):
+                            public_context, public_context_bytes = receive_public_context(sock, scheme, context_store)
                             bool_contextGenerated = True
 
                         # Single loop for all combinations
-                        for nb_data in nb_data_list:
+                        for nb_data, workers in itertools.product(nb_data_list, workers_list):
                             
                             reset_benchmark()
-                            config = {
-                                'nb_runs': args.nb_runs,
-                                'nb_data': nb_data,
-                                'key_length': key_length,
-                                'operation': operation,
-                                'nb_operations': args.nb_operations,
-                                'folder_prefix': args.folder_prefix,
-                                'scheme': scheme_name
-                            }
+                            config = build_config(args, scheme_name, key_length, operation, nb_data, workers, public_context_bytes)
 
                             print(Fore.YELLOW)
                             print("> Configuration:")
@@ -891,16 +3561,32 @@ if __name__ == '__main__':
 
                             server(sock, scheme, config, public_context)
 
+            write_speedup_report(args.folder_prefix)
             sock.close()
         finally:
             server_sock.close()
 
+    # Load generator mode
+    elif args.client and args.load > 0:
+        if args.stream_chunk > 0 or args.generator_chunk > 0:
+            raise ValueError("The load generator does not support --stream_chunk and --generator_chunk")
+        if args.target_ci > 0:
+            raise ValueError("The load generator replays a fixed number of runs, it does not support --target_ci")
+        context_store = ContentStore(args.context_cache, args.context_cache_size * 2**20) if args.context_cache else None
+        steps = prepare_load_steps(args, (schemes_list, key_length_list, operations, nb_data_list, workers_list), context_store)
+        print(f"! Starting {args.load} simulated clients against {args.client}:{args.port}")
+        write_load_report(args, asyncio.run(run_load(args, steps)))
+
     # Client mode
     elif args.client:
+        context_store = ContentStore(args.context_cache, args.context_cache_size * 2**20) if args.context_cache else None
         client_sock = create_socket()
         try:
             client_sock.connect((args.client, args.port))
             print(f"! Client connected to {args.client}:{args.port}")
+            if args.compression != "none":
+                # The configurations record the codec both sides agreed on
+                args.compression = negotiate_compression_client(client_sock, args.compression, args.compression_level)
 
             for scheme_name in schemes_list:
                 scheme = SCHEMES[scheme_name]
@@ -908,24 +3594,26 @@ if __name__ == '__main__':
 
                     bool_contextGenerated = False
                     for operation in operations:
-                        if not bool_contextGenerated or scheme_name == "tfhe":
-                            public_context, private_context = scheme.generate_contexts(key_length, operation=operation)
-                            send_public_context(client_sock, scheme, public_context)
+                        send_context = not bool_contextGenerated or scheme_name == "tfhe"
+                        if send_context:
+                            public_context, private_context = load_or_generate_contexts(
+                                scheme, key_length, operation, context_store, key_profile(operations, args.key_profile), args.tfhe_batch
+                            )
+                            if isinstance(scheme, PaillierScheme) and args.obfuscator_pool > 0:
+                                scheme.attach_obfuscator_pool(public_context, args.obfuscator_pool, refill=args.obfuscator_refill)
+                        if rotates_slots(operation, args.packed) and scheme.needs_galois_keys(public_context):
+                            # The server holds the public context without Galois keys, it is sent again
+                            scheme.generate_galois_keys(public_context, private_context)
+                            send_context = True
+                        if send_context:
+                            public_context_bytes = send_public_context(client_sock, scheme, public_context, handshake=args.context_handshake)
                             bool_contextGenerated = True
 
                         # Single loop for all combinations
-                        for nb_data in nb_data_list:
+                        for nb_data, workers in itertools.product(nb_data_list, workers_list):
                             
                             reset_benchmark()
-                            config = {
-                                'nb_runs': args.nb_runs,
-                                'nb_data': nb_data,
-                                'key_length': key_length,
-                                'operation': operation,
-                                'nb_operations': args.nb_operations,
-                                'folder_prefix': args.folder_prefix,
-                                'scheme': scheme_name
-                            }
+                            config = build_config(args, scheme_name, key_length, operation, nb_data, workers, public_context_bytes)
 
                             print(Fore.YELLOW)
                             print("> Configuration:")
@@ -940,4 +3628,8 @@ if __name__ == '__main__':
 
     else:
         print("Please specify either --server or --client <server_ip>. See --help.")
+
+    # Graphs are rendered once every measurement is over, they can also be rendered later with: python benchmark.py render
+    if not args.no_plots:
+        benchmark.render_pending()
 #!SECTION - END MAIN